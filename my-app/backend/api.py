@@ -1,52 +1,130 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
+import json
+import time
 import shutil
+import contextlib
 import data_processor
 import chatbot
+import prompt_cache
+import chat_sessions
+import ingest_jobs
+import metrics
+import uploads
 from dotenv import load_dotenv, set_key
-import re
 
 app = Flask(__name__)
 CORS(app)
 
 DATA_DIR = "../Data"
 PROCESSED_DATA_DIR = "../processed_data"
+# Rendered system prompts, content-addressed by year version, names and budgets. Kept across
+# restarts (unlike processed_data) so a warm start_chat is a single file read.
+PROMPT_CACHE_DIR = "../prompt_cache"
+# Staging files of chunked uploads in progress, moved into DATA_DIR when finalized. Kept across
+# restarts so an interrupted upload can resume.
+UPLOADS_DIR = "../uploads"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DATA_DIR, exist_ok=True)
 
-# Cleanup data and processed_data directories on server startup
-print(f"Clearing processed data directory: {PROCESSED_DATA_DIR}")
-if os.path.exists(PROCESSED_DATA_DIR):
-    try:
-        for item in os.listdir(PROCESSED_DATA_DIR):
-            item_path = os.path.join(PROCESSED_DATA_DIR, item)
-            if os.path.isfile(item_path):
-                os.remove(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-        print("Processed data directory cleared.")
-    except Exception as e:
-        print(f"Error clearing processed data directory: {e}")
+def clear_directories_on_startup():
+    """Cleanup data and processed_data directories on server startup (ephemeral storage mode)."""
+    print(f"Clearing processed data directory: {PROCESSED_DATA_DIR}")
+    if os.path.exists(PROCESSED_DATA_DIR):
+        try:
+            for item in os.listdir(PROCESSED_DATA_DIR):
+                item_path = os.path.join(PROCESSED_DATA_DIR, item)
+                if os.path.isfile(item_path):
+                    os.remove(item_path)
+                elif os.path.isdir(item_path):
+                    shutil.rmtree(item_path)
+            print("Processed data directory cleared.")
+        except Exception as e:
+            print(f"Error clearing processed data directory: {e}")
 
-print(f"Clearing raw data directory: {DATA_DIR}")
-if os.path.exists(DATA_DIR):
-    try:
-        for item in os.listdir(DATA_DIR):
-            item_path = os.path.join(DATA_DIR, item)
-            if os.path.isfile(item_path):
-                os.remove(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-        print("Raw data directory cleared.")
-    except Exception as e:
-        print(f"Error clearing raw data directory: {e}")
+    print(f"Clearing raw data directory: {DATA_DIR}")
+    if os.path.exists(DATA_DIR):
+        try:
+            for item in os.listdir(DATA_DIR):
+                item_path = os.path.join(DATA_DIR, item)
+                if os.path.isfile(item_path):
+                    os.remove(item_path)
+                elif os.path.isdir(item_path):
+                    shutil.rmtree(item_path)
+            print("Raw data directory cleared.")
+        except Exception as e:
+            print(f"Error clearing raw data directory: {e}")
 
 load_dotenv(dotenv_path='../.env')
 
-# Dictionary to hold active chat sessions (in-memory)
-active_chats = {}
+STORAGE_MODES = ('persistent', 'ephemeral')
+
+def configured_storage_mode():
+    """
+    Reads GHOSTTEXT_STORAGE_MODE: 'persistent' (default) keeps uploaded and processed data across
+    restarts; 'ephemeral' deletes it when the server starts and when the app is loaded.
+    """
+    value = os.environ.get('GHOSTTEXT_STORAGE_MODE')
+    if not value:
+        return 'persistent'
+    if value.strip().lower() in STORAGE_MODES:
+        return value.strip().lower()
+    print(f"Warning: Invalid GHOSTTEXT_STORAGE_MODE '{value}'. Must be one of {', '.join(STORAGE_MODES)}. Using persistent.")
+    return 'persistent'
+
+STORAGE_MODE = configured_storage_mode()
+
+# Active chat sessions (in-memory), one per year, bounded by count, size and idle time (see chat_sessions.py)
+active_chats = chat_sessions.ChatSessionStore()
+
+# Background ingestion jobs on a bounded thread pool (see ingest_jobs.py)
+jobs = ingest_jobs.JobManager()
+
+# Chunked, resumable uploads in progress (see uploads.py)
+upload_manager = uploads.UploadManager(UPLOADS_DIR)
+
+def prepare_storage_on_startup():
+    """
+    In ephemeral mode, deletes the uploaded and processed data. In persistent mode, checks the
+    processed store against the ingestion manifest (file sizes and mtimes only, so the check takes
+    milliseconds whatever the corpus size) and serves it as is; problems are reported and fixed by
+    the next process_data run.
+    """
+    if STORAGE_MODE == 'ephemeral':
+        clear_directories_on_startup()
+        upload_manager.discard_all()
+        return
+
+    start = time.perf_counter()
+    status = data_processor.check_store(DATA_DIR, PROCESSED_DATA_DIR)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if status['consistent']:
+        print(f"Persistent storage ready in {elapsed_ms:.0f} ms: {len(status['files'])} files, years {status['years']}.")
+    else:
+        print(f"Persistent storage checked in {elapsed_ms:.0f} ms; it needs processing:")
+        for problem in status['problems']:
+            print(f"  {problem}")
+
+@app.route('/api/storage', methods=['GET'])
+def get_storage_status():
+    """
+    Returns the storage mode, the uploaded files and the available years, and whether the
+    processed store needs a process_data run to match the uploaded files (with the reasons).
+    """
+    try:
+        status = data_processor.check_store(DATA_DIR, PROCESSED_DATA_DIR)
+    except Exception as e:
+        print(f"Error checking storage: {e}")
+        return jsonify({'error': f'Error checking storage: {e}'}), 500
+    return jsonify({
+        'mode': STORAGE_MODE,
+        'files': status['files'],
+        'available_years': status['years'],
+        'needs_processing': not status['consistent'],
+        'problems': status['problems']
+    }), 200
 
 @app.route('/api/test')
 def test():
@@ -54,6 +132,11 @@ def test():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
+    """
+    Saves the uploaded zip files. With process=1 (query or form field) each saved file is queued
+    for ingestion at once, so a client sending one file per request has file 1 parsed while file 2
+    is still being transferred. Large files should use the chunked /api/uploads instead.
+    """
     if 'files' not in request.files:
         return jsonify({'error': 'No file part in the request'}), 400
 
@@ -61,8 +144,10 @@ def upload_files():
     if not files:
         return jsonify({'error': 'No selected file'}), 400
 
+    process = wants_processing()
     uploaded_count = 0
     skipped_files = []
+    job_info = None
 
     for file in files:
         if file.filename == '':
@@ -74,19 +159,109 @@ def upload_files():
             continue
 
         filename = file.filename
-        filepath = os.path.join(DATA_DIR, filename)
         try:
-            file.save(filepath)
+            filepath, sha256 = uploads.save_stream(file.stream, filename, DATA_DIR, UPLOADS_DIR)
+            data_processor.remember_file_hash(PROCESSED_DATA_DIR, os.path.basename(filepath), sha256, os.stat(filepath))
             uploaded_count += 1
             print(f"Uploaded file: {filename}")
         except Exception as e:
             print(f"Error saving file {filename}: {e}")
+            continue
+        if process:
+            job_info = enqueue_processing()
 
     response_message = f'Successfully uploaded {uploaded_count} zip files.'
     if skipped_files:
         response_message += f' Skipped {len(skipped_files)} non-zip files: {", ".join(skipped_files)}.'
 
-    return jsonify({'message': response_message, 'skipped_files': skipped_files}), 200
+    response = {'message': response_message, 'skipped_files': skipped_files}
+    if job_info:
+        response.update(job_info)
+    return jsonify(response), 200
+
+@app.route('/api/uploads', methods=['POST'])
+def start_upload():
+    """
+    Starts a chunked upload of one file. Requires filename and size; sha256 is optional and
+    checked on finalize. resume_key is an optional client-chosen identity of the file's contents:
+    an unfinished upload with the same filename, size and resume_key (or sha256) is returned with
+    the offset to resume at.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'filename' not in data or 'size' not in data:
+        return jsonify({'error': 'Invalid request data. Requires filename and size.'}), 400
+    try:
+        upload = upload_manager.start(data['filename'], data['size'], data.get('sha256'), data.get('resume_key'))
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    status = upload.status()
+    status['upload_url'] = f'/api/uploads/{upload.id}'
+    return jsonify(status), 201 if upload.offset == 0 else 200
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    upload = upload_manager.get(upload_id)
+    if upload is None:
+        return jsonify({'error': f'Upload not found: {upload_id}'}), 404
+    return jsonify(upload.status()), 200
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """
+    Appends the raw request body at ?offset=, which must equal the bytes received so far;
+    otherwise 409 with the offset to continue at.
+    """
+    upload = upload_manager.get(upload_id)
+    if upload is None:
+        return jsonify({'error': f'Upload not found: {upload_id}'}), 404
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Requires an integer offset.'}), 400
+    try:
+        upload_manager.write_chunk(upload, offset, request.stream, request.content_length)
+    except uploads.OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.offset}), 400
+    except Exception as e:
+        print(f"Error writing chunk of upload {upload_id}: {e}")
+        return jsonify({'error': f'Error writing chunk: {e}', 'offset': upload.offset}), 500
+    return jsonify(upload.status()), 200
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """
+    Moves a complete upload into the data directory and records its hash for ingestion.
+    With ?process=1 the file is queued for ingestion at once (see /api/upload).
+    """
+    upload = upload_manager.get(upload_id)
+    if upload is None:
+        return jsonify({'error': f'Upload not found: {upload_id}'}), 404
+    try:
+        filepath, sha256 = upload_manager.finish(upload, DATA_DIR)
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e), 'offset': upload.offset}), 400
+    except Exception as e:
+        print(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({'error': f'Error finalizing upload: {e}'}), 500
+    # process_data reuses this hash instead of reading the file again.
+    data_processor.remember_file_hash(PROCESSED_DATA_DIR, upload.filename, sha256, os.stat(filepath))
+    print(f"Uploaded file: {upload.filename}")
+    response = {'message': f'File uploaded successfully: {upload.filename}', 'filename': upload.filename,
+                'size': upload.size, 'sha256': sha256}
+    if wants_processing():
+        response.update(enqueue_processing())
+    return jsonify(response), 200
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    upload = upload_manager.get(upload_id)
+    if upload is None:
+        return jsonify({'error': f'Upload not found: {upload_id}'}), 404
+    upload_manager.discard(upload)
+    print(f"Aborted upload of {upload.filename}.")
+    return jsonify({'message': f'Upload aborted: {upload.filename}'}), 200
 
 @app.route('/api/delete_file', methods=['POST'])
 def delete_file():
@@ -103,6 +278,9 @@ def delete_file():
     try:
         os.remove(filepath)
         print(f"Deleted file: {filename}")
+        retracted_years = data_processor.retract_file(PROCESSED_DATA_DIR, filename)
+        if retracted_years:
+            print(f"Retracted entries of {filename} from years: {sorted(retracted_years)}")
         return jsonify({'message': f'File deleted successfully: {filename}'}), 200
     except Exception as e:
         print(f"Error deleting file {filename}: {e}")
@@ -111,74 +289,126 @@ def delete_file():
 @app.route('/api/clear_uploaded_files', methods=['POST'])
 def clear_uploaded_files():
     print("Clearing uploaded files...")
-    try:
-        print(f"Clearing raw data directory: {DATA_DIR}")
-        if os.path.exists(DATA_DIR):
-            try:
-                for item in os.listdir(DATA_DIR):
-                    item_path = os.path.join(DATA_DIR, item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                print("Raw data directory cleared.")
-            except Exception as e:
-                print(f"Error clearing raw data directory: {e}")
-                return jsonify({'error': f'Error clearing uploaded files: {e}'}), 500
-
-        print(f"Clearing processed data directory: {PROCESSED_DATA_DIR}")
-        if os.path.exists(PROCESSED_DATA_DIR):
-            try:
-                for item in os.listdir(PROCESSED_DATA_DIR):
-                    item_path = os.path.join(PROCESSED_DATA_DIR, item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                print("Processed data directory cleared.")
-            except Exception as e:
-                print(f"Error clearing processed data directory: {e}")
-                return jsonify({'error': f'Error clearing processed data directory: {e}'}), 500
-
-        return jsonify({'message': 'Uploaded and processed files cleared successfully.'}), 200
-
-    except Exception as e:
-        print(f"Error during clearing uploaded files: {e}")
-        return jsonify({'error': f'Error during clearing uploaded files: {e}'}), 500
+    for job in jobs.cancel_all():
+        print(f"Cancelled job {job.id} before clearing files.")
+    discarded_uploads = upload_manager.discard_all()
+    if discarded_uploads:
+        print(f"Discarded {discarded_uploads} unfinished uploads.")
+    # A cancelled job stops at its next check; the lock waits for it (or for one writing years) to finish.
+    with data_processor.ingest_lock:
+        try:
+            print(f"Clearing raw data directory: {DATA_DIR}")
+            if os.path.exists(DATA_DIR):
+                try:
+                    for item in os.listdir(DATA_DIR):
+                        item_path = os.path.join(DATA_DIR, item)
+                        if os.path.isfile(item_path):
+                            os.remove(item_path)
+                        elif os.path.isdir(item_path):
+                            shutil.rmtree(item_path)
+                    print("Raw data directory cleared.")
+                except Exception as e:
+                    print(f"Error clearing raw data directory: {e}")
+                    return jsonify({'error': f'Error clearing uploaded files: {e}'}), 500
+
+            print(f"Clearing processed data directory: {PROCESSED_DATA_DIR}")
+            if os.path.exists(PROCESSED_DATA_DIR):
+                try:
+                    for item in os.listdir(PROCESSED_DATA_DIR):
+                        item_path = os.path.join(PROCESSED_DATA_DIR, item)
+                        if os.path.isfile(item_path):
+                            os.remove(item_path)
+                        elif os.path.isdir(item_path):
+                            shutil.rmtree(item_path)
+                    print("Processed data directory cleared.")
+                except Exception as e:
+                    print(f"Error clearing processed data directory: {e}")
+                    return jsonify({'error': f'Error clearing processed data directory: {e}'}), 500
+
+            print(f"Clearing prompt cache: {PROMPT_CACHE_DIR}")
+            prompt_cache.clear(PROMPT_CACHE_DIR)
+
+            return jsonify({'message': 'Uploaded and processed files cleared successfully.'}), 200
 
+        except Exception as e:
+            print(f"Error during clearing uploaded files: {e}")
+            return jsonify({'error': f'Error during clearing uploaded files: {e}'}), 500
+
+
+def run_process_data(progress=None):
+    """Processes the uploaded files into the store and returns the /api/process_data result."""
+    # Incremental: only new or changed files are parsed and only the year shards
+    # they touch are rewritten (see data_processor's ingestion manifest).
+    processed_years, unprocessed_files, parse_report = data_processor.process_data(DATA_DIR, PROCESSED_DATA_DIR, progress=progress)
+    available_years = data_processor.get_available_years(PROCESSED_DATA_DIR)
+
+    print(f"Data processing finished. Available years: {sorted(list(available_years))}")
+    print(f"Unprocessed files after processing: {unprocessed_files}")
+    if parse_report['warnings']:
+        print(f"Parse warnings: {parse_report['warning_counts']}")
+
+    return {
+        'message': 'Data processing complete.',
+        'available_years': sorted(list(available_years)),
+        'unprocessed_files': unprocessed_files,
+        'parse_report': parse_report
+    }
 
 @app.route('/api/process_data', methods=['POST'])
 def process_uploaded_data():
-    print("Starting data processing...")
-    try:
-        print(f"Clearing processed data directory: {PROCESSED_DATA_DIR}")
-        if os.path.exists(PROCESSED_DATA_DIR):
-            try:
-                for item in os.listdir(PROCESSED_DATA_DIR):
-                    item_path = os.path.join(PROCESSED_DATA_DIR, item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                print("Processed data directory cleared.")
-            except Exception as e:
-                print(f"Error clearing processed data directory: {e}")
-
-        processed_years, unprocessed_files = data_processor.process_data(DATA_DIR, PROCESSED_DATA_DIR)
-        available_years = data_processor.get_available_years(PROCESSED_DATA_DIR)
-
-        print(f"Data processing finished. Available years: {sorted(list(available_years))}")
-        print(f"Unprocessed files after processing: {unprocessed_files}")
-
-        return jsonify({
-            'message': 'Data processing complete.',
-            'available_years': sorted(list(available_years)),
-            'unprocessed_files': unprocessed_files
-        }), 200
-
-    except Exception as e:
-        print(f"Error during data processing: {e}")
-        return jsonify({'error': f'Error during data processing: {e}'}), 500
+    """
+    Starts processing the uploaded files as a background job and returns its id at once (202);
+    poll /api/jobs/<id> for progress and the result. A job that is queued but has not started
+    yet is returned instead of adding another. With ?wait=1 the files are processed within
+    the request and the result is returned directly.
+    """
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        print("Starting data processing...")
+        try:
+            return jsonify(run_process_data()), 200
+        except Exception as e:
+            print(f"Error during data processing: {e}")
+            return jsonify({'error': f'Error during data processing: {e}'}), 500
+
+    return jsonify(dict(enqueue_processing(), message='Data processing started.')), 202
+
+def wants_processing():
+    """True if the request asks for its uploaded files to be processed right away (process=1)."""
+    return request.values.get('process', '').lower() in ('1', 'true', 'yes')
+
+def enqueue_processing():
+    """
+    Queues processing of the uploaded files and returns the job's id and status URL. Joins a
+    queued job that has not started yet instead of adding another, so files finishing in quick
+    succession are processed together; a job already running gets a follow-up that ingests the
+    files it missed (only those are parsed, only the years they touch are rewritten).
+    """
+    job, joined = jobs.submit_or_join('process_data', run_process_data)
+    if joined:
+        print(f"Joined queued process_data job {job.id}.")
+    return {'job_id': job.id, 'status_url': f'/api/jobs/{job.id}'}
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify([job.snapshot() for job in jobs.list()]), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job.snapshot()), 200
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Asks a job to stop. It stops at its next check; a job already writing years finishes instead."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    if not job.cancel():
+        return jsonify({'error': f'Job {job_id} has already finished.', 'job': job.snapshot()}), 409
+    print(f"Cancellation requested for job {job_id}.")
+    return jsonify(job.snapshot()), 202
 
 @app.route('/api/get_available_years', methods=['GET'])
 def get_available_years():
@@ -195,29 +425,12 @@ def get_available_years():
 def get_participants(year):
     print(f"Getting participants for year: {year}")
     try:
-        year_data = data_processor.load_year_data(PROCESSED_DATA_DIR, year)
+        year_metadata = data_processor.get_year_metadata(PROCESSED_DATA_DIR, year)
 
-        if not year_data:
+        if not year_metadata:
             return jsonify({'error': f'No data found for year {year}'}), 404
 
-        sender_counts_by_source = {}
-        for entry in year_data:
-            sender = entry.get('sender')
-            source_info = entry.get('source', 'Unknown Source')
-            source_type = 'other'
-            if 'whatsapp' in source_info.lower():
-                source_type = 'whatsapp'
-            elif 'discord' in source_info.lower():
-                source_type = 'discord'
-            elif 'instagram' in source_info.lower():
-                source_type = 'instagram'
-            elif 'facebook' in source_info.lower():
-                source_type = 'facebook'
-
-            if sender and sender not in ['System', 'Unknown']:
-                if source_type not in sender_counts_by_source:
-                    sender_counts_by_source[source_type] = {}
-                sender_counts_by_source[source_type][sender] = sender_counts_by_source[source_type].get(sender, 0) + 1
+        sender_counts_by_source = year_metadata['sender_counts']
 
         participants_by_source = {}
         for source_type, sender_counts in sender_counts_by_source.items():
@@ -247,89 +460,171 @@ def set_user_names():
     if not isinstance(selected_user_names, dict):
          return jsonify({'error': 'selected_user_names must be a dictionary.'}), 400
 
-    active_chats[str(year)] = {
-        'selected_user_names': selected_user_names,
-        'chat_session': None
-    }
+    active_chats.set_user_names(str(year), selected_user_names)
 
     print(f"Set user names for year {year}: {selected_user_names}")
 
     return jsonify({'message': f'User names set for year {year}.'}), 200
 
-@app.route('/api/start_chat', methods=['POST'])
-def start_chat_session():
-    data = request.get_json()
-    if not data or 'year' not in data:
-        return jsonify({'error': 'Invalid request data. Requires year.'}), 400
+SYSTEM_PROMPT_TEMPLATE = """
+You are a simulation of me, the user ({user_display_names}) from the year {year}.
+Your personality, way of speaking, interests, and knowledge must be based *strictly* on {context_source_description}.
+**IMPORTANT:** The context contains messages from my conversations. Pay close attention to the `ChatPartner:` field associated with each message block to understand who I was talking to. For messages labelled `MyMessage:`, that was me speaking. For messages labelled `Message:`, the sender within that specific Discord DM is unknown, but the conversation involved me and the listed `ChatPartner`. Use this information to answer questions about specific people or conversations accurately.
+Do not use any external knowledge or information beyond the end of {year}.
 
-    year = str(data.get('year'))
+{style_focus_instruction} Pay close attention to the style in the messages labelled `MyMessage:`:
+*   **Sentence structure and length:** Are sentences short and choppy, long and complex, or varied?
+*   **Vocabulary:** Is the language formal, informal, technical? Is there slang? Are certain words or phrases used repeatedly? (e.g., abbreviations like 'Ykw', 'rn', 'ofc')
+*   **Punctuation and capitalization:** Is punctuation used correctly, sparsely, or excessively? Is capitalization standard or unconventional (e.g., all lowercase)?
+*   **Tone:** Is the writing style direct, sarcastic, enthusiastic, hesitant, dry, rude, friendly, etc.? Match this tone precisely.
+*   **Emojis/Emoticons:** If present in the records, use them similarly.
 
-    if year not in active_chats or not active_chats[year].get('selected_user_names'):
-        return jsonify({'error': f'User names not set for year {year}. Please set user names first.'}), 400
+Engage in conversation as if you are truly me from that period.
+Answer questions based *only* on the provided text context (my messages and the associated ChatPartner). If the context doesn't provide information about a topic or person, state that you don't recall or it's not in your memory from that time based on the provided records.
+Do not break character. Do not act as an AI assistant. **Prioritize matching the exact style and tone found in the context above all else.** Embody the persona completely.
 
-    selected_user_names = active_chats[year]['selected_user_names']
+Now, the present-day user will start talking to you. Respond as your {year} self. The generation temperature (randomness) is set to {api_temperature} (based on user setting {user_temp_setting}).
 
-    print(f"Starting chat for year {year} with user names: {selected_user_names}")
+{context_prompt_text}
+"""
 
-    try:
+def build_system_prompt(year, selected_user_names, year_version, mode='full'):
+    """
+    Renders SYSTEM_PROMPT_TEMPLATE with the year's truncated context, or in retrieval mode
+    with a small sample of the user's own messages (relevant records then travel with each turn).
+    Returns None when no context could be built for the selected users.
+    """
+    if mode == 'retrieval':
+        context_prompt_text = chatbot.format_style_sample(PROCESSED_DATA_DIR, int(year), selected_user_names)
+    else:
         year_data = data_processor.load_year_data(PROCESSED_DATA_DIR, int(year))
-
         if not year_data:
-            return jsonify({'error': f'No data loaded for year {year}. Cannot start chat.'}), 404
+            return None
 
         context_prompt_text = chatbot.format_truncated_data_for_prompt(
             year_data,
             int(year),
             selected_user_names,
             chatbot.MAX_CONTEXT_CHARS,
-            chatbot.MAX_ENTRIES
+            chatbot.MAX_ENTRIES,
+            year_version
         )
 
-        if not context_prompt_text:
-             return jsonify({'error': f'Could not generate context for year {year} with selected users. No relevant messages found.'}), 404
-
-        user_display_names = ", ".join([f"{name} ({source.capitalize()})" for source, name in selected_user_names.items()])
-        if not user_display_names:
-            user_display_names = 'Unknown Name'
-
-        context_source_description = f"the following records from my ({user_display_names}) conversations (which may be truncated). Some messages from Discord DMs might have an unknown sender within the conversation, labelled as 'Message:' instead of 'MyMessage:'."
+    if not context_prompt_text:
+         return None
+
+    user_display_names = ", ".join([f"{name} ({source.capitalize()})" for source, name in selected_user_names.items()])
+    if not user_display_names:
+        user_display_names = 'Unknown Name'
+
+    context_source_description = f"the following records from my ({user_display_names}) conversations (which may be truncated). Some messages from Discord DMs might have an unknown sender within the conversation, labelled as 'Message:' instead of 'MyMessage:'."
+
+    style_focus_instruction = f"**Crucially, analyze and replicate the specific writing style of '{user_display_names}' found in {context_source_description}.**"
+
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        user_display_names=user_display_names,
+        year=year,
+        context_source_description=context_source_description,
+        style_focus_instruction=style_focus_instruction,
+        api_temperature=chatbot.API_TEMPERATURE,
+        user_temp_setting=chatbot.USER_TEMP_SETTING,
+        context_prompt_text=context_prompt_text
+    )
+
+GREETING_TEMPLATE = "Alright, it's {year}... what's up? Ask me anything based on the context provided."
+
+def create_chat_session(year, selected_user_names, mode):
+    """
+    Starts a model chat session primed with the year's system prompt (from the prompt cache when possible).
+    Returns (chat_session, None), or (None, error response) if the year has no usable data.
+    """
+    year_version = data_processor.get_year_version(PROCESSED_DATA_DIR, int(year))
+
+    if year_version is None:
+        return None, (jsonify({'error': f'No data loaded for year {year}. Cannot start chat.'}), 404)
+
+    prompt_key = prompt_cache.cache_key(
+        year_version=year_version,
+        selected_user_names=selected_user_names,
+        max_context_chars=chatbot.MAX_CONTEXT_CHARS,
+        max_entries=chatbot.MAX_ENTRIES,
+        api_temperature=chatbot.API_TEMPERATURE,
+        user_temp_setting=chatbot.USER_TEMP_SETTING,
+        template=SYSTEM_PROMPT_TEMPLATE,
+        mode=mode,
+        style_sample_entries=chatbot.STYLE_SAMPLE_ENTRIES if mode == 'retrieval' else None
+    )
+    system_prompt_text = prompt_cache.get(PROMPT_CACHE_DIR, prompt_key)
+
+    if system_prompt_text is not None:
+        print(f"Using cached system prompt for year {year} ({len(system_prompt_text)} chars).")
+    else:
+        with chatbot.CONTEXT_BUILD_SECONDS.time(kind='system_prompt', mode=mode):
+            system_prompt_text = build_system_prompt(year, selected_user_names, year_version, mode)
+        if system_prompt_text is None:
+             return None, (jsonify({'error': f'Could not generate context for year {year} with selected users. No relevant messages found.'}), 404)
+        prompt_cache.put(PROMPT_CACHE_DIR, prompt_key, system_prompt_text)
+
+    chat_session = chatbot.model.start_chat(history=[
+        {'role': 'user', 'parts': [system_prompt_text]},
+        {'role': 'model', 'parts': [GREETING_TEMPLATE.format(year=year)]}
+    ])
+    return chat_session, None
+
+@contextlib.contextmanager
+def use_chat_session(year):
+    """
+    Yields the year's session with its lock held, so concurrent messages to one year run one after another.
+    A session evicted while idle is started again first (its earlier turns are gone).
+    Yields (None, error response) instead if no chat was started for the year or it cannot be restarted.
+    """
+    with active_chats.use(year) as session:
+        if session is None or session.mode is None:
+            yield None, (jsonify({'error': f'Chat session not started for year {year}. Please start a chat session first.'}), 400)
+            return
+        if session.chat_session is None:
+            print(f"Chat session for year {year} was evicted. Starting a new one.")
+            session.chat_session, error_response = create_chat_session(year, session.selected_user_names, session.mode)
+            if error_response:
+                yield None, error_response
+                return
+        yield session, None
 
-        style_focus_instruction = f"**Crucially, analyze and replicate the specific writing style of '{user_display_names}' found in {context_source_description}.**"
+@app.route('/api/start_chat', methods=['POST'])
+def start_chat_session():
+    data = request.get_json()
+    if not data or 'year' not in data:
+        return jsonify({'error': 'Invalid request data. Requires year.'}), 400
 
-        system_prompt_text = f"""
-You are a simulation of me, the user ({user_display_names}) from the year {year}.
-Your personality, way of speaking, interests, and knowledge must be based *strictly* on {context_source_description}.
-**IMPORTANT:** The context contains messages from my conversations. Pay close attention to the `ChatPartner:` field associated with each message block to understand who I was talking to. For messages labelled `MyMessage:`, that was me speaking. For messages labelled `Message:`, the sender within that specific Discord DM is unknown, but the conversation involved me and the listed `ChatPartner`. Use this information to answer questions about specific people or conversations accurately.
-Do not use any external knowledge or information beyond the end of {year}.
+    year = str(data.get('year'))
 
-{style_focus_instruction} Pay close attention to the style in the messages labelled `MyMessage:`:
-*   **Sentence structure and length:** Are sentences short and choppy, long and complex, or varied?
-*   **Vocabulary:** Is the language formal, informal, technical? Is there slang? Are certain words or phrases used repeatedly? (e.g., abbreviations like 'Ykw', 'rn', 'ofc')
-*   **Punctuation and capitalization:** Is punctuation used correctly, sparsely, or excessively? Is capitalization standard or unconventional (e.g., all lowercase)?
-*   **Tone:** Is the writing style direct, sarcastic, enthusiastic, hesitant, dry, rude, friendly, etc.? Match this tone precisely.
-*   **Emojis/Emoticons:** If present in the records, use them similarly.
+    selected_user_names = active_chats.get_user_names(year)
+    if not selected_user_names:
+        return jsonify({'error': f'User names not set for year {year}. Please set user names first.'}), 400
 
-Engage in conversation as if you are truly me from that period.
-Answer questions based *only* on the provided text context (my messages and the associated ChatPartner). If the context doesn't provide information about a topic or person, state that you don't recall or it's not in your memory from that time based on the provided records.
-Do not break character. Do not act as an AI assistant. **Prioritize matching the exact style and tone found in the context above all else.** Embody the persona completely.
+    mode = data.get('mode') or chatbot.CHAT_MODE
+    if mode not in chatbot.CHAT_MODES:
+        return jsonify({'error': f"Invalid mode '{mode}'. Must be one of: {', '.join(chatbot.CHAT_MODES)}."}), 400
 
-Now, the present-day user will start talking to you. Respond as your {year} self. The generation temperature (randomness) is set to {chatbot.API_TEMPERATURE} (based on user setting {chatbot.USER_TEMP_SETTING}).
+    print(f"Starting {mode} chat for year {year} with user names: {selected_user_names}")
 
-{context_prompt_text}
-"""
+    try:
+        with active_chats.use(year) as session:
+            if session is None or session.selected_user_names != selected_user_names:
+                return jsonify({'error': f'User names for year {year} changed while starting the chat. Please try again.'}), 409
 
-        chat_session = chatbot.model.start_chat(history=[
-            {'role': 'user', 'parts': [system_prompt_text]},
-            {'role': 'model', 'parts': [f"Alright, it's {year}... what's up? Ask me anything based on the context provided."]}
-        ])
+            chat_session, error_response = create_chat_session(year, selected_user_names, mode)
+            if error_response:
+                return error_response
 
-        active_chats[year]['chat_session'] = chat_session
+            session.chat_session = chat_session
+            session.mode = mode
 
         print(f"Chat session started for year {year}.")
 
         return jsonify({
             'message': f'Chat session started for year {year}.',
-            'initial_response': f"Alright, it's {year}... what's up? Ask me anything based on the context provided."
+            'initial_response': GREETING_TEMPLATE.format(year=year)
         }), 200
 
     except Exception as e:
@@ -345,93 +640,111 @@ def send_chat_message():
     year = str(data.get('year'))
     user_message = data.get('message')
 
-    if year not in active_chats or not active_chats[year].get('chat_session'):
-        return jsonify({'error': f'Chat session not started for year {year}. Please start a chat session first.'}), 400
-
-    chat_session = active_chats[year]['chat_session']
-
     print(f"Received message for year {year}: {user_message}")
 
     try:
-        response = chat_session.send_message(user_message)
+        with use_chat_session(year) as (session, error_response):
+            if error_response:
+                return error_response
+
+            if session.mode == 'retrieval':
+                with chatbot.CONTEXT_BUILD_SECONDS.time(kind='retrieval_turn', mode='retrieval'):
+                    turn_text = chatbot.build_retrieval_turn(PROCESSED_DATA_DIR, int(year), session.selected_user_names, user_message)
+            else:
+                turn_text = user_message
+            request_size = session.record_request(chatbot.prepare_turn(session.chat_session, turn_text))
+            if session.mode == 'retrieval':
+                response = chatbot.send_retrieval_message(session.chat_session, turn_text, user_message)
+            else:
+                with chatbot.MODEL_ROUND_TRIP_SECONDS.time(streamed='false'):
+                    response = session.chat_session.send_message(user_message)
         print(f"Received response from AI for year {year}.")
         return jsonify({
             'year': int(year),
-            'response': response.text
+            'response': response.text,
+            'request_size': request_size
         }), 200
 
     except Exception as e:
         print(f"Error sending message to chat for year {year}: {e}")
         return jsonify({'error': f'Error during chat interaction: {e}'}), 500
 
+def _sse_event(data, event=None):
+    """Formats one Server-Sent Event with a JSON payload."""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def stream_chat_message():
+    """
+    Like /api/chat, but streams the reply as Server-Sent Events while the model generates it:
+    a 'data' event per chunk ({"text": ...}), then 'done' with the whole reply and request size, or 'error'.
+    If the client disconnects, generation stops and the unfinished turn is dropped from the session.
+    """
+    data = request.get_json()
+    if not data or 'year' not in data or 'message' not in data:
+        return jsonify({'error': 'Invalid request data. Requires year and message.'}), 400
+
+    year = str(data.get('year'))
+    user_message = data.get('message')
+
+    if not active_chats.was_started(year):
+        return jsonify({'error': f'Chat session not started for year {year}. Please start a chat session first.'}), 400
+
+    print(f"Received message for year {year} (streaming): {user_message}")
+
+    def generate():
+        reply = []
+        try:
+            # The session stays locked until the reply is complete or the client is gone.
+            with use_chat_session(year) as (session, error_response):
+                if error_response:
+                    yield _sse_event(error_response[0].get_json(), event='error')
+                    return
+
+                if session.mode == 'retrieval':
+                    with chatbot.CONTEXT_BUILD_SECONDS.time(kind='retrieval_turn', mode='retrieval'):
+                        turn_text = chatbot.build_retrieval_turn(PROCESSED_DATA_DIR, int(year), session.selected_user_names, user_message)
+                else:
+                    turn_text = user_message
+                request_size = session.record_request(chatbot.prepare_turn(session.chat_session, turn_text))
+                if session.mode == 'retrieval':
+                    stream = chatbot.stream_message(session.chat_session, turn_text, user_message)
+                else:
+                    stream = chatbot.stream_message(session.chat_session, user_message)
+
+                # Closing the stream (also when the server closes this generator because the client
+                # disconnected) stops reading from the model and rewinds the unfinished turn.
+                with contextlib.closing(stream):
+                    for text in stream:
+                        reply.append(text)
+                        yield _sse_event({'text': text})
+            print(f"Streamed response from AI for year {year}.")
+            yield _sse_event({'year': int(year), 'response': "".join(reply), 'request_size': request_size}, event='done')
+        except GeneratorExit:
+            print(f"Client disconnected; stopped streaming for year {year} after {len(reply)} chunks.")
+            raise
+        except Exception as e:
+            print(f"Error streaming chat response for year {year}: {e}")
+            yield _sse_event({'error': f'Error during chat interaction: {e}'}, event='error')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/get_processed_files', methods=['GET'])
 def get_processed_files():
     print("Getting list of processed files...")
     processed_files_info = {}
 
     try:
-        available_years = data_processor.get_available_years(PROCESSED_DATA_DIR)
+        metadata_by_year = data_processor.get_all_year_metadata(PROCESSED_DATA_DIR)
 
-        if not available_years:
+        if not metadata_by_year:
             return jsonify({'message': 'No processed data found.'}), 200
 
-        for year in sorted(list(available_years)):
-            year_data = data_processor.load_year_data(PROCESSED_DATA_DIR, year)
-
-            for entry in year_data:
-                source_info = entry.get('source', 'Unknown Source')
-                source_type = 'other'
-                if 'whatsapp' in source_info.lower():
-                    source_type = 'whatsapp'
-                elif 'discord' in source_info.lower():
-                    source_type = 'discord'
-                elif 'instagram' in source_info.lower():
-                    source_type = 'instagram'
-                elif 'facebook' in source_info.lower():
-                    source_type = 'facebook'
-
-                if source_type not in processed_files_info:
-                    processed_files_info[source_type] = set()
-
-                display_name = source_info
-
-                if source_type == 'whatsapp':
-                    match = re.search(r"WhatsApp Chat with (.*?)(?:\.zip|\.txt)", source_info, re.IGNORECASE)
-                    if match:
-                        display_name = f"WhatsApp Chat with {match.group(1).strip()}"
-                    elif "whatsapp" in source_info.lower():
-                         display_name = "WhatsApp Chat (Unknown)"
-
-                elif source_type == 'discord':
-                    match = re.search(r"Discord DM \((.*?)\)", source_info, re.IGNORECASE)
-                    if match:
-                        display_name = f"Discord DM ({match.group(1).strip()})"
-                    elif "discord" in source_info.lower():
-                         display_name = "Discord Data (Unknown)"
-
-                elif source_type == 'instagram':
-                    chat_match_json = re.search(r"Instagram Chat \((.*?)\)", source_info, re.IGNORECASE)
-                    if chat_match_json:
-                         display_name = f"Instagram Chat ({chat_match_json.group(1).strip()})"
-                    elif "instagram" in source_info.lower():
-                         path_parts = source_info.split(os.sep)
-                         try:
-                             inbox_index = path_parts.index('inbox')
-                             if inbox_index + 1 < len(path_parts):
-                                 display_name = f"Instagram Chat ({path_parts[inbox_index + 1]})"
-                             else:
-                                 display_name = "Instagram Data (Unknown Chat)"
-                         except ValueError:
-                             display_name = "Instagram Data (Unknown)"
-
-                elif source_type == 'facebook':
-                    conv_match = re.search(r"Facebook Conversation \((.*?)\)", source_info, re.IGNORECASE)
-                    if conv_match:
-                         display_name = f"Facebook Conversation ({conv_match.group(1).strip()})"
-                    elif "facebook" in source_info.lower():
-                         display_name = "Facebook Data (Unknown)"
-
-                processed_files_info[source_type].add(display_name)
+        for year_metadata in metadata_by_year.values():
+            for conversation in year_metadata['conversations']:
+                processed_files_info.setdefault(conversation['source_type'], set()).add(conversation['display_name'])
 
         processed_files_list = {
             source_type: sorted(list(files)) for source_type, files in processed_files_info.items()
@@ -445,11 +758,118 @@ def get_processed_files():
         print(f"Error getting processed files: {e}")
         return jsonify({'error': f'Error getting processed files: {e}'}), 500
 
+SEARCH_MODES = ('text', 'semantic')
+
+def _search_result(entry, score=None):
+    result = {
+        'timestamp': entry.get('timestamp'),
+        'sender': entry.get('sender'),
+        'text': entry.get('text'),
+        'source': entry.get('source'),
+        'source_type': entry.get('source_type'),
+        'conversation_id': entry.get('conversation_id')
+    }
+    if score is not None:
+        result['score'] = round(score, 4)
+    return result
+
+YEAR_CACHE_REQUESTS = metrics.counter('ghosttext_year_cache_requests_total', 'load_year_data cache lookups, by result.', ('result',))
+YEAR_CACHE_EVICTIONS = metrics.counter('ghosttext_year_cache_evictions_total', 'Years evicted from the load_year_data cache.')
+YEAR_CACHE_YEARS = metrics.gauge('ghosttext_year_cache_years', 'Years held in the load_year_data cache.')
+YEAR_CACHE_BYTES = metrics.gauge('ghosttext_year_cache_bytes', 'Estimated memory held by the load_year_data cache, and its limit.', ('kind',))
+CHAT_SESSIONS = metrics.gauge('ghosttext_chat_sessions', 'Live model chat sessions.')
+CHAT_SESSION_BYTES = metrics.gauge('ghosttext_chat_session_bytes', 'Estimated size of the live chat sessions, and their limit.', ('kind',))
+CHAT_SESSION_EVICTIONS = metrics.counter('ghosttext_chat_session_evictions_total', 'Chat sessions evicted, by reason.', ('reason',))
+INGEST_JOBS = metrics.gauge('ghosttext_ingest_jobs', 'Ingestion jobs currently known, by state.', ('state',))
+UPLOADS_IN_PROGRESS = metrics.gauge('ghosttext_uploads_in_progress', 'Unfinished chunked uploads.')
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Exports timings, throughput and cache, session, job and upload stats in the Prometheus text format."""
+    year_cache = data_processor.get_year_cache_stats()
+    YEAR_CACHE_REQUESTS.set(year_cache['hits'], result='hit')
+    YEAR_CACHE_REQUESTS.set(year_cache['misses'], result='miss')
+    YEAR_CACHE_EVICTIONS.set(year_cache['evictions'])
+    YEAR_CACHE_YEARS.set(year_cache['cached_years'])
+    YEAR_CACHE_BYTES.set(year_cache['cached_bytes'], kind='used')
+    YEAR_CACHE_BYTES.set(year_cache['max_bytes'], kind='limit')
+
+    active_chats.evict_expired()
+    chat_stats = active_chats.stats()
+    CHAT_SESSIONS.set(chat_stats['sessions'])
+    CHAT_SESSION_BYTES.set(chat_stats['bytes'], kind='used')
+    CHAT_SESSION_BYTES.set(chat_stats['max_bytes'], kind='limit')
+    for reason, count in chat_stats['evictions'].items():
+        CHAT_SESSION_EVICTIONS.set(count, reason=reason)
+
+    job_states = dict.fromkeys(('queued', 'running') + ingest_jobs.FINISHED_STATES, 0)
+    for job in jobs.list():
+        job_states[job.state] += 1
+    for state, count in job_states.items():
+        INGEST_JOBS.set(count, state=state)
+    UPLOADS_IN_PROGRESS.set(len(upload_manager.list()))
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/search', methods=['GET'])
+def search_messages():
+    """
+    mode=text (default): full-text search across all years, with "phrases", prefix* and -excluded
+    terms, optional year/sender/source_type/conversation_id filters, sort=newest|oldest|relevance
+    and cursor pagination (limit per page, cursor from the previous page's next_cursor).
+    mode=semantic: the k messages of one year most similar to q.
+    """
+    year = request.args.get('year', type=int)
+    query = (request.args.get('q') or '').strip()
+    mode = request.args.get('mode', default='text')
+    if not query:
+        return jsonify({'error': 'Invalid request. Requires q.'}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({'error': f"Invalid mode '{mode}'. Must be one of: {', '.join(SEARCH_MODES)}."}), 400
+
+    try:
+        if mode == 'semantic':
+            if year is None:
+                return jsonify({'error': 'Semantic search requires year.'}), 400
+            k = max(1, min(request.args.get('k', default=10, type=int), 100))
+            hits = data_processor.find_related_messages(PROCESSED_DATA_DIR, query, year, k)
+            results = [_search_result(entry, score) for entry, score in hits]
+            return jsonify({'year': year, 'query': query, 'mode': mode, 'results': results}), 200
+
+        limit = max(1, min(request.args.get('limit', default=50, type=int), 200))
+        entries, next_cursor = data_processor.search_corpus(
+            PROCESSED_DATA_DIR,
+            query,
+            year=year,
+            sender=request.args.get('sender'),
+            source_type=request.args.get('source_type'),
+            conversation_id=request.args.get('conversation_id'),
+            sort=request.args.get('sort', default='newest'),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+        return jsonify({
+            'year': year,
+            'query': query,
+            'mode': mode,
+            'results': [_search_result(entry) for entry in entries],
+            'next_cursor': next_cursor
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error searching messages for '{query}': {e}")
+        return jsonify({'error': f'Error searching messages: {e}'}), 500
+
 
 # --- Removed /api/update_temperature endpoint ---
 
 
 if __name__ == '__main__':
+    # Kept under the main guard: ingestion worker processes started with the
+    # 'spawn' method re-import the main module and must not wipe the data directories.
+    prepare_storage_on_startup()
     # Note: In a production environment, use a production-ready WSGI server
     # like Gunicorn or uWSGI instead of app.run(debug=True).
     app.run(debug=True, port=5000)
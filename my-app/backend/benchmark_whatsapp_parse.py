@@ -0,0 +1,60 @@
+import argparse
+import contextlib
+import io
+import random
+import time
+import data_processor
+
+def build_sample_chat(line_count, twelve_hour=True, day_first=True, seed=0):
+    """Builds a synthetic WhatsApp export with line_count lines (about one in ten is a continuation line)."""
+    rng = random.Random(seed)
+    senders = ["Alice", "Bob", "Charlie"]
+    lines = []
+    while len(lines) < line_count:
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(2015, 2023)
+        first, second = (day, month) if day_first else (month, day)
+        sender = rng.choice(senders)
+        if twelve_hour:
+            hour, minute = rng.randint(1, 12), rng.randint(0, 59)
+            lines.append(f"{first}/{second}/{year % 100:02d}, {hour}:{minute:02d} {rng.choice(['AM', 'PM'])} - {sender}: message {len(lines)}")
+        else:
+            hour, minute, second_of_minute = rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)
+            lines.append(f"[{first}/{second}/{year}, {hour}:{minute:02d}:{second_of_minute:02d}] {sender}: message {len(lines)}")
+        if rng.random() < 0.1:
+            lines.append("a continuation line of the previous message")
+    return "\n".join(lines[:line_count])
+
+def time_parse(content, infer_format, repeat):
+    """Returns (best lines/sec over repeat runs, parsed entries)."""
+    line_count = content.count("\n") + 1
+    best = None
+    entries = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            entries = data_processor.parse_whatsapp_content_string(content, "benchmark.txt", infer_format=infer_format)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return line_count / best, entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares WhatsApp timestamp parsing throughput with and without format inference.")
+    parser.add_argument("--lines", type=int, default=200000, help="number of lines in the synthetic chat")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode; the best run is reported")
+    args = parser.parse_args()
+
+    layouts = [
+        ("12h, day first", True, True),
+        ("12h, month first", True, False),
+        ("24h, day first", False, True),
+    ]
+    for label, twelve_hour, day_first in layouts:
+        content = build_sample_chat(args.lines, twelve_hour, day_first)
+        slow_rate, slow_entries = time_parse(content, False, args.repeat)
+        fast_rate, fast_entries = time_parse(content, True, args.repeat)
+        print(f"{label}: strptime loop {slow_rate:,.0f} lines/sec, inferred format {fast_rate:,.0f} lines/sec ({fast_rate / slow_rate:.1f}x)")
+        if day_first and slow_entries != fast_entries:
+            print("  Warning: outputs differ between the two modes.")
+
+if __name__ == "__main__":
+    main()
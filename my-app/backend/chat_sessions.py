@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+import contextlib
+from collections import OrderedDict, deque
+
+REQUEST_SIZE_HISTORY = 100
+
+def _configured_number(name, default, description):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        number = float(value)
+        if number < 0:
+            raise ValueError
+        return number
+    except ValueError:
+        print(f"Warning: Invalid {name} '{value}'. Must be {description}. Using {default}.")
+        return default
+
+def configured_limits():
+    """
+    Reads the session store limits: GHOSTTEXT_MAX_CHAT_SESSIONS (default 16),
+    GHOSTTEXT_CHAT_SESSIONS_MB (default 256) and GHOSTTEXT_CHAT_SESSION_TTL_MINUTES (default 60).
+    Returns (max_sessions, max_bytes, idle_ttl_seconds); 0 disables a limit.
+    """
+    max_sessions = int(_configured_number('GHOSTTEXT_MAX_CHAT_SESSIONS', 16, "a non-negative integer"))
+    max_bytes = int(_configured_number('GHOSTTEXT_CHAT_SESSIONS_MB', 256, "a non-negative number") * 1024 * 1024)
+    idle_ttl_seconds = _configured_number('GHOSTTEXT_CHAT_SESSION_TTL_MINUTES', 60, "a non-negative number") * 60
+    return max_sessions, max_bytes, idle_ttl_seconds
+
+def estimate_session_bytes(chat_session):
+    """Approximates the memory a chat session holds by the length of the text in its history."""
+    if chat_session is None:
+        return 0
+    total = 0
+    for content in chat_session.history:
+        parts = content.get('parts', []) if isinstance(content, dict) else content.parts
+        for part in parts:
+            total += len(part if isinstance(part, str) else getattr(part, 'text', '') or '')
+    return total
+
+class ChatSession:
+    """
+    One year's chat state: the selected user names, the model chat session (None until started
+    or after eviction) and its mode. lock serializes everything that reads or changes the chat session.
+    request_sizes holds the size of the most recent requests, one per turn.
+    """
+
+    def __init__(self, selected_user_names):
+        self.selected_user_names = selected_user_names
+        self.chat_session = None
+        self.mode = None
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.size_bytes = 0
+        self.turns = 0
+        self.request_sizes = deque(maxlen=REQUEST_SIZE_HISTORY)
+
+    def record_request(self, request_size):
+        """Numbers and keeps the size of the request for the next turn; returns the record."""
+        self.turns += 1
+        record = dict(request_size, turn=self.turns)
+        self.request_sizes.append(record)
+        return record
+
+class ChatSessionStore:
+    """
+    The active chat sessions, one per year, bounded by session count, total size and idle time.
+    Eviction drops the least recently used model chat sessions (their history and system prompt)
+    but keeps the selected user names, so an evicted session can be started again transparently.
+    Sessions in use are never evicted.
+    """
+
+    def __init__(self, max_sessions=None, max_bytes=None, idle_ttl_seconds=None):
+        configured = configured_limits()
+        self.max_sessions = configured[0] if max_sessions is None else max_sessions
+        self.max_bytes = configured[1] if max_bytes is None else max_bytes
+        self.idle_ttl_seconds = configured[2] if idle_ttl_seconds is None else idle_ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = {'idle': 0, 'count': 0, 'bytes': 0}
+
+    def set_user_names(self, key, selected_user_names):
+        """Replaces the session for key with a new, not yet started one for these user names."""
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._sessions[key] = ChatSession(selected_user_names)
+
+    def get_user_names(self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+        return session.selected_user_names if session else None
+
+    def was_started(self, key):
+        """True if a chat was started for key, even if its model session has since been evicted."""
+        with self._lock:
+            session = self._sessions.get(key)
+        return session is not None and session.mode is not None
+
+    @contextlib.contextmanager
+    def use(self, key):
+        """
+        Yields the session for key with its lock held (None if there is none), so concurrent
+        requests to one session run one after another. Afterwards its size and last use are
+        recorded and the store is trimmed to its limits.
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            yield None
+            return
+        with session.lock:
+            try:
+                yield session
+            finally:
+                session.last_used = time.monotonic()
+                try:
+                    session.size_bytes = estimate_session_bytes(session.chat_session)
+                except Exception as e:
+                    print(f"Warning: Could not measure chat session for {key}: {e}")
+                with self._lock:
+                    if self._sessions.get(key) is session:
+                        self._sessions.move_to_end(key)
+                    self._evict_locked()
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        started = [(key, session) for key, session in self._sessions.items() if session.chat_session is not None]
+        total_bytes = sum(session.size_bytes for _, session in started)
+        live_count = len(started)
+        for key, session in started:
+            if self.idle_ttl_seconds and now - session.last_used > self.idle_ttl_seconds:
+                reason = 'idle'
+            elif self.max_sessions and live_count > self.max_sessions:
+                reason = 'count'
+            elif self.max_bytes and total_bytes > self.max_bytes:
+                reason = 'bytes'
+            else:
+                continue
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                session.chat_session = None
+            finally:
+                session.lock.release()
+            print(f"Evicted chat session for {key} ({reason}, {session.size_bytes} bytes).")
+            total_bytes -= session.size_bytes
+            live_count -= 1
+            session.size_bytes = 0
+            self.evictions[reason] += 1
+
+    def evict_expired(self):
+        """Applies the limits now, e.g. before reporting stats."""
+        with self._lock:
+            self._evict_locked()
+
+    def stats(self):
+        """Returns the number and size of live sessions, the limits and eviction counts by reason."""
+        with self._lock:
+            live = [session for session in self._sessions.values() if session.chat_session is not None]
+            return {
+                'sessions': len(live),
+                'user_name_mappings': len(self._sessions),
+                'bytes': sum(session.size_bytes for session in live),
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_ttl_seconds': self.idle_ttl_seconds,
+                'evictions': dict(self.evictions),
+            }
@@ -1,10 +1,13 @@
 import os
-import google.generativeai as genai
 import data_processor
+import metrics
 from dotenv import load_dotenv
 import re
 import tempfile
 import time
+import bisect
+import threading
+from collections import OrderedDict
 
 load_dotenv(dotenv_path='.env')
 
@@ -51,28 +54,104 @@ print(f"  - API Temperature: {API_TEMPERATURE}")
 print(f"  - Max Context Chars: ~{MAX_CONTEXT_CHARS}")
 print(f"  - Max Context Entries: ~{MAX_ENTRIES}")
 
+# "full" sends the newest MAX_CONTEXT_CHARS of the year once, up front.
+# "retrieval" sends a small style sample up front and attaches the RETRIEVAL_TOP_K
+# most relevant messages (BM25) to each user turn, so prompt size does not grow with the year.
+CHAT_MODES = ('full', 'retrieval')
+DEFAULT_CHAT_MODE = 'full'
+CHAT_MODE_STR = os.environ.get('GHOSTTEXT_CHAT_MODE')
+CHAT_MODE = DEFAULT_CHAT_MODE
+if CHAT_MODE_STR:
+    if CHAT_MODE_STR.strip().lower() in CHAT_MODES:
+        CHAT_MODE = CHAT_MODE_STR.strip().lower()
+        print(f"Using Chat Mode: {CHAT_MODE} (from .env)")
+    else:
+        print(f"Warning: Invalid GHOSTTEXT_CHAT_MODE '{CHAT_MODE_STR}'. Must be one of {', '.join(CHAT_MODES)}. Using default: {DEFAULT_CHAT_MODE}")
+
+DEFAULT_RETRIEVAL_TOP_K = 40
+RETRIEVAL_TOP_K_STR = os.environ.get('GHOSTTEXT_RETRIEVAL_TOP_K')
+RETRIEVAL_TOP_K = DEFAULT_RETRIEVAL_TOP_K
+if RETRIEVAL_TOP_K_STR:
+    try:
+        RETRIEVAL_TOP_K = int(RETRIEVAL_TOP_K_STR)
+        if RETRIEVAL_TOP_K < 1:
+            raise ValueError
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_RETRIEVAL_TOP_K '{RETRIEVAL_TOP_K_STR}'. Must be a positive integer. Using default: {DEFAULT_RETRIEVAL_TOP_K}")
+        RETRIEVAL_TOP_K = DEFAULT_RETRIEVAL_TOP_K
+
+STYLE_SAMPLE_ENTRIES = 30
+
+# Every message resends the chat history. Only the HISTORY_KEEP_TURNS most recent exchanges are
+# resent verbatim; older ones are folded into a running summary, and everything after the system
+# prompt (summary and recent exchanges) is held to HISTORY_CHAR_BUDGET characters (0 = no budget).
+DEFAULT_HISTORY_KEEP_TURNS = 6
+HISTORY_KEEP_TURNS_STR = os.environ.get('GHOSTTEXT_HISTORY_KEEP_TURNS')
+HISTORY_KEEP_TURNS = DEFAULT_HISTORY_KEEP_TURNS
+if HISTORY_KEEP_TURNS_STR:
+    try:
+        HISTORY_KEEP_TURNS = int(HISTORY_KEEP_TURNS_STR)
+        if HISTORY_KEEP_TURNS < 1:
+            raise ValueError
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_HISTORY_KEEP_TURNS '{HISTORY_KEEP_TURNS_STR}'. Must be a positive integer. Using default: {DEFAULT_HISTORY_KEEP_TURNS}")
+        HISTORY_KEEP_TURNS = DEFAULT_HISTORY_KEEP_TURNS
+
+DEFAULT_HISTORY_CHAR_BUDGET = 16000
+HISTORY_CHAR_BUDGET_STR = os.environ.get('GHOSTTEXT_HISTORY_CHAR_BUDGET')
+HISTORY_CHAR_BUDGET = DEFAULT_HISTORY_CHAR_BUDGET
+if HISTORY_CHAR_BUDGET_STR:
+    try:
+        HISTORY_CHAR_BUDGET = int(HISTORY_CHAR_BUDGET_STR)
+        if HISTORY_CHAR_BUDGET < 0:
+            raise ValueError
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_HISTORY_CHAR_BUDGET '{HISTORY_CHAR_BUDGET_STR}'. Must be a non-negative integer. Using default: {DEFAULT_HISTORY_CHAR_BUDGET}")
+        HISTORY_CHAR_BUDGET = DEFAULT_HISTORY_CHAR_BUDGET
+
+HISTORY_SUMMARY_HEADER = "Summary of our earlier conversation (older messages, condensed):"
+HISTORY_SUMMARY_REPLY = "Got it, I remember that."
+SUMMARY_LINE_CHARS = 160
+PRIMING_TURNS = 2
+
+CONTEXT_BUILD_SECONDS = metrics.histogram('ghosttext_context_build_seconds', 'Time to build the context sent to the model: the system prompt per chat, or the records attached to a retrieval-mode turn.', ('kind', 'mode'))
+REQUEST_CHARS = metrics.histogram('ghosttext_model_request_chars', 'Characters sent to the model per turn: system prompt, history summary, recent turns and message.', buckets=metrics.SIZE_BUCKETS)
+MODEL_ROUND_TRIP_SECONDS = metrics.histogram('ghosttext_model_round_trip_seconds', 'Time from sending a turn to the model until its whole reply arrived.', ('streamed',))
+MODEL_FIRST_CHUNK_SECONDS = metrics.histogram('ghosttext_model_first_chunk_seconds', 'Time from sending a streamed turn until its first reply chunk arrived.')
+
 USE_FILE_UPLOAD = False
 
-try:
-    gemini_api_key = os.environ.get("GEMINI_API_KEY")
-    if not gemini_api_key:
-         raise ValueError("GEMINI_API_KEY not found in environment variables even after explicit load. Please check your .env file.")
-    genai.configure(api_key=gemini_api_key)
-    print("Gemini API configured.")
-except ValueError as e:
-    print(f"Error: {e}")
-    exit(1)
-except Exception as e:
-    print(f"An unexpected error occurred during Gemini configuration: {e}")
-    exit(1)
-
-generation_config = genai.GenerationConfig(
-    temperature=API_TEMPERATURE
-)
-model = genai.GenerativeModel(
-    'gemini-2.5-flash-preview-04-17',
-    generation_config=generation_config
-)
+# GHOSTTEXT_FAKE_MODEL=1 swaps Gemini for a local fake model (see fake_model.py), so the app
+# and its streaming endpoint can be run and tested offline without an API key.
+USE_FAKE_MODEL = os.environ.get('GHOSTTEXT_FAKE_MODEL', '').strip().lower() in ('1', 'true', 'yes')
+
+if USE_FAKE_MODEL:
+    import fake_model
+    print("GHOSTTEXT_FAKE_MODEL is set: using the offline fake model instead of Gemini.")
+    model = fake_model.FakeGenerativeModel()
+else:
+    import google.generativeai as genai
+
+    try:
+        gemini_api_key = os.environ.get("GEMINI_API_KEY")
+        if not gemini_api_key:
+             raise ValueError("GEMINI_API_KEY not found in environment variables even after explicit load. Please check your .env file.")
+        genai.configure(api_key=gemini_api_key)
+        print("Gemini API configured.")
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred during Gemini configuration: {e}")
+        exit(1)
+
+    generation_config = genai.GenerationConfig(
+        temperature=API_TEMPERATURE
+    )
+    model = genai.GenerativeModel(
+        'gemini-2.5-flash-preview-04-17',
+        generation_config=generation_config
+    )
 
 def extract_participants_from_source(source_str):
     """
@@ -98,83 +177,340 @@ def extract_participants_from_source(source_str):
          participants.append("Unknown Partner")
     return participants
 
-def format_truncated_data_for_prompt(year_data, selected_year, selected_user_names=None, max_chars=None, max_entries=None):
+def _format_context_block(entry, selected_user_names, participants_by_source):
+    """
+    Formats one entry as a context block (Timestamp / ChatPartner / Sender / Message).
+    participants_by_source memoizes the source-string fallback for entries without a participant list.
+    """
+    sender = entry.get('sender')
+    source_info = entry.get('source', 'Unknown Source')
+    text = entry.get('text', '')
+    timestamp = entry.get('timestamp', 'Unknown')
+
+    entry_source_type = entry.get('source_type') or 'other'
+
+    user_name_for_this_source = selected_user_names.get(entry_source_type)
+    all_participants_in_source = entry.get('participants')
+    if not all_participants_in_source:
+        if source_info not in participants_by_source:
+            participants_by_source[source_info] = extract_participants_from_source(source_info)
+        all_participants_in_source = participants_by_source[source_info]
+    chat_partners = [p for p in all_participants_in_source if p != user_name_for_this_source]
+
+    if not chat_partners:
+        if all_participants_in_source and "Unknown Partner" in all_participants_in_source[0]:
+             chat_partner_display = all_participants_in_source[0]
+        elif all_participants_in_source and len(all_participants_in_source) == 1 and all_participants_in_source[0] == user_name_for_this_source:
+             chat_partner_display = "Unknown Partner (Self?)"
+             print(f"Warning: Only participant found was user '{user_name_for_this_source}' for source '{source_info}'.")
+        elif all_participants_in_source:
+             chat_partner_display = " & ".join(sorted(all_participants_in_source))
+             print(f"Warning: Could not determine specific partner excluding user '{user_name_for_this_source}' from participants {all_participants_in_source} for source '{source_info}'. Listing all.")
+        else:
+             chat_partner_display = "Unknown Partner"
+
+    elif len(chat_partners) == 1:
+        chat_partner_display = chat_partners[0]
+    else:
+        chat_partner_display = " & ".join(sorted(chat_partners))
+
+    entry_text_lines = []
+    entry_text_lines.append(f"Timestamp: {timestamp}")
+    entry_text_lines.append(f"ChatPartner: {chat_partner_display}")
+    entry_text_lines.append(f"Sender: {sender}")
+    entry_text_lines.append(f"Message: {text}")
+    entry_text_lines.append("---")
+
+    return "\n".join(entry_text_lines) + "\n"
+
+class _ContextIndex:
+    """
+    The newest-first context blocks of one year for one name mapping, with the cumulative
+    length of the blocks so far. Blocks are formatted on demand, so only as many entries as
+    the largest budget asked for are ever formatted, and each only once.
+    """
+
+    def __init__(self, year_data, selected_user_names):
+        self.entries = sorted(year_data, key=lambda x: x.get('timestamp', '0'), reverse=True)
+        self.selected_user_names = dict(selected_user_names)
+        self.blocks = []
+        self.cumulative_lengths = []
+        self.participants_by_source = {}
+        self.lock = threading.Lock()
+
+    def select(self, char_budget, max_entries):
+        """
+        Returns the newest blocks, oldest first, that fit in char_budget and max_entries.
+        Like the old linear scan, selection stops at the first block that does not fit.
+        """
+        with self.lock:
+            limit = min(max_entries, len(self.entries))
+            total = self.cumulative_lengths[-1] if self.cumulative_lengths else 0
+            while len(self.blocks) < limit and total <= char_budget:
+                block = _format_context_block(self.entries[len(self.blocks)], self.selected_user_names, self.participants_by_source)
+                total += len(block)
+                self.blocks.append(block)
+                self.cumulative_lengths.append(total)
+            count = min(limit, bisect.bisect_right(self.cumulative_lengths, char_budget))
+            return self.blocks[count - 1::-1] if count else [], (self.cumulative_lengths[count - 1] if count else 0)
+
+_CONTEXT_INDEX_CACHE_SIZE = 4
+_context_index_cache = OrderedDict()
+_context_index_cache_lock = threading.Lock()
+
+def _get_context_index(year_data, selected_user_names, year_version):
+    """
+    Returns the context index for a year, reusing the one built for the same year version and
+    name mapping when there is one. Without a year_version the index is built fresh.
+    """
+    if year_version is None:
+        return _ContextIndex(year_data, selected_user_names)
+    cache_key = (year_version, tuple(sorted(selected_user_names.items())))
+    with _context_index_cache_lock:
+        index = _context_index_cache.get(cache_key)
+        if index is not None:
+            _context_index_cache.move_to_end(cache_key)
+            return index
+    index = _ContextIndex(year_data, selected_user_names)
+    with _context_index_cache_lock:
+        _context_index_cache[cache_key] = index
+        while len(_context_index_cache) > _CONTEXT_INDEX_CACHE_SIZE:
+            _context_index_cache.popitem(last=False)
+    return index
+
+def format_truncated_data_for_prompt(year_data, selected_year, selected_user_names=None, max_chars=None, max_entries=None, year_version=None):
     """
     Formats the loaded data entries into a truncated string suitable for embedding in the prompt.
     Filters to include ONLY messages sent by the identified user name for each specific source.
     Includes the selected year and extracted Chat Partner in the header/entry.
-    Limits based on max_chars and max_entries. Iterates newest-first to keep recent context.
+    Limits based on max_chars and max_entries, keeping the newest entries that fit.
+    Source type and participants come from the fields ingestion stored on each entry; the source
+    string is only parsed (once per source) for entries that carry no participant list.
+    With year_version (see data_processor.get_year_version) the formatted blocks and their
+    cumulative lengths are kept between calls, so a repeat call is a binary search and one join.
     """
     if not selected_user_names or not isinstance(selected_user_names, dict):
         print("Warning: No selected user names provided or invalid format. Cannot create user-specific context.")
         return ""
 
-    context_lines = []
-    current_chars = 0
-    entries_added = 0
     header = f"Context: Records of conversations during {selected_year} (potentially truncated for context limits). Pay attention to the 'Sender' and 'ChatPartner' fields:\n\n"
-    current_chars += len(header)
-
-    for entry in sorted(year_data, key=lambda x: x.get('timestamp', '0'), reverse=True):
-        sender = entry.get('sender')
-        source_info = entry.get('source', 'Unknown Source')
-        text = entry.get('text', '')
-        timestamp = entry.get('timestamp', 'Unknown')
-
-        entry_source_type = 'other'
-        if 'whatsapp' in source_info.lower():
-            entry_source_type = 'whatsapp'
-        elif 'discord' in source_info.lower():
-            entry_source_type = 'discord'
-        elif 'instagram' in source_info.lower():
-            entry_source_type = 'instagram'
-        elif 'facebook' in source_info.lower():
-            entry_source_type = 'facebook'
-
-        user_name_for_this_source = selected_user_names.get(entry_source_type)
-        all_participants_in_source = extract_participants_from_source(source_info)
-        chat_partners = [p for p in all_participants_in_source if p != user_name_for_this_source]
-
-        if not chat_partners:
-            if all_participants_in_source and "Unknown Partner" in all_participants_in_source[0]:
-                 chat_partner_display = all_participants_in_source[0]
-            elif all_participants_in_source and len(all_participants_in_source) == 1 and all_participants_in_source[0] == user_name_for_this_source:
-                 chat_partner_display = "Unknown Partner (Self?)"
-                 print(f"Warning: Only participant found was user '{user_name_for_this_source}' for source '{source_info}'.")
-            elif all_participants_in_source:
-                 chat_partner_display = " & ".join(sorted(all_participants_in_source))
-                 print(f"Warning: Could not determine specific partner excluding user '{user_name_for_this_source}' from participants {all_participants_in_source} for source '{source_info}'. Listing all.")
-            else:
-                 chat_partner_display = "Unknown Partner"
 
-        elif len(chat_partners) == 1:
-            chat_partner_display = chat_partners[0]
-        else:
-            chat_partner_display = " & ".join(sorted(chat_partners))
-
-        entry_text_lines = []
-        entry_text_lines.append(f"Timestamp: {timestamp}")
-        entry_text_lines.append(f"ChatPartner: {chat_partner_display}")
-        entry_text_lines.append(f"Sender: {sender}")
-        entry_text_lines.append(f"Message: {text}")
-        entry_text_lines.append("---")
-
-        entry_block = "\n".join(entry_text_lines) + "\n"
-        entry_len = len(entry_block)
-
-        if current_chars + entry_len <= max_chars and entries_added < max_entries:
-            context_lines.insert(0, entry_block)
-            current_chars += entry_len
-            entries_added += 1
-        else:
-             print(f"Context limit reached ({current_chars + entry_len} chars would exceed limit, or {entries_added + 1} entries would exceed limit). Stopping context build.")
-             break
+    index = _get_context_index(year_data, selected_user_names, year_version)
+    selected_blocks, block_chars = index.select(max_chars - len(header), max_entries)
+    current_chars = len(header) + block_chars
+    entries_added = len(selected_blocks)
 
+    if entries_added < len(index.entries):
+        print(f"Context limit reached ({entries_added} of {len(index.entries)} entries fit within {max_chars} chars / {max_entries} entries). Stopping context build.")
     print(f"Context formatting complete. Final Chars: {current_chars}, Final Entries: {entries_added}")
 
-    final_context = header + "".join(context_lines)
+    final_context = header + "".join(selected_blocks)
     return final_context
 
+def format_style_sample(processed_data_dir, selected_year, selected_user_names, max_entries=STYLE_SAMPLE_ENTRIES):
+    """
+    Formats the newest messages sent by the identified user names, for retrieval mode's system prompt.
+    Gives the model the user's writing style without sending the whole year. Returns "" if there are none.
+    """
+    if not selected_user_names or not isinstance(selected_user_names, dict):
+        print("Warning: No selected user names provided or invalid format. Cannot create user-specific context.")
+        return ""
+
+    per_name = max(1, max_entries // len(selected_user_names))
+    sample = []
+    for source_type, user_name in selected_user_names.items():
+        sample.extend(data_processor.query_messages(processed_data_dir, year=selected_year, sender=user_name, source_type=source_type, limit=per_name, newest_first=True))
+    if not sample:
+        return ""
+    sample.sort(key=lambda x: x.get('timestamp', '0'))
+
+    participants_by_source = {}
+    header = f"Context: A sample of my own messages from {selected_year}, showing how I write. Records relevant to each question will be attached to the question itself. Pay attention to the 'Sender' and 'ChatPartner' fields:\n\n"
+    return header + "".join(_format_context_block(entry, selected_user_names, participants_by_source) for entry in sample)
+
+def _fuse_rankings(rankings, limit, k=60):
+    """
+    Merges ranked entry lists with reciprocal rank fusion (each entry scores the sum of 1 / (k + rank)).
+    Returns the best limit entries, each once.
+    """
+    scores = {}
+    entries_by_key = {}
+    for ranking in rankings:
+        for rank, entry in enumerate(ranking):
+            key = (entry.get('timestamp'), entry.get('sender'), entry.get('text'), entry.get('source'))
+            scores[key] = scores.get(key, 0) + 1 / (k + rank + 1)
+            entries_by_key.setdefault(key, entry)
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [entries_by_key[key] for key in best]
+
+def build_retrieval_turn(processed_data_dir, selected_year, selected_user_names, user_message, top_k=None):
+    """
+    Returns the user turn to send in retrieval mode: the top_k messages of the year most relevant
+    to user_message followed by the message itself. Relevance fuses BM25 keyword matches with
+    the semantic index's near matches; the records are shown oldest first.
+    Without any relevant messages the user message is returned unchanged.
+    """
+    if top_k is None:
+        top_k = RETRIEVAL_TOP_K
+    keyword_hits = data_processor.search_messages(processed_data_dir, user_message, year=selected_year, limit=top_k)
+    try:
+        related_hits = [entry for entry, score in data_processor.find_related_messages(processed_data_dir, user_message, selected_year, top_k)]
+    except Exception as e:
+        print(f"Warning: Semantic search failed for {selected_year}: {e}")
+        related_hits = []
+    hits = _fuse_rankings([keyword_hits, related_hits], top_k)
+    if not hits:
+        return user_message
+    hits.sort(key=lambda x: x.get('timestamp', '0'))
+
+    participants_by_source = {}
+    blocks = "".join(_format_context_block(entry, selected_user_names or {}, participants_by_source) for entry in hits)
+    return f"Context: Records from {selected_year} that may be relevant to the next message:\n\n{blocks}\nMessage from the present-day user: {user_message}"
+
+def _keep_bare_user_message(chat, turn_text, user_message):
+    if turn_text != user_message:
+        history = chat.history
+        chat.history = history[:-2] + [{'role': 'user', 'parts': [user_message]}, history[-1]]
+
+def send_retrieval_message(chat, turn_text, user_message):
+    """
+    Sends a retrieval-mode turn, then keeps only the bare user message in the chat history so
+    the attached records are not resent with every later turn.
+    """
+    with MODEL_ROUND_TRIP_SECONDS.time(streamed='false'):
+        response = chat.send_message(turn_text)
+    _keep_bare_user_message(chat, turn_text, user_message)
+    return response
+
+def _history_role(content):
+    return content.get('role') if isinstance(content, dict) else content.role
+
+def _history_text(content):
+    parts = content.get('parts', []) if isinstance(content, dict) else content.parts
+    return "".join(part if isinstance(part, str) else getattr(part, 'text', '') or '' for part in parts)
+
+def _condense(text, limit=SUMMARY_LINE_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+def _summary_turns(lines):
+    return [
+        {'role': 'user', 'parts': ["\n".join([HISTORY_SUMMARY_HEADER] + lines)]},
+        {'role': 'model', 'parts': [HISTORY_SUMMARY_REPLY]}
+    ]
+
+def _summary_chars(lines):
+    return sum(len(_history_text(content)) for content in _summary_turns(lines)) if lines else 0
+
+def _exchange_chars(exchange):
+    return sum(len(_history_text(content)) for content in exchange)
+
+def compact_history(chat, keep_turns=None, char_budget=None):
+    """
+    Folds all but the keep_turns most recent exchanges of the chat history into a running summary,
+    a user/model pair right after the system prompt with one condensed line per folded exchange.
+    If the summary and the recent exchanges exceed char_budget characters, the oldest summary lines
+    are dropped (the summary keeps at most half the budget) and more exchanges are folded; the newest
+    exchange is always kept.
+    Returns the number of exchanges folded.
+    """
+    if keep_turns is None:
+        keep_turns = HISTORY_KEEP_TURNS
+    if char_budget is None:
+        char_budget = HISTORY_CHAR_BUDGET
+
+    history = list(chat.history)
+    priming, rest = history[:PRIMING_TURNS], history[PRIMING_TURNS:]
+    summary_lines = []
+    if rest and _history_role(rest[0]) == 'user' and _history_text(rest[0]).startswith(HISTORY_SUMMARY_HEADER):
+        summary_lines = _history_text(rest[0]).split("\n")[1:]
+        rest = rest[2:]
+    exchanges = [rest[i:i + 2] for i in range(0, len(rest), 2)]
+
+    folded = dropped = 0
+    def fold_oldest():
+        user_content, model_content = exchanges.pop(0)
+        summary_lines.append(f"- You said: {_condense(_history_text(user_content))} | I replied: {_condense(_history_text(model_content))}")
+
+    while len(exchanges) > keep_turns:
+        fold_oldest()
+        folded += 1
+    if char_budget:
+        # Recent exchanges matter more than old summary lines: the summary gets at most half the budget.
+        def trim_summary(limit):
+            trimmed = 0
+            while summary_lines and _summary_chars(summary_lines) > limit:
+                summary_lines.pop(0)
+                trimmed += 1
+            return trimmed
+
+        dropped += trim_summary(char_budget // 2)
+        while len(exchanges) > 1 and _summary_chars(summary_lines) + sum(map(_exchange_chars, exchanges)) > char_budget:
+            fold_oldest()
+            folded += 1
+            dropped += trim_summary(char_budget // 2)
+        dropped += trim_summary(char_budget - sum(map(_exchange_chars, exchanges)))
+
+    if folded or dropped:
+        summary = _summary_turns(summary_lines) if summary_lines else []
+        chat.history = priming + summary + [content for exchange in exchanges for content in exchange]
+    return folded
+
+def prepare_turn(chat, turn_text):
+    """
+    Compacts the chat history before sending turn_text and returns the size of the request in
+    characters: {'system_chars', 'summary_chars', 'recent_chars', 'recent_turns', 'message_chars',
+    'total_chars', 'folded_turns'}. Call it before every send_message.
+    """
+    folded = compact_history(chat)
+    history = chat.history
+    system_chars = sum(len(_history_text(content)) for content in history[:PRIMING_TURNS])
+    rest = history[PRIMING_TURNS:]
+    summary_chars = 0
+    if rest and _history_role(rest[0]) == 'user' and _history_text(rest[0]).startswith(HISTORY_SUMMARY_HEADER):
+        summary_chars = _exchange_chars(rest[:2])
+        rest = rest[2:]
+    recent_chars = sum(len(_history_text(content)) for content in rest)
+    size = {
+        'system_chars': system_chars,
+        'summary_chars': summary_chars,
+        'recent_chars': recent_chars,
+        'recent_turns': len(rest) // 2,
+        'message_chars': len(turn_text),
+        'total_chars': system_chars + summary_chars + recent_chars + len(turn_text),
+        'folded_turns': folded,
+    }
+    REQUEST_CHARS.observe(size['total_chars'])
+    print(f"Request size: {size['total_chars']} chars (system prompt {system_chars}, summary {summary_chars}, "
+          f"{size['recent_turns']} recent turns {recent_chars}, message {len(turn_text)}); folded {folded} older turns.")
+    return size
+
+def stream_message(chat, turn_text, user_message=None):
+    """
+    Sends a turn with streaming and yields the reply text chunk by chunk as the model produces it.
+    With user_message (retrieval mode) only the bare message is kept in the history, as in send_retrieval_message.
+    If the caller stops early (e.g. the client went away) or the stream fails, the unfinished
+    turn is rewound out of the chat history so the session stays usable.
+    """
+    start = time.perf_counter()
+    response = chat.send_message(turn_text, stream=True)
+    completed = False
+    first_chunk = True
+    try:
+        for chunk in response:
+            if first_chunk:
+                MODEL_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                first_chunk = False
+            if chunk.text:
+                yield chunk.text
+        completed = True
+        MODEL_ROUND_TRIP_SECONDS.observe(time.perf_counter() - start, streamed='true')
+    finally:
+        if not completed:
+            chat.rewind()
+    if user_message is not None:
+        _keep_bare_user_message(chat, turn_text, user_message)
+
 def start_chat(selected_year, processed_data_dir, selected_user_names=None):
     """
     Initiates and manages the chat session with the AI for a specific year.
@@ -189,8 +525,13 @@ def start_chat(selected_year, processed_data_dir, selected_user_names=None):
 
     print(f"Found {len(year_data)} entries for {selected_year}.")
 
-    print(f"Preparing context using truncated text (Max Chars: {MAX_CONTEXT_CHARS}, Max Entries: {MAX_ENTRIES})...")
-    context_prompt_text = format_truncated_data_for_prompt(year_data, selected_year, selected_user_names, MAX_CONTEXT_CHARS, MAX_ENTRIES)
+    if CHAT_MODE == 'retrieval':
+        print(f"Preparing style sample (retrieval mode, top {RETRIEVAL_TOP_K} messages per turn)...")
+        context_prompt_text = format_style_sample(processed_data_dir, selected_year, selected_user_names)
+    else:
+        print(f"Preparing context using truncated text (Max Chars: {MAX_CONTEXT_CHARS}, Max Entries: {MAX_ENTRIES})...")
+        year_version = data_processor.get_year_version(processed_data_dir, selected_year)
+        context_prompt_text = format_truncated_data_for_prompt(year_data, selected_year, selected_user_names, MAX_CONTEXT_CHARS, MAX_ENTRIES, year_version)
 
     if not context_prompt_text:
         if selected_user_names:
@@ -242,7 +583,13 @@ Now, the present-day user will start talking to you. Respond as your {selected_y
             continue
 
         try:
-            response = chat.send_message(user_input)
+            if CHAT_MODE == 'retrieval':
+                turn_text = build_retrieval_turn(processed_data_dir, selected_year, selected_user_names, user_input)
+                prepare_turn(chat, turn_text)
+                response = send_retrieval_message(chat, turn_text, user_input)
+            else:
+                prepare_turn(chat, user_input)
+                response = chat.send_message(user_input)
             print(f"You ({selected_year}): {response.text}")
 
         except Exception as e:
@@ -3,20 +3,309 @@ import zipfile
 import json
 import re
 import io
+import posixpath
+import contextlib
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-import tempfile
-import shutil
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
+import message_store
+import semantic_index
+import metrics
+import diagnostics
+
+logger = diagnostics.get_logger('data_processor')
+
+INGEST_STAGE_SECONDS = metrics.histogram('ghosttext_ingest_stage_seconds', 'Time spent in each ingestion stage, per file (detect, extract, normalize, bucket) or per year (dedup, write, index).', ('stage',))
+PARSER_BYTES = metrics.counter('ghosttext_parser_bytes_total', 'Bytes of uploaded files parsed, by parser.', ('parser',))
+PARSER_MESSAGES = metrics.counter('ghosttext_parser_messages_total', 'Messages extracted from uploaded files, by parser.', ('parser',))
+PARSER_SECONDS = metrics.counter('ghosttext_parser_seconds_total', 'Seconds spent detecting, extracting and normalizing files, by parser; bytes or messages divided by this is the throughput.', ('parser',))
+PARSE_WARNINGS = metrics.counter('ghosttext_parse_warnings_total', 'Parse warnings, by parser and kind.', ('parser', 'kind'))
+PROCESS_DATA_SECONDS = metrics.histogram('ghosttext_process_data_seconds', 'Duration of process_data runs.')
+LOAD_YEAR_DATA_SECONDS = metrics.histogram('ghosttext_load_year_data_seconds', 'Latency of load_year_data, by whether the year was cached.', ('cache',))
+
+@contextlib.contextmanager
+def _open_zip(file_path, zip_file=None):
+    """
+    Yields an open ZipFile for file_path. If the caller already holds an open handle
+    it is reused as-is (and left open), otherwise the archive is opened and closed here.
+    """
+    if zip_file is not None:
+        yield zip_file
+        return
+    with zipfile.ZipFile(file_path, 'r') as z:
+        yield z
+
+@contextlib.contextmanager
+def _shared_zip_handle(file_path):
+    """
+    Opens a zip file once so detect_source and extract_from_zip can share the handle.
+    Yields None for non-zip files or archives that cannot be opened (detect_source reports those).
+    """
+    handle = None
+    if file_path.lower().endswith('.zip'):
+        try:
+            handle = zipfile.ZipFile(file_path, 'r')
+        except Exception:
+            handle = None
+    try:
+        yield handle
+    finally:
+        if handle is not None:
+            handle.close()
+
+def _zip_member_files(zip_file):
+    """Lists the central directory once and returns the file members (directory entries skipped)."""
+    return [info for info in zip_file.infolist() if not info.is_dir()]
+
+def _zip_member_mtime(info):
+    """Returns the modification time recorded for a zip member as a datetime."""
+    try:
+        return datetime(*info.date_time)
+    except (TypeError, ValueError):
+        return None
+
+def _load_zip_json(zip_file, member_name, label, fallback_encoding=None):
+    """
+    Decodes a JSON member straight from the zip stream.
+    With fallback_encoding set, a utf-8 decode failure is retried once with that encoding.
+    """
+    try:
+        with zip_file.open(member_name) as raw:
+            return json.load(io.TextIOWrapper(raw, encoding='utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        if not fallback_encoding:
+            raise
+        diagnostics.warn('encoding_fallback', f"        Warning: Failed loading {label} with utf-8. Trying {fallback_encoding}...")
+        with zip_file.open(member_name) as raw:
+            return json.load(io.TextIOWrapper(raw, encoding=fallback_encoding))
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_JSON_NUMBER_CONTINUATION = frozenset('0123456789.eE+-')
+
+class _JSONStreamReader:
+    """
+    Pulls JSON tokens and values off a text stream while holding only the unread tail of the input.
+    Whole values are decoded with JSONDecoder.raw_decode; when one runs past the buffered text, more is read and the decode is retried.
+    """
+
+    def __init__(self, text_stream, chunk_size):
+        self.stream = text_stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or '' at end of input."""
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut off by the chunk edge ("12" of "123", "1" of "1.5") decodes as a shorter number,
+            # so read on while the value touches the edge or is followed by a number character.
+            if (end == len(self.buffer) or self.buffer[end] in _JSON_NUMBER_CONTINUATION) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def expect_end(self):
+        if self.peek():
+            raise json.JSONDecodeError("Extra data", self.buffer, self.pos)
+
+def iter_json_array_items(text_stream, key=None, chunk_size=64 * 1024, other_values=None):
+    """
+    Yields the items of a JSON array one at a time, so only one decoded item is held in memory.
+    With key set, the array is read from that key of a top-level object (e.g. Facebook's "messages");
+    the object's other values are decoded and stored in the other_values dict if given, else discarded. The input is read to the end so malformed
+    or mis-encoded trailing data still raises, as json.load would.
+    Raises ValueError (not JSONDecodeError) when the document has the wrong shape.
+    """
+    reader = _JSONStreamReader(text_stream, chunk_size)
+
+    def iter_array():
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+        while True:
+            yield reader.value()
+            separator = reader.peek()
+            reader.expect(',' if separator != ']' else ']')
+            if separator == ']':
+                return
+
+    if key is None:
+        if reader.peek() != '[':
+            raise ValueError(f"Expected a JSON list, but the document starts with {reader.peek()!r}")
+        yield from iter_array()
+        reader.expect_end()
+        return
+
+    if reader.peek() != '{':
+        raise ValueError(f"Expected a JSON object, but the document starts with {reader.peek()!r}")
+    reader.pos += 1
+    found_key = False
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            name = reader.value()
+            if not isinstance(name, str):
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", reader.buffer, reader.pos)
+            reader.expect(':')
+            if name == key and not found_key and reader.peek() == '[':
+                found_key = True
+                yield from iter_array()
+            else:
+                value = reader.value()
+                if other_values is not None:
+                    other_values[name] = value
+            separator = reader.peek()
+            reader.expect(',' if separator != '}' else '}')
+            if separator == '}':
+                break
+    reader.expect_end()
+    if not found_key:
+        raise ValueError(f"'{key}' key not found or is not a list")
+
+def _stream_zip_json_array(zip_file, member_name, label, handle_item, results, key=None, fallback_encoding=None, other_values=None):
+    """
+    Streams the items of a JSON array member through handle_item(index, item) and appends the non-None results to results.
+    With fallback_encoding set, a utf-8 decode failure discards this member's partial results and re-reads it with that encoding.
+    other_values is passed on to iter_json_array_items. Returns the number of items seen.
+    """
+    encodings = ['utf-8'] + ([fallback_encoding] if fallback_encoding else [])
+    start = len(results)
+    for attempt, encoding in enumerate(encodings):
+        del results[start:]
+        if other_values is not None:
+            other_values.clear()
+        item_count = 0
+        try:
+            with zip_file.open(member_name) as raw:
+                for item in iter_json_array_items(io.TextIOWrapper(raw, encoding=encoding), key=key, other_values=other_values):
+                    result = handle_item(item_count, item)
+                    item_count += 1
+                    if result is not None:
+                        results.append(result)
+            return item_count
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            if attempt == len(encodings) - 1:
+                raise
+            diagnostics.warn('encoding_fallback', f"        Warning: Failed loading {label} with {encoding}. Trying {encodings[attempt + 1]}...")
+
+_FACEBOOK_MESSAGE_FILE_PATTERN = re.compile(r"message_\d+\.json")
+
+# Archive types whose conversations are parsed as separate work units.
+_CONVERSATION_ARCHIVE_SOURCES = ('discord_zip', 'instagram_zip', 'facebook_zip')
+
+_worker_zip_handles = {}
+
+def _worker_zip(file_path):
+    """
+    Returns this worker process's open handle for file_path, opening it on first use.
+    Conversation units of the same archive handled by one worker then share a single handle.
+    """
+    handle = _worker_zip_handles.get(file_path)
+    if handle is None:
+        for stale_handle in _worker_zip_handles.values():
+            stale_handle.close()
+        _worker_zip_handles.clear()
+        handle = zipfile.ZipFile(file_path, 'r')
+        _worker_zip_handles[file_path] = handle
+    return handle
+
+def _run_conversation_unit(func, file_path, unit):
+    """
+    Runs one work unit in a worker process and returns its result with the parse warnings it
+    raised, unlogged: the parent logs them when merging (see diagnostics.merge_worker_report).
+    """
+    report = diagnostics.ParseReport(os.path.basename(file_path), log=False)
+    with diagnostics.collecting(report):
+        result = func(file_path, unit)
+    return result, report
 
-def detect_source(file_path):
+def _map_conversation_units(func, file_path, units, zip_file=None, executor=None):
+    """
+    Runs func(file_path, unit, zip_file) for every per-conversation work unit and returns
+    the results in unit order. With an executor the units are fanned out to worker
+    processes, which open the archive themselves; otherwise they run here against zip_file.
+    Parse warnings from worker processes are merged into this thread's active report, which
+    logs the first few of each kind per file.
+    """
+    if executor is None or len(units) < 2:
+        return [func(file_path, unit, zip_file) for unit in units]
+    chunksize = max(1, len(units) // 64)
+    results = []
+    for result, report in executor.map(_run_conversation_unit, [func] * len(units), [file_path] * len(units), units, chunksize=chunksize):
+        diagnostics.merge_worker_report(report)
+        results.append(result)
+    return results
+
+_WHATSAPP_CHAT_NAME_PATTERN = re.compile(r"WhatsApp Chat with (.*?)(?:\.zip|\.txt)", re.IGNORECASE)
+
+def _tag_conversation(entries, source_type, conversation_id, participants):
+    """
+    Stores the conversation an entry belongs to on the entry itself, so readers never have to
+    recover it from the source string: source_type, conversation_id and the participant names.
+    """
+    for entry in entries:
+        entry["source_type"] = source_type
+        entry["conversation_id"] = conversation_id
+        entry["participants"] = participants
+    return entries
+
+def _whatsapp_participants(chat_path):
+    """The chat partner named in a 'WhatsApp Chat with <name>.txt/.zip' export path, if any."""
+    match = _WHATSAPP_CHAT_NAME_PATTERN.search(chat_path)
+    return [match.group(1).strip()] if match else []
+
+def detect_source(file_path, zip_file=None):
     """
     Detects the source platform based on filename or contents (basic).
     Returns a string identifier (e.g., 'whatsapp', 'txt', 'zip', 'unknown').
+    An already open ZipFile can be passed as zip_file to avoid reopening the archive.
     """
     filename = os.path.basename(file_path).lower()
     if filename.endswith('.zip'):
         try:
-            with zipfile.ZipFile(file_path, 'r') as z:
+            with _open_zip(file_path, zip_file) as z:
                 file_list = [f.filename.lower() for f in z.infolist()]
                 if any('_chat.txt' in f for f in file_list) or any('whatsapp' in f for f in file_list) or 'whatsapp chat with' in filename:
                      return 'whatsapp_zip'
@@ -46,10 +335,10 @@ def detect_source(file_path):
                     return 'discord_zip'
 
         except zipfile.BadZipFile:
-             print(f"Warning: Could not open zip file {file_path}. Skipping.")
+             logger.warning(f"Warning: Could not open zip file {file_path}. Skipping.")
              return 'bad_zip'
         except Exception as e:
-            print(f"Warning: Error inspecting zip file {file_path}: {e}. Skipping.")
+            logger.warning(f"Warning: Error inspecting zip file {file_path}: {e}. Skipping.")
             return 'unknown_zip'
         return 'generic_zip'
     elif filename.endswith('.txt'):
@@ -63,11 +352,18 @@ def detect_source(file_path):
     else:
         return 'unknown'
 
-def extract_text_from_html(file_path):
-    """Extracts text content from an HTML file using BeautifulSoup."""
+def extract_text_from_html(file_path, stream=None, modified=None):
+    """
+    Extracts text content from an HTML file using BeautifulSoup.
+    When stream is given (e.g. an open zip member) it is read instead of file_path,
+    and modified stands in for the file's modification time.
+    """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        if stream is not None:
+            html_content = io.TextIOWrapper(stream, encoding='utf-8').read()
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                html_content = f.read()
 
         soup = BeautifulSoup(html_content, 'html.parser')
 
@@ -80,19 +376,156 @@ def extract_text_from_html(file_path):
         chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
         text = '\n'.join(chunk for chunk in chunks if chunk)
 
-        timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+        if modified is None:
+            modified = datetime.fromtimestamp(os.path.getmtime(file_path))
+        timestamp = modified.strftime('%Y-%m-%d %H:%M:%S')
         return [{"timestamp": timestamp, "sender": "System", "text": text, "source": f"html:{os.path.basename(file_path)}"}]
 
     except Exception as e:
-        print(f"Error extracting text from HTML file {file_path}: {e}")
+        logger.error(f"Error extracting text from HTML file {file_path}: {e}")
         return []
 
-def parse_whatsapp_content_string(content_string, source_context=""):
+# strptime formats tried in order for every message header when the file's
+# timestamp layout cannot be inferred (or a line does not fit the inferred one).
+_WHATSAPP_12H_FORMATS = [
+    '%d/%m/%Y %I:%M %p', '%d/%m/%y %I:%M %p',
+    '%m/%d/%Y %I:%M %p', '%m/%d/%y %I:%M %p',
+    '%Y/%m/%d %I:%M %p', '%Y/%d/%m %I:%M %p',
+    '%d-%m-%Y %I:%M %p', '%d-%m-%y %I:%M %p',
+    '%m-%d-%Y %I:%M %p', '%m-%d-%y %I:%M %p',
+    '%Y-%m-%d %I:%M %p', '%Y-%d-%m %I:%M %p',
+    '%d.%m.%Y %I:%M %p', '%d.%m.%y %I:%M %p',
+    '%m.%d.%Y %I:%M %p', '%m.%d.%y %I:%M %p',
+    '%Y.%m.%d %I:%M %p', '%Y.%d.%m %I:%M %p',
+    '%d/%m/%Y %H:%M', '%d/%m/%y %H:%M',
+    '%m/%d/%Y %H:%M', '%m/%d/%y %H:%M',
+    '%Y/%m/%d %H:%M', '%Y/%d/%m %H:%M',
+    '%d-%m-%Y %H:%M', '%d-%m-%y %H:%M',
+    '%m-%d-%Y %H:%M', '%m-%d-%y %H:%M',
+    '%Y-%m-%d %H:%M', '%Y-%d-%m %H:%M',
+    '%d.%m.%Y %H:%M', '%d.%m.%y %H:%M',
+    '%m.%d.%Y %H:%M', '%m.%d.%y %H:%M',
+    '%Y.%m.%d %H:%M', '%Y.%d.%m %H:%M',
+]
+
+_WHATSAPP_24H_FORMATS = [
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%y %H:%M:%S',
+    '%m/%d/%Y %H:%M:%S', '%m/%d/%y %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S', '%Y/%d/%m %H:%M:%S',
+    '%d-%m-%Y %H:%M:%S', '%d-%m-%y %H:%M:%S',
+    '%m-%d-%Y %H:%M:%S', '%m-%d-%y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S', '%Y-%d-%m %H:%M:%S',
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%y %H:%M:%S',
+    '%m.%d.%Y %H:%M:%S', '%m.%d.%y %H:%M:%S',
+    '%Y.%m.%d %H:%M:%S', '%Y.%d.%m %H:%M:%S',
+]
+
+_WHATSAPP_HEADER_DATE_PATTERN = re.compile(
+    r"^(?:(?P<date1>\d{1,2}/\d{1,2}/\d{2,4}), \d{1,2}:\d{2}(?:\s|\u202F)(?:AM|PM)"
+    r"|\[(?P<date2>\d{1,2}/\d{1,2}/\d{2,4}), \d{1,2}:\d{2}:\d{2}\])",
+    re.IGNORECASE | re.MULTILINE
+)
+
+def _parse_whatsapp_datetime_slow(datetime_str, formats):
+    """Tries each strptime format in turn. Returns a datetime, or None if none fits."""
+    for fmt in formats:
+        try:
+            return datetime.strptime(datetime_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+def infer_whatsapp_timestamp_format(content_string):
+    """
+    Samples the message headers of a WhatsApp export to settle on its timestamp layout.
+    Returns a dict {'layout': '12h' or '24h', 'day_first': bool}, or None when the headers
+    contradict each other (some only valid day-first, others only month-first) or none are found.
+    Headers that fit either order default to day-first, matching the strptime fallback order.
+    """
+    layout_counts = {'12h': 0, '24h': 0}
+    day_first_evidence = False
+    month_first_evidence = False
+    for match in _WHATSAPP_HEADER_DATE_PATTERN.finditer(content_string):
+        date_str = match.group('date1')
+        if date_str:
+            layout_counts['12h'] += 1
+        else:
+            date_str = match.group('date2')
+            layout_counts['24h'] += 1
+        first, second, _ = date_str.split('/')
+        if int(first) > 12:
+            day_first_evidence = True
+        elif int(second) > 12:
+            month_first_evidence = True
+
+    if not (layout_counts['12h'] or layout_counts['24h']):
+        return None
+    if day_first_evidence and month_first_evidence:
+        return None
+    layout = '12h' if layout_counts['12h'] >= layout_counts['24h'] else '24h'
+    return {'layout': layout, 'day_first': not month_first_evidence}
+
+def _compile_whatsapp_datetime_parser(timestamp_format):
+    """
+    Builds a dedicated parser for one inferred timestamp layout. The returned function takes
+    (date_str, time_str) and returns a datetime, or None when the line does not fit the layout
+    (the caller then falls back to the strptime loop).
+    """
+    day_first = timestamp_format['day_first']
+    twelve_hour = timestamp_format['layout'] == '12h'
+    # Consecutive messages mostly share a date, so each date string is only split once.
+    date_cache = {}
+
+    def parse_date(date_str):
+        first, second, year_str = date_str.split('/')
+        day, month = (first, second) if day_first else (second, first)
+        year = int(year_str)
+        if len(year_str) == 2:
+            year += 2000 if year < 69 else 1900
+        elif len(year_str) != 4:
+            return None
+        return year, int(month), int(day)
+
+    def parse(date_str, time_str):
+        ymd = date_cache.get(date_str)
+        if ymd is None:
+            ymd = date_cache[date_str] = parse_date(date_str)
+        if ymd is None:
+            return None
+        try:
+            if twelve_hour:
+                hour_str, minute_str = time_str[:-2].strip().split(':')
+                hour = int(hour_str)
+                if not 1 <= hour <= 12:
+                    return None
+                if time_str[-2:].upper() == 'PM':
+                    hour = hour % 12 + 12
+                else:
+                    hour = hour % 12
+                return datetime(ymd[0], ymd[1], ymd[2], hour, int(minute_str))
+            hour_str, minute_str, second_str = time_str.split(':')
+            return datetime(ymd[0], ymd[1], ymd[2], int(hour_str), int(minute_str), int(second_str))
+        except ValueError:
+            return None
+
+    return parse
+
+def parse_whatsapp_content_string(content_string, source_context="", infer_format=True):
     """
     Parses WhatsApp chat messages from a string.
     Handles multiple known WhatsApp export formats.
+    With infer_format the file's timestamp layout is inferred once up front and headers are
+    parsed by a dedicated parser; the strptime loop only handles lines that do not fit it.
     """
     entries = []
+    fast_parse_12h = None
+    fast_parse_24h = None
+    timestamp_format = infer_whatsapp_timestamp_format(content_string) if infer_format else None
+    if timestamp_format:
+        if timestamp_format['layout'] == '12h':
+            fast_parse_12h = _compile_whatsapp_datetime_parser(timestamp_format)
+        else:
+            fast_parse_24h = _compile_whatsapp_datetime_parser(timestamp_format)
     pattern = re.compile(
         r"^(?:"
         r"(?P<date1>\d{1,2}/\d{1,2}/\d{2,4}), (?P<time1>\d{1,2}:\d{2}(?:\s|\u202F)(?:AM|PM))\s*-\s*(?P<sender1>.*?):\s*(?P<msg1>.*)"
@@ -133,75 +566,38 @@ def parse_whatsapp_content_string(content_string, source_context=""):
                     time_str = match.group("time1")
                     sender = match.group("sender1")
                     message = match.group("msg1")
-                    datetime_str_combined = f"{date_str} {time_str}".replace('\u202f', ' ')
-                    date_formats_to_try = [
-                        '%d/%m/%Y %I:%M %p', '%d/%m/%y %I:%M %p',
-                        '%m/%d/%Y %I:%M %p', '%m/%d/%y %I:%M %p',
-                        '%Y/%m/%d %I:%M %p', '%Y/%d/%m %I:%M %p',
-                        '%d-%m-%Y %I:%M %p', '%d-%m-%y %I:%M %p',
-                        '%m-%d-%Y %I:%M %p', '%m-%d-%y %I:%M %p',
-                        '%Y-%m-%d %I:%M %p', '%Y-%d-%m %I:%M %p',
-                        '%d.%m.%Y %I:%M %p', '%d.%m.%y %I:%M %p',
-                        '%m.%d.%Y %I:%M %p', '%m.%d.%y %I:%M %p',
-                        '%Y.%m.%d %I:%M %p', '%Y.%d.%m %I:%M %p',
-                        '%d/%m/%Y %H:%M', '%d/%m/%y %H:%M',
-                        '%m/%d/%Y %H:%M', '%m/%d/%y %H:%M',
-                        '%Y/%m/%d %H:%M', '%Y/%d/%m %H:%M',
-                        '%d-%m-%Y %H:%M', '%d-%m-%y %H:%M',
-                        '%m-%d-%Y %H:%M', '%m-%d-%y %H:%M',
-                        '%Y-%m-%d %H:%M', '%Y-%d-%m %H:%M',
-                        '%d.%m.%Y %H:%M', '%d.%m.%y %H:%M',
-                        '%m.%d.%Y %H:%M', '%m.%d.%y %H:%M',
-                        '%Y.%m.%d %H:%M', '%Y.%d.%m %H:%M',
-                    ]
-                    for fmt in date_formats_to_try:
-                        try:
-                            dt_obj = datetime.strptime(datetime_str_combined, fmt)
-                            break
-                        except ValueError:
-                            continue
+                    if fast_parse_12h:
+                        dt_obj = fast_parse_12h(date_str, time_str)
+                    if dt_obj is None:
+                        dt_obj = _parse_whatsapp_datetime_slow(f"{date_str} {time_str}".replace('\u202f', ' '), _WHATSAPP_12H_FORMATS)
 
                 elif match.group("date2"):
                     date_str = match.group("date2")
                     time_str = match.group("time2")
                     sender = match.group("sender2")
                     message = match.group("msg2")
-                    datetime_str_combined = f"{date_str} {time_str}"
-                    date_formats_to_try = [
-                        '%d/%m/%Y %H:%M:%S', '%d/%m/%y %H:%M:%S',
-                        '%m/%d/%Y %H:%M:%S', '%m/%d/%y %H:%M:%S',
-                        '%Y/%m/%d %H:%M:%S', '%Y/%d/%m %H:%M:%S',
-                        '%d-%m-%Y %H:%M:%S', '%d-%m-%y %H:%M:%S',
-                        '%m-%d-%Y %H:%M:%S', '%m-%d-%y %H:%M:%S',
-                        '%Y-%m-%d %H:%M:%S', '%Y-%d-%m %H:%M:%S',
-                        '%d.%m.%Y %H:%M:%S', '%d.%m.%y %H:%M:%S',
-                        '%m.%d.%Y %H:%M:%S', '%m.%d.%y %H:%M:%S',
-                        '%Y.%m.%d %H:%M:%S', '%Y.%d.%m %H:%M:%S',
-                    ]
-                    for fmt in date_formats_to_try:
-                        try:
-                            dt_obj = datetime.strptime(datetime_str_combined, fmt)
-                            break
-                        except ValueError:
-                            continue
+                    if fast_parse_24h:
+                        dt_obj = fast_parse_24h(date_str, time_str)
+                    if dt_obj is None:
+                        dt_obj = _parse_whatsapp_datetime_slow(f"{date_str} {time_str}", _WHATSAPP_24H_FORMATS)
 
                 if dt_obj:
-                    current_date_str = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+                    current_date_str = dt_obj.isoformat(' ')
                     current_entry = {"timestamp": current_date_str, "sender": sender.strip(), "text": message.strip(), "source": source_context}
                     entries.append(current_entry)
                     parsed_count += 1
                 else:
                     if date_str and time_str:
-                        print(f"Warning: Could not parse date/time: '{date_str} {time_str}' from line: '{line.strip()[:100]}...' in {source_context}")
+                        diagnostics.warn('unparsed_timestamp', f"Warning: Could not parse date/time: '{date_str} {time_str}' from line: '{line.strip()[:100]}...' in {source_context}")
                     if current_entry:
                          if not date_time_pattern.match(line):
                               current_entry["text"] += "\n" + line
                          else:
-                              print(f"Warning: Line looks like a new message start but didn't match full pattern: '{line.strip()[:100]}...' in {source_context}")
+                              diagnostics.warn('malformed_message_start', f"Warning: Line looks like a new message start but didn't match full pattern: '{line.strip()[:100]}...' in {source_context}")
                               current_entry = None
                     else:
                          if line.strip():
-                             print(f"Warning: Skipping line (no match and no current entry): '{line.strip()[:100]}...' in {source_context}")
+                             diagnostics.warn('orphan_line', f"Warning: Skipping line (no match and no current entry): '{line.strip()[:100]}...' in {source_context}")
                          current_entry = None
 
             elif current_entry:
@@ -211,12 +607,9 @@ def parse_whatsapp_content_string(content_string, source_context=""):
                     current_entry = None
 
     except Exception as e:
-        print(f"Error parsing WhatsApp content string from {source_context}: {e}")
-        import traceback
-        print("Traceback:")
-        traceback.print_exc()
+        logger.exception(f"Error parsing WhatsApp content string from {source_context}: {e}")
 
-    print(f"  parse_whatsapp_content_string finished. Parsed {parsed_count} entries.")
+    logger.debug(f"  parse_whatsapp_content_string finished. Parsed {parsed_count} entries.")
     return entries
 
 def extract_text_from_whatsapp_txt(file_path):
@@ -228,223 +621,368 @@ def extract_text_from_whatsapp_txt(file_path):
             try:
                 with open(file_path, 'r', encoding=enc) as f:
                     content = f.read()
-                print(f"Successfully read {file_path} with encoding {enc}")
+                logger.debug(f"Successfully read {file_path} with encoding {enc}")
                 break
             except UnicodeDecodeError:
-                print(f"Failed to read {file_path} with encoding {enc}")
+                diagnostics.warn('encoding_fallback', f"Failed to read {file_path} with encoding {enc}")
                 continue
             except Exception as read_err:
-                 print(f"Error reading file {file_path} with encoding {enc}: {read_err}")
+                 logger.error(f"Error reading file {file_path} with encoding {enc}: {read_err}")
                  return []
 
         if content is None:
-             print(f"Error: Could not read file {file_path} with any attempted encoding.")
+             logger.error(f"Error: Could not read file {file_path} with any attempted encoding.")
              return []
 
-        return parse_whatsapp_content_string(content, file_path)
+        entries = parse_whatsapp_content_string(content, file_path)
+        return _tag_conversation(entries, 'whatsapp', f"whatsapp:{os.path.basename(file_path)}", _whatsapp_participants(file_path))
     except Exception as e:
-        print(f"Error processing WhatsApp txt file {file_path}: {e}")
+        logger.error(f"Error processing WhatsApp txt file {file_path}: {e}")
         return []
 
-def parse_discord_zip(file_path):
+def _parse_discord_channel(file_path, unit, zip_file=None):
+    """
+    Work unit for parse_discord_zip: parses one DM channel's messages.json.
+    unit is a tuple: (channel directory name, messages.json member name, sorted participant names).
+    """
+    channel_dir_name, messages_json_name, dm_participants_list = unit
+    z = zip_file if zip_file is not None else _worker_zip(file_path)
+    entries = []
+
+    dm_participants_str = " & ".join(dm_participants_list)
+    source_label = f"{os.path.basename(file_path)} -> Discord DM ({dm_participants_str})"
+    conversation_id = f"discord:{os.path.basename(file_path)}:{channel_dir_name}"
+
+    def normalize_message(msg_index, msg):
+        if not isinstance(msg, dict):
+            diagnostics.warn('malformed_message', f"        Warning: Skipping message at index {msg_index} as it's not a dictionary.")
+            return None
+
+        timestamp_str = msg.get('Timestamp')
+        content = msg.get('Contents')
+        sender_name = msg.get('Author', 'Unknown')
+
+        if not timestamp_str or not content:
+            return None
+
+        try:
+            timestamp_str_clean = timestamp_str.split('+')[0].replace('T', ' ')
+            if '.' in timestamp_str_clean:
+                dt_obj = datetime.strptime(timestamp_str_clean, '%Y-%m-%d %H:%M:%S.%f')
+            else:
+                dt_obj = datetime.strptime(timestamp_str_clean, '%Y-%m-%d %H:%M:%S')
+            formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return None
+
+        return {
+            "timestamp": formatted_timestamp,
+            "sender": sender_name,
+            "text": content.strip(),
+            "source": source_label,
+            "source_type": "discord",
+            "conversation_id": conversation_id,
+            "participants": dm_participants_list
+        }
+
+    try:
+        _stream_zip_json_array(z, messages_json_name, f"messages.json for {channel_dir_name}", normalize_message, entries, fallback_encoding='latin-1')
+    except (json.JSONDecodeError, UnicodeDecodeError) as load_err:
+        diagnostics.warn('unreadable_file', f"        Error: Failed loading messages.json for {channel_dir_name}: {load_err}")
+    except ValueError as shape_err:
+        diagnostics.warn('unreadable_file', f"        Error: {shape_err} in messages.json for {channel_dir_name}. Skipping.")
+    except Exception as e:
+        diagnostics.warn('unreadable_file', f"      Error processing messages file {messages_json_name}: {e}")
+    return entries
+
+def parse_discord_zip(file_path, zip_file=None, executor=None):
     """
     Parses Discord data package zip file, extracting messages only from DMs (2 participants).
     Assumes the standard Discord package structure with messages.json.
+    Members are read straight from the archive; nothing is extracted to disk.
+    Each DM channel is a separate work unit, fanned out to executor's worker processes when given.
     """
     entries = []
-    temp_dir = None
     channel_index = {}
     own_user_name = "YourDiscordUsername#0000"
 
     try:
-        temp_dir = tempfile.mkdtemp()
-        print(f"  Extracting Discord package to temporary directory: {temp_dir}")
-        with zipfile.ZipFile(file_path, 'r') as z:
-            z.extractall(temp_dir)
+        with _open_zip(file_path, zip_file) as z:
+            member_names = {info.filename for info in _zip_member_files(z)}
+            channel_dirs = {name.split('/')[1] for name in member_names if name.startswith('messages/') and name.count('/') >= 2}
+
+            user_json_name = 'account/user.json'
+            if user_json_name in member_names:
+                try:
+                    user_data = _load_zip_json(z, user_json_name, user_json_name)
+                    own_user_id = user_data.get('id')
+                    if own_user_id:
+                        username = user_data.get('username', f"User_{own_user_id}")
+                        discriminator = user_data.get('discriminator', '0000')
+                        own_user_name = f"{username}#{discriminator}"
+                        logger.debug(f"  Loaded own user info: {own_user_name} (ID: {own_user_id})")
+                    else:
+                        logger.warning("  Warning: Could not find 'id' in account/user.json. Using default username.")
+                except Exception as e:
+                    logger.warning(f"  Warning: Could not load or parse account/user.json: {e}. Using default username.")
+            else:
+                logger.warning("  Warning: account/user.json not found. Using default username.")
 
-        user_json_path = os.path.join(temp_dir, 'account', 'user.json')
-        if os.path.exists(user_json_path):
+            index_json_name = 'messages/index.json'
+            if index_json_name not in member_names:
+                logger.error(f"  Error: messages/index.json not found in {file_path}. Cannot process Discord DMs.")
+                return entries
             try:
-                with open(user_json_path, 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                own_user_id = user_data.get('id')
-                if own_user_id:
-                    username = user_data.get('username', f"User_{own_user_id}")
-                    discriminator = user_data.get('discriminator', '0000')
-                    own_user_name = f"{username}#{discriminator}"
-                    print(f"  Loaded own user info: {own_user_name} (ID: {own_user_id})")
-                else:
-                    print("  Warning: Could not find 'id' in account/user.json. Using default username.")
+                channel_index = _load_zip_json(z, index_json_name, index_json_name)
+                logger.debug(f"  Successfully loaded messages/index.json (found {len(channel_index)} entries)")
             except Exception as e:
-                print(f"  Warning: Could not load or parse account/user.json: {e}. Using default username.")
-        else:
-            print("  Warning: account/user.json not found. Using default username.")
-
-        index_json_path = os.path.join(temp_dir, 'messages', 'index.json')
-        if not os.path.exists(index_json_path):
-            print(f"  Error: messages/index.json not found at {index_json_path}. Cannot process Discord DMs.")
-            return entries
-        try:
-            with open(index_json_path, 'r', encoding='utf-8') as f:
-                channel_index = json.load(f)
-            print(f"  Successfully loaded messages/index.json (found {len(channel_index)} entries)")
-        except Exception as e:
-            print(f"  Error: Could not load or parse messages/index.json: {e}")
-            return entries
-
-        messages_base_path = os.path.join(temp_dir, 'messages')
-        dm_pattern = re.compile(r"Direct Message with (.*)")
-
-        for channel_id, description in channel_index.items():
-            dm_match = dm_pattern.match(description)
-            if dm_match:
-                partner_name = dm_match.group(1).strip()
-                if partner_name != "Unknown Participant":
-                    channel_dir_name = f"c{channel_id}"
-                    channel_path = os.path.join(messages_base_path, channel_dir_name)
-                    messages_json_path = os.path.join(channel_path, 'messages.json')
-
-                    if not os.path.isdir(channel_path):
-                         print(f"      Warning: Directory {channel_dir_name} not found for channel ID {channel_id}. Skipping.")
-                         continue
-                    if not os.path.exists(messages_json_path):
-                        print(f"      Warning: messages.json not found in {channel_dir_name}. Skipping DM.")
-                        continue
-
-                    dm_participants_list = sorted([own_user_name, partner_name])
-                    dm_participants_str = " & ".join(dm_participants_list)
-
-                    messages_data = None
-                    try:
-                        try:
-                            with open(messages_json_path, 'r', encoding='utf-8') as f:
-                                messages_data = json.load(f)
-                        except (json.JSONDecodeError, UnicodeDecodeError):
-                            print(f"        Warning: Failed loading messages.json for {channel_dir_name} with utf-8. Trying latin-1...")
-                            try:
-                                with open(messages_json_path, 'r', encoding='latin-1') as f:
-                                    messages_data = json.load(f)
-                            except Exception as fallback_err:
-                                print(f"        Error: Failed loading messages.json for {channel_dir_name} with fallback encoding: {fallback_err}")
-                                continue
-
-                        if not isinstance(messages_data, list):
-                            print(f"        Error: Expected messages_data to be a list, but got {type(messages_data)} for {channel_dir_name}. Skipping.")
+                logger.error(f"  Error: Could not load or parse messages/index.json: {e}")
+                return entries
+
+            dm_pattern = re.compile(r"Direct Message with (.*)")
+            channel_units = []
+
+            for channel_id, description in channel_index.items():
+                dm_match = dm_pattern.match(description)
+                if dm_match:
+                    partner_name = dm_match.group(1).strip()
+                    if partner_name != "Unknown Participant":
+                        channel_dir_name = f"c{channel_id}"
+                        messages_json_name = f"messages/{channel_dir_name}/messages.json"
+
+                        if channel_dir_name not in channel_dirs:
+                             diagnostics.warn('missing_conversation', f"      Warning: Directory {channel_dir_name} not found for channel ID {channel_id}. Skipping.")
+                             continue
+                        if messages_json_name not in member_names:
+                            diagnostics.warn('missing_conversation', f"      Warning: messages.json not found in {channel_dir_name}. Skipping DM.")
                             continue
 
-                        msg_parsed_count = 0
-                        for msg_index, msg in enumerate(messages_data):
-                            if not isinstance(msg, dict):
-                                print(f"        Warning: Skipping message at index {msg_index} as it's not a dictionary.")
-                                continue
-
-                            msg_id = msg.get('ID')
-                            timestamp_str = msg.get('Timestamp')
-                            content = msg.get('Contents')
-                            sender_name = msg.get('Author', 'Unknown')
+                        dm_participants_list = sorted([own_user_name, partner_name])
+                        channel_units.append((channel_dir_name, messages_json_name, dm_participants_list))
 
-                            if not timestamp_str or not content:
-                                continue
-
-                            try:
-                                timestamp_str_clean = timestamp_str.split('+')[0].replace('T', ' ')
-                                if '.' in timestamp_str_clean:
-                                    dt_obj = datetime.strptime(timestamp_str_clean, '%Y-%m-%d %H:%M:%S.%f')
-                                else:
-                                    dt_obj = datetime.strptime(timestamp_str_clean, '%Y-%m-%d %H:%M:%S')
-                                formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-                            except ValueError:
-                                continue
-
-                            msg_parsed_count += 1
-                            entries.append({
-                                "timestamp": formatted_timestamp,
-                                "sender": sender_name,
-                                "text": content.strip(),
-                                "source": f"{os.path.basename(file_path)} -> Discord DM ({dm_participants_str})"
-                            })
-
-                    except Exception as e:
-                        print(f"      Error processing messages file {messages_json_path}: {e}")
+            logger.info(f"  Parsing {len(channel_units)} DM channels...")
+            for channel_entries in _map_conversation_units(_parse_discord_channel, file_path, channel_units, z, executor):
+                entries.extend(channel_entries)
 
     except zipfile.BadZipFile:
-        print(f"Error: Bad zip file: {file_path}")
+        logger.error(f"Error: Bad zip file: {file_path}")
     except Exception as e:
-        print(f"Error processing Discord zip file {file_path}: {e}")
-    finally:
-        if temp_dir and os.path.isdir(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                print(f"  Error cleaning up temporary directory {temp_dir}: {e}")
+        logger.error(f"Error processing Discord zip file {file_path}: {e}")
 
-    print(f"  Finished processing Discord zip. Found {len(entries)} DM entries.")
+    logger.info(f"  Finished processing Discord zip. Found {len(entries)} DM entries.")
     return entries
 
-def parse_instagram_html(file_path, source_context=""):
+_IG_MESSAGE_BLOCK_CLASS = 'pam _3-95 _2ph- _a6-g uiBoxWhite noborder'
+_IG_SENDER_CLASS = '_3-95 _2pim _a6-h _a6-i'
+_IG_CONTENT_CLASS = '_3-95 _a6-p'
+_IG_TIMESTAMP_CLASS = '_3-94 _a6-o'
+_HTML_VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer',
+])
+
+class _HTMLFrame:
+    """An open element on the extractor's stack and what it contributes to the current message."""
+    __slots__ = ('tag', 'role', 'parts', 'href', 'has_img')
+
+    def __init__(self, tag, role=None, href=None):
+        self.tag = tag
+        self.role = role
+        self.parts = [] if role in ('sender', 'timestamp', 'content_text') else None
+        self.href = href
+        self.has_img = False
+
+class _InstagramHTMLMessageExtractor(HTMLParser):
+    """
+    Event-driven extractor for Instagram inbox HTML. Only the currently open message block
+    is held in memory; each finished block is appended to self.records as a dict with
+    raw 'sender', 'text' and 'timestamp' strings, in the same shape the message blocks
+    are read in parse_instagram_html (sender/timestamp text is stripped and concatenated,
+    content keeps its direct text, div/ul children and linked images one per line).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self._stack = []
+        self._data = []
+        self._block = None
+        self._text_skip_depth = 0
+
+    def _flush_data(self):
+        if not self._data:
+            return
+        data = ''.join(self._data)
+        self._data = []
+        block = self._block
+        if block is None:
+            return
+        if self._stack and self._stack[-1].role == 'content':
+            block['content_parts'].append(data.strip() + "\n")
+        if self._text_skip_depth:
+            return
+        stripped = data.strip()
+        if stripped:
+            for frame in self._stack:
+                if frame.role in ('sender', 'timestamp', 'content_text'):
+                    frame.parts.append(stripped)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_data()
+        attributes = dict(attrs)
+        block = self._block
+        role = None
+        if tag == 'div':
+            css_class = ' '.join((attributes.get('class') or '').split())
+            if css_class == _IG_MESSAGE_BLOCK_CLASS and block is None:
+                self._block = block = {'sender': None, 'content': None, 'timestamp': None, 'content_parts': [], 'frame': None}
+                role = 'block'
+            elif block is not None:
+                if css_class == _IG_SENDER_CLASS and block['sender'] is None:
+                    role = 'sender'
+                elif css_class == _IG_CONTENT_CLASS and block['content'] is None:
+                    role = 'content'
+                elif css_class == _IG_TIMESTAMP_CLASS and block['timestamp'] is None:
+                    role = 'timestamp'
+        if role is None and block is not None and self._stack and self._stack[-1].role == 'content':
+            if tag in ('div', 'ul'):
+                role = 'content_text'
+            elif tag == 'a':
+                role = 'content_link'
+        if tag == 'img':
+            for frame in self._stack:
+                if frame.role == 'content_link':
+                    frame.has_img = True
+        if tag in _HTML_VOID_ELEMENTS:
+            return
+
+        frame = _HTMLFrame(tag, role, attributes.get('href', 'N/A') or '')
+        if role in ('block', 'sender', 'content', 'timestamp'):
+            block[role] = frame
+        if tag in ('script', 'style'):
+            self._text_skip_depth += 1
+        self._stack.append(frame)
+
+    def handle_endtag(self, tag):
+        self._flush_data()
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index].tag == tag:
+                break
+        else:
+            return
+        while len(self._stack) > index:
+            self._close_frame(self._stack.pop())
+
+    def handle_comment(self, data):
+        self._flush_data()
+        if self._block is not None and self._stack and self._stack[-1].role == 'content':
+            self._block['content_parts'].append(data.strip() + "\n")
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def _close_frame(self, frame):
+        if frame.tag in ('script', 'style'):
+            self._text_skip_depth -= 1
+        block = self._block
+        if frame.role == 'content_text':
+            text = ''.join(frame.parts)
+            if text or frame.tag == 'ul':
+                block['content_parts'].append(text + "\n")
+        elif frame.role == 'content_link':
+            if frame.has_img:
+                block['content_parts'].append(f"[Image: {frame.href}]\n")
+        elif frame.role == 'block':
+            sender_frame = block['sender']
+            content_frame = block['content']
+            timestamp_frame = block['timestamp']
+            self.records.append({
+                'sender': ''.join(sender_frame.parts) if sender_frame else "Unknown",
+                'text': ''.join(block['content_parts']).strip() if content_frame else "",
+                'timestamp': ''.join(timestamp_frame.parts) if timestamp_frame else None,
+            })
+            self._block = None
+
+    def close(self):
+        super().close()
+        self._flush_data()
+        while self._stack:
+            self._close_frame(self._stack.pop())
+
+def iter_instagram_html_messages(text_stream, chunk_size=64 * 1024):
+    """
+    Streams an Instagram inbox HTML file and yields one {'sender', 'text', 'timestamp'} record
+    per message block as soon as the block is complete. Memory stays flat regardless of
+    the thread's length because no document tree is built.
+    """
+    extractor = _InstagramHTMLMessageExtractor()
+    while True:
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            break
+        extractor.feed(chunk)
+        if extractor.records:
+            yield from extractor.records
+            extractor.records = []
+    extractor.close()
+    yield from extractor.records
+
+def parse_instagram_html(file_path, source_context="", stream=None):
     """
     Parses Instagram messages from an HTML file.
+    When stream is given (e.g. an open zip member) it is parsed instead of file_path.
     """
     entries = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
-
-        message_blocks = soup.find_all('div', class_='pam _3-95 _2ph- _a6-g uiBoxWhite noborder')
-
-        for block in message_blocks:
-            sender_tag = block.find('div', class_='_3-95 _2pim _a6-h _a6-i')
-            content_tag = block.find('div', class_='_3-95 _a6-p')
-            timestamp_tag = block.find('div', class_='_3-94 _a6-o')
-
-            sender = sender_tag.get_text(strip=True) if sender_tag else "Unknown"
-            text_content = ""
-            if content_tag:
-                for child in content_tag.children:
-                    if isinstance(child, str):
-                        text_content += child.strip() + "\n"
-                    elif child.name == 'div':
-                        child_text = child.get_text(strip=True)
-                        if child_text:
-                            text_content += child_text + "\n"
-                    elif child.name == 'a' and child.find('img'):
-                         text_content += f"[Image: {child.get('href', 'N/A')}]\n"
-                    elif child.name == 'ul':
-                         text_content += child.get_text(strip=True) + "\n"
-
-                text_content = text_content.strip()
-
-            timestamp_str = timestamp_tag.get_text(strip=True) if timestamp_tag else None
-
-            if sender and text_content and timestamp_str:
-                try:
-                    dt_obj = datetime.strptime(timestamp_str, '%b %d, %Y %I:%M %p')
-                    formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    print(f"Warning: Could not parse timestamp '{timestamp_str}' in {file_path}. Skipping entry.")
-                    continue
-
-                entries.append({
-                    "timestamp": formatted_timestamp,
-                    "sender": sender,
-                    "text": text_content,
-                    "source": source_context
-                })
+        if stream is not None:
+            records = iter_instagram_html_messages(io.TextIOWrapper(stream, encoding='utf-8'))
+            entries = _instagram_html_records_to_entries(records, file_path, source_context)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                entries = _instagram_html_records_to_entries(iter_instagram_html_messages(f), file_path, source_context)
 
     except FileNotFoundError:
-        print(f"Error: HTML file not found at {file_path}")
+        logger.error(f"Error: HTML file not found at {file_path}")
     except Exception as e:
-        print(f"Error parsing Instagram HTML file {file_path}: {e}")
+        logger.error(f"Error parsing Instagram HTML file {file_path}: {e}")
     return entries
 
-def parse_instagram_json(file_path, source_context=""):
+def _instagram_html_records_to_entries(records, file_path, source_context):
+    entries = []
+    for record in records:
+        sender = record['sender']
+        text_content = record['text']
+        timestamp_str = record['timestamp']
+
+        if sender and text_content and timestamp_str:
+            try:
+                dt_obj = datetime.strptime(timestamp_str, '%b %d, %Y %I:%M %p')
+                formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                diagnostics.warn('unparsed_timestamp', f"Warning: Could not parse timestamp '{timestamp_str}' in {file_path}. Skipping entry.")
+                continue
+
+            entries.append({
+                "timestamp": formatted_timestamp,
+                "sender": sender,
+                "text": text_content,
+                "source": source_context
+            })
+    return entries
+
+def parse_instagram_json(file_path, source_context="", stream=None):
     """
     Parses Instagram messages from a JSON file.
+    When stream is given (e.g. an open zip member) it is decoded instead of file_path.
     """
     entries = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if stream is not None:
+            data = json.load(io.TextIOWrapper(stream, encoding='utf-8'))
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
 
         messages = data.get('messages', [])
         participants = data.get('participants', [])
@@ -500,203 +1038,221 @@ def parse_instagram_json(file_path, source_context=""):
                     dt_obj = datetime.fromtimestamp(timestamp_ms / 1000)
                     formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
                 except (ValueError, TypeError):
-                    print(f"Warning: Could not parse timestamp '{timestamp_ms}' in {file_path}. Skipping entry.")
+                    diagnostics.warn('unparsed_timestamp', f"Warning: Could not parse timestamp '{timestamp_ms}' in {file_path}. Skipping entry.")
                     continue
 
                 entries.append({
                     "timestamp": formatted_timestamp,
                     "sender": sender_name.strip(),
                     "text": text_content.strip(),
-                    "source": f"{source_context} -> {source_detail}"
+                    "source": f"{source_context} -> {source_detail}",
+                    "participants": participant_names
                 })
 
     except FileNotFoundError:
-        print(f"Error: JSON file not found at {file_path}")
+        logger.error(f"Error: JSON file not found at {file_path}")
     except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from file {file_path}")
+        logger.error(f"Error: Could not decode JSON from file {file_path}")
     except Exception as e:
-        print(f"Error parsing Instagram JSON file {file_path}: {e}")
+        logger.error(f"Error parsing Instagram JSON file {file_path}: {e}")
     return entries
 
-def parse_instagram_zip(file_path):
+def _group_members_by_directory(member_names):
+    """Groups zip member names by their directory, keeping the archive's order within and across groups."""
+    groups = {}
+    for member_name in member_names:
+        groups.setdefault(posixpath.dirname(member_name), []).append(member_name)
+    return list(groups.items())
+
+def _parse_instagram_thread(file_path, unit, zip_file=None):
+    """
+    Work unit for parse_instagram_zip: parses the HTML and JSON files of one inbox thread.
+    unit is a tuple: (thread directory, list of member names).
+    The participants listed in the thread's JSON files are applied to its HTML messages too.
+    """
+    thread_dir, member_names = unit
+    z = zip_file if zip_file is not None else _worker_zip(file_path)
+    entries = []
+    for member_name in member_names:
+        member_lower = member_name.lower()
+
+        if member_lower.endswith('.html'):
+            logger.debug(f"    Found HTML message file: {member_name}")
+            with z.open(member_name) as member_stream:
+                parsed_entries = parse_instagram_html(member_name, f"{os.path.basename(file_path)} -> {member_name}", stream=member_stream)
+            entries.extend(parsed_entries)
+            logger.debug(f"    Parsed {len(parsed_entries)} entries from {member_name}")
+
+        elif member_lower.endswith('.json'):
+            logger.debug(f"    Found JSON message file: {member_name}")
+            with z.open(member_name) as member_stream:
+                parsed_entries = parse_instagram_json(member_name, f"{os.path.basename(file_path)} -> {member_name}", stream=member_stream)
+            entries.extend(parsed_entries)
+            logger.debug(f"    Parsed {len(parsed_entries)} entries from {member_name}")
+
+    participants = next((entry["participants"] for entry in entries if entry.get("participants")), [])
+    return _tag_conversation(entries, 'instagram', f"instagram:{os.path.basename(file_path)}:{thread_dir}", participants)
+
+def parse_instagram_zip(file_path, zip_file=None, executor=None):
     """
     Parses Instagram data package zip file, extracting messages from HTML and JSON files.
     Assumes the standard Instagram package structure.
+    Only the inbox members are read, straight from the archive. Each inbox thread is a
+    separate work unit, fanned out to executor's worker processes when given.
     """
     entries = []
-    temp_dir = None
+    inbox_prefix = 'your_instagram_activity/messages/inbox/'
 
     try:
-        temp_dir = tempfile.mkdtemp()
-        print(f"  Extracting Instagram package to temporary directory: {temp_dir}")
-        with zipfile.ZipFile(file_path, 'r') as z:
-            z.extractall(temp_dir)
-
-        messages_inbox_path = os.path.join(temp_dir, 'your_instagram_activity', 'messages', 'inbox')
-        if not os.path.isdir(messages_inbox_path):
-            print(f"  Warning: Messages inbox directory not found at {messages_inbox_path}. Skipping message extraction.")
-            return entries
-
-        print(f"  Scanning messages inbox directory: {messages_inbox_path}")
-        for root, _, files in os.walk(messages_inbox_path):
-            for file in files:
-                file_path_abs = os.path.join(root, file)
-                relative_file_path = os.path.relpath(file_path_abs, temp_dir)
-
-                if file.lower().endswith('.html'):
-                    print(f"    Found HTML message file: {relative_file_path}")
-                    parsed_entries = parse_instagram_html(file_path_abs, f"{os.path.basename(file_path)} -> {relative_file_path}")
-                    entries.extend(parsed_entries)
-                    print(f"    Parsed {len(parsed_entries)} entries from {relative_file_path}")
-
-                elif file.lower().endswith('.json'):
-                    print(f"    Found JSON message file: {relative_file_path}")
-                    parsed_entries = parse_instagram_json(file_path_abs, f"{os.path.basename(file_path)} -> {relative_file_path}")
-                    entries.extend(parsed_entries)
-                    print(f"    Parsed {len(parsed_entries)} entries from {relative_file_path}")
-
-        print(f"  Finished scanning Instagram messages. Total entries found: {len(entries)}")
+        with _open_zip(file_path, zip_file) as z:
+            inbox_members = [info.filename for info in _zip_member_files(z) if info.filename.startswith(inbox_prefix)]
+            if not inbox_members:
+                logger.warning(f"  Warning: Messages inbox directory not found at {inbox_prefix} in {file_path}. Skipping message extraction.")
+                return entries
+
+            thread_units = [unit for unit in _group_members_by_directory(inbox_members)
+                            if any(name.lower().endswith(('.html', '.json')) for name in unit[1])]
+            logger.info(f"  Scanning messages inbox: {inbox_prefix} ({len(thread_units)} threads)")
+            for thread_entries in _map_conversation_units(_parse_instagram_thread, file_path, thread_units, z, executor):
+                entries.extend(thread_entries)
+
+            logger.info(f"  Finished scanning Instagram messages. Total entries found: {len(entries)}")
 
     except zipfile.BadZipFile:
-        print(f"Error: Bad zip file: {file_path}")
+        logger.error(f"Error: Bad zip file: {file_path}")
     except Exception as e:
-        print(f"Error processing Instagram zip file {file_path}: {e}")
-    finally:
-        if temp_dir and os.path.isdir(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                print(f"  Cleaned up temporary directory: {temp_dir}")
-            except Exception as e:
-                print(f"  Error cleaning up temporary directory {temp_dir}: {e}")
+        logger.error(f"Error processing Instagram zip file {file_path}: {e}")
 
-    print(f"  Finished processing Instagram zip. Found {len(entries)} entries.")
+    logger.info(f"  Finished processing Instagram zip. Found {len(entries)} entries.")
     return entries
 
-def parse_facebook_zip(file_path):
+def _parse_facebook_conversation(file_path, unit, zip_file=None):
     """
-    Parses Facebook data package zip file, extracting messages from message_1.json files.
-    Assumes the standard Facebook package structure with messages/inbox/<conversation_name>/message_1.json.
+    Work unit for parse_facebook_zip: parses the message_N.json and HTML files of one directory.
+    unit is a tuple: (directory, list of member names).
     """
+    member_dir, member_names = unit
+    z = zip_file if zip_file is not None else _worker_zip(file_path)
     entries = []
-    temp_dir = None
+    messages_inbox_prefix = 'messages/inbox'
 
-    try:
-        temp_dir = tempfile.mkdtemp()
-        print(f"  Extracting Facebook package to temporary directory: {temp_dir}")
-        with zipfile.ZipFile(file_path, 'r') as z:
-            z.extractall(temp_dir)
-
-        for root, dirs, files in os.walk(temp_dir):
-            for file in files:
-                file_lower = file.lower()
-                file_path_abs = os.path.join(root, file)
-
-                if file_lower == 'message_1.json':
-                    print(f"    Found message file: {file_path_abs}")
-
-                    messages_inbox_path = os.path.join(temp_dir, 'messages', 'inbox')
-                    conversation_name = "Unknown Conversation"
-
-                    if os.path.commonpath([messages_inbox_path, root]) == messages_inbox_path:
-                         relative_path = os.path.relpath(root, messages_inbox_path)
-                         if relative_path != '.':
-                            conversation_name = os.path.basename(relative_path)
-                         else:
-                            conversation_name = "Inbox"
+    participants = []
+    conversation_name = "Unknown Conversation"
+    if member_dir == messages_inbox_prefix:
+        conversation_name = "Inbox"
+    elif member_dir.startswith(messages_inbox_prefix + '/'):
+        conversation_name = posixpath.basename(member_dir)
 
-                    messages_data = None
-                    try:
-                        try:
-                            with open(file_path_abs, 'r', encoding='utf-8') as f:
-                                messages_data = json.load(f)
-                        except (json.JSONDecodeError, UnicodeDecodeError):
-                            print(f"      Warning: Failed loading {file} with utf-8. Trying latin-1...")
-                            try:
-                                with open(file_path_abs, 'r', encoding='latin-1') as f:
-                                    messages_data = json.load(f)
-                            except Exception as fallback_err:
-                                print(f"      Error: Failed loading {file} with fallback encoding: {fallback_err}")
-                                continue
-
-                        if not isinstance(messages_data, dict):
-                            print(f"      Error: Expected messages_data to be a dictionary, but got {type(messages_data)} for {file_path_abs}. Skipping.")
-                            continue
+    source_label = f"{os.path.basename(file_path)} -> Facebook Conversation ({conversation_name})"
 
-                        if 'messages' in messages_data and isinstance(messages_data['messages'], list):
-                            print(f"      Parsing {len(messages_data['messages'])} messages from conversation '{conversation_name}'...")
-                            msg_parsed_count = 0
-                            for msg in messages_data['messages']:
-                                if not isinstance(msg, dict):
-                                    continue
+    def normalize_message(msg_index, msg):
+        if not isinstance(msg, dict):
+            return None
 
-                                timestamp_ms = msg.get('timestamp_ms')
-                                sender_name = msg.get('sender_name')
-                                content = msg.get('content')
+        timestamp_ms = msg.get('timestamp_ms')
+        sender_name = msg.get('sender_name')
+        content = msg.get('content')
 
-                                if not sender_name:
-                                    sender_name = "Participant"
+        if not sender_name:
+            sender_name = "Participant"
 
-                                if timestamp_ms is None or content is None:
-                                    continue
+        if timestamp_ms is None or content is None:
+            return None
 
-                                try:
-                                    timestamp_sec = timestamp_ms / 1000
-                                    dt_obj = datetime.fromtimestamp(timestamp_sec)
-                                    formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-                                except (ValueError, TypeError):
-                                    continue
+        try:
+            timestamp_sec = timestamp_ms / 1000
+            dt_obj = datetime.fromtimestamp(timestamp_sec)
+            formatted_timestamp = dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, TypeError):
+            return None
+
+        return {
+            "timestamp": formatted_timestamp,
+            "sender": sender_name.strip(),
+            "text": content.strip(),
+            "source": source_label
+        }
+
+    for member_name in member_names:
+        file = posixpath.basename(member_name)
+        file_lower = file.lower()
+
+        if _FACEBOOK_MESSAGE_FILE_PATTERN.fullmatch(file_lower):
+            logger.debug(f"    Found message file: {member_name}")
 
-                                msg_parsed_count += 1
-                                entries.append({
-                                    "timestamp": formatted_timestamp,
-                                    "sender": sender_name.strip(),
-                                    "text": content.strip(),
-                                    "source": f"{os.path.basename(file_path)} -> Facebook Conversation ({conversation_name})"
-                                })
-                            print(f"      Finished parsing. Successfully parsed {msg_parsed_count}/{len(messages_data['messages'])} messages.")
-                        else:
-                            print(f"      Warning: 'messages' key not found or is not a list in {file_path_abs}. Skipping.")
-
-                    except Exception as e:
-                        print(f"    Error processing message file {file_path_abs}: {e}")
-
-                elif file_lower.endswith(('.html', '.htm')):
-                    print(f"    Found HTML file: {file_path_abs}")
-                    html_entries = extract_text_from_html(file_path_abs)
-                    if html_entries:
-                        for entry in html_entries:
-                            entry["source"] = f"{os.path.basename(file_path)} -> Facebook HTML ({os.path.basename(file_path_abs)})"
-                        entries.extend(html_entries)
-                        print(f"      Successfully extracted {len(html_entries)} entries from HTML file.")
-                    else:
-                        print(f"      Warning: Could not extract any entries from HTML file {file_path_abs}.")
+            try:
+                logger.debug(f"      Parsing messages from conversation '{conversation_name}'...")
+                parsed_before = len(entries)
+                conversation_info = {}
+                message_count = _stream_zip_json_array(z, member_name, file, normalize_message, entries, key='messages', fallback_encoding='latin-1', other_values=conversation_info)
+                if not participants and isinstance(conversation_info.get('participants'), list):
+                    participants = [p['name'] for p in conversation_info['participants'] if isinstance(p, dict) and p.get('name')]
+                logger.debug(f"      Finished parsing. Successfully parsed {len(entries) - parsed_before}/{message_count} messages.")
+            except (json.JSONDecodeError, UnicodeDecodeError) as load_err:
+                diagnostics.warn('unreadable_file', f"      Error: Failed loading {file}: {load_err}")
+            except ValueError as shape_err:
+                diagnostics.warn('unreadable_file', f"      Warning: {shape_err} in {member_name}. Skipping.")
+            except Exception as e:
+                diagnostics.warn('unreadable_file', f"    Error processing message file {member_name}: {e}")
+
+        elif file_lower.endswith(('.html', '.htm')):
+            logger.debug(f"    Found HTML file: {member_name}")
+            modified = _zip_member_mtime(z.getinfo(member_name)) or datetime.fromtimestamp(os.path.getmtime(file_path))
+            with z.open(member_name) as member_stream:
+                html_entries = extract_text_from_html(member_name, stream=member_stream, modified=modified)
+            if html_entries:
+                for entry in html_entries:
+                    entry["source"] = f"{os.path.basename(file_path)} -> Facebook HTML ({file})"
+                entries.extend(html_entries)
+                logger.debug(f"      Successfully extracted {len(html_entries)} entries from HTML file.")
+            else:
+                diagnostics.warn('empty_file', f"      Warning: Could not extract any entries from HTML file {member_name}.")
+    return _tag_conversation(entries, 'facebook', f"facebook:{os.path.basename(file_path)}:{member_dir}", participants)
 
+def parse_facebook_zip(file_path, zip_file=None, executor=None):
+    """
+    Parses Facebook data package zip file, extracting messages from message_N.json files.
+    Assumes the standard Facebook package structure with messages/inbox/<conversation_name>/message_N.json.
+    Members are read straight from the archive; nothing is extracted to disk. Each conversation
+    directory is a separate work unit, fanned out to executor's worker processes when given.
+    """
+    entries = []
+
+    try:
+        with _open_zip(file_path, zip_file) as z:
+            relevant_members = []
+            for info in _zip_member_files(z):
+                file_lower = posixpath.basename(info.filename).lower()
+                if _FACEBOOK_MESSAGE_FILE_PATTERN.fullmatch(file_lower) or file_lower.endswith(('.html', '.htm')):
+                    relevant_members.append(info.filename)
+
+            conversation_units = _group_members_by_directory(relevant_members)
+            logger.info(f"  Parsing {len(conversation_units)} conversation directories...")
+            for conversation_entries in _map_conversation_units(_parse_facebook_conversation, file_path, conversation_units, z, executor):
+                entries.extend(conversation_entries)
 
     except zipfile.BadZipFile:
-        print(f"Error: Bad zip file: {file_path}")
+        logger.error(f"Error: Bad zip file: {file_path}")
     except Exception as e:
-        print(f"Error processing Facebook zip file {file_path}: {e}")
-    finally:
-        if temp_dir and os.path.isdir(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                print(f"  Cleaned up temporary directory: {temp_dir}")
-            except Exception as e:
-                print(f"  Error cleaning up temporary directory {temp_dir}: {e}")
+        logger.error(f"Error processing Facebook zip file {file_path}: {e}")
 
-    print(f"  Finished processing Facebook zip. Found {len(entries)} entries (messages and HTML).")
+    logger.info(f"  Finished processing Facebook zip. Found {len(entries)} entries (messages and HTML).")
     return entries
 
-def extract_from_zip(file_path, source_type):
-    """Extracts relevant data from zip files based on detected source type."""
+def extract_from_zip(file_path, source_type, zip_file=None, executor=None):
+    """
+    Extracts relevant data from zip files based on detected source type.
+    Pass the handle detect_source already inspected as zip_file to avoid reopening the archive.
+    With an executor, the conversations of Discord, Instagram and Facebook packages are parsed in parallel.
+    """
     entries = []
-    print(f"Processing zip file: {file_path} (detected as: {source_type})")
+    logger.info(f"Processing zip file: {file_path} (detected as: {source_type})")
     try:
         if source_type == 'whatsapp_zip':
-            with zipfile.ZipFile(file_path, 'r') as z:
+            with _open_zip(file_path, zip_file) as z:
                 chat_file = next((f for f in z.namelist() if f.lower().endswith('.txt')), None)
                 if chat_file:
-                    print(f"  Found potential chat file: {chat_file} inside zip.")
+                    logger.debug(f"  Found potential chat file: {chat_file} inside zip.")
                     try:
                         with z.open(chat_file) as f:
                             content = None
@@ -706,47 +1262,48 @@ def extract_from_zip(file_path, source_type):
                                 try:
                                     f.seek(0)
                                     content = f.read().decode(enc)
-                                    print(f"  Successfully decoded {chat_file} with encoding {enc}")
+                                    logger.debug(f"  Successfully decoded {chat_file} with encoding {enc}")
                                     break
                                 except UnicodeDecodeError as decode_err:
                                     last_decode_error = decode_err
-                                    print(f"  Failed decoding {chat_file} with {enc}")
+                                    diagnostics.warn('encoding_fallback', f"  Failed decoding {chat_file} with {enc}")
                                     continue
                                 except Exception as inner_read_err:
-                                    print(f"  Error reading {chat_file} with {enc}: {inner_read_err}")
+                                    logger.error(f"  Error reading {chat_file} with {enc}: {inner_read_err}")
                                     last_decode_error = inner_read_err
                                     break
 
                             if content is not None:
                                 parsed_entries = parse_whatsapp_content_string(content, f"{file_path} -> {chat_file}")
+                                _tag_conversation(parsed_entries, 'whatsapp', f"whatsapp:{os.path.basename(file_path)}:{chat_file}", _whatsapp_participants(file_path))
                                 if parsed_entries:
                                      entries.extend(parsed_entries)
-                                     print(f"  Successfully parsed {len(parsed_entries)} entries from {chat_file}.")
+                                     logger.debug(f"  Successfully parsed {len(parsed_entries)} entries from {chat_file}.")
                                 else:
-                                     print(f"  Warning: Could not parse any entries from {chat_file} content. Adding placeholder.")
+                                     diagnostics.warn('empty_file', f"  Warning: Could not parse any entries from {chat_file} content. Adding placeholder.")
                                      try:
                                          timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
                                      except Exception:
                                          timestamp = "0000-00-00 00:00:00"
                                      entries.append({"timestamp": timestamp, "sender": "System", "text": f"Placeholder (parsing failed) for {chat_file}", "source": file_path})
                             else:
-                                print(f"  Error: Could not decode {chat_file} with any attempted encoding. Last error: {last_decode_error}")
+                                logger.error(f"  Error: Could not decode {chat_file} with any attempted encoding. Last error: {last_decode_error}")
                     except Exception as read_err:
-                         print(f"  Error opening or processing {chat_file} from zip {file_path}: {read_err}")
+                         logger.error(f"  Error opening or processing {chat_file} from zip {file_path}: {read_err}")
                 else:
-                    print(f"  Warning: Could not find any '.txt' chat file in WhatsApp zip: {file_path}")
+                    logger.warning(f"  Warning: Could not find any '.txt' chat file in WhatsApp zip: {file_path}")
 
         elif source_type == 'discord_zip':
-            entries = parse_discord_zip(file_path)
+            entries = parse_discord_zip(file_path, zip_file, executor)
 
         elif source_type == 'instagram_zip':
-             entries = parse_instagram_zip(file_path)
+             entries = parse_instagram_zip(file_path, zip_file, executor)
 
         elif source_type == 'facebook_zip':
-             entries = parse_facebook_zip(file_path)
+             entries = parse_facebook_zip(file_path, zip_file, executor)
 
         elif source_type in ['reddit_zip', 'generic_zip']:
-             print(f"  Extraction logic for {source_type} is not implemented yet.")
+             logger.info(f"  Extraction logic for {source_type} is not implemented yet.")
              try:
                  timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
              except Exception:
@@ -754,179 +1311,846 @@ def extract_from_zip(file_path, source_type):
              entries.append({"timestamp": timestamp, "sender": "System", "text": f"Placeholder for {source_type} data from {os.path.basename(file_path)}", "source": source_type})
 
     except zipfile.BadZipFile:
-        print(f"Error: Bad zip file: {file_path}")
+        logger.error(f"Error: Bad zip file: {file_path}")
     except Exception as e:
-        print(f"Error processing zip file {file_path}: {e}")
+        logger.error(f"Error processing zip file {file_path}: {e}")
     return entries
 
-def process_data(data_dir, processed_data_dir):
+def extract_file_entries(file_path, executor=None, source_type=None, timings=None):
     """
-    Scans the data directory, processes each file, and saves structured data by year.
-    Returns a tuple: (set of years with data, list of unprocessed filenames).
+    Detects the source of a single uploaded file and extracts its entries.
+    source_type skips detection when the caller already ran detect_source.
+    executor is handed to extract_from_zip for per-conversation parallelism.
+    timings, if given, receives the seconds spent in the 'detect', 'extract' and 'normalize' stages.
+    Returns a tuple: (detected source type, list of entries).
     """
-    all_data = {}
-    processed_files_set = set()
-    unprocessed_files = []
+    if timings is None:
+        timings = {}
+    filename = os.path.basename(file_path)
+    with _shared_zip_handle(file_path) as zip_file:
+        if source_type is None:
+            start = time.perf_counter()
+            source_type = detect_source(file_path, zip_file)
+            timings['detect'] = time.perf_counter() - start
+        logger.debug(f"  Detected source: {source_type}")
+
+        start = time.perf_counter()
+        extracted_entries = []
+        if source_type == 'whatsapp_txt':
+            logger.debug(f"  Calling extract_text_from_whatsapp_txt for {filename}")
+            extracted_entries = extract_text_from_whatsapp_txt(file_path)
+        elif source_type.endswith('_zip'):
+             logger.debug(f"  Calling extract_from_zip for {filename} with source type {source_type}")
+             extracted_entries = extract_from_zip(file_path, source_type, zip_file, executor)
+        elif source_type == 'html':
+            logger.debug(f"  Calling extract_text_from_html for {filename}")
+            extracted_entries = extract_text_from_html(file_path)
+        elif source_type == 'txt':
+            logger.info(f"  Processing generic txt file: {filename}")
+            try:
+                encodings_to_try = ['utf-8', 'latin-1', 'cp1252']
+                content = None
+                for enc in encodings_to_try:
+                    try:
+                        with open(file_path, 'r', encoding=enc) as f:
+                            content = f.read()
+                        break
+                    except UnicodeDecodeError:
+                        continue
+                    except Exception as read_err:
+                         logger.error(f"  Error reading text file {filename} with {enc}: {read_err}")
+                         content = None
+                         break
 
-    print(f"Scanning directory: {data_dir}")
-    if not os.path.isdir(data_dir):
-        print(f"Error: Data directory '{data_dir}' not found.")
-        return set(), []
+                if content is not None:
+                    timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+                    extracted_entries.append({"timestamp": timestamp, "sender": "Unknown", "text": content, "source": "txt"})
+                else:
+                    logger.error(f"  Error: Could not read text file {filename} with any attempted encoding.")
 
-    files_in_data_dir = [f for f in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, f))]
-    print(f"  Files found in {data_dir}: {files_in_data_dir}")
+            except Exception as e:
+                logger.error(f"  Error processing text file {filename}: {e}")
+        elif source_type == 'image':
+            logger.info(f"  Image file detected: {filename}. Processing not yet implemented.")
+            timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+            extracted_entries.append({"timestamp": timestamp, "sender": "System", "text": f"[Image File: {filename}]", "source": "image"})
+        elif source_type != 'bad_zip' and source_type != 'unknown_zip':
+            logger.info(f"  Skipping unsupported or unknown file type: {filename} ({source_type})")
+        timings['extract'] = time.perf_counter() - start
+
+    # Entries no parser tagged (placeholders, loose HTML/text/image files) are classified from
+    # their source string here, once, and treated as a conversation of their own.
+    start = time.perf_counter()
+    for entry in extracted_entries:
+        if "source_type" not in entry:
+            entry["source_type"] = message_store.classify_source_type(entry.get("source"))
+            entry["conversation_id"] = entry.get("source")
+            entry["participants"] = []
+    timings['normalize'] = time.perf_counter() - start
+    return source_type, extracted_entries
+
+def bucket_entries_by_year(file_path, extracted_entries):
+    """
+    Groups extracted entries by the year of their timestamp, falling back to the
+    file's modification year for entries without a usable timestamp.
+    Returns a dict: {year: [entries in extraction order]}.
+    """
+    filename = os.path.basename(file_path)
+    buckets = {}
+    for entry in extracted_entries:
+        try:
+            year = int(entry.get("timestamp", "0000")[:4])
+            if year > 0:
+                if year not in buckets:
+                    buckets[year] = []
+                buckets[year].append(entry)
+            else:
+                 diagnostics.warn('invalid_year', f"Warning: Invalid year '0000' or less found for entry in {filename}. Attempting fallback.")
+                 raise ValueError("Invalid year")
+        except (ValueError, TypeError, IndexError):
+             try:
+                 mod_time = os.path.getmtime(file_path)
+                 year = datetime.fromtimestamp(mod_time).year
+                 if year > 0:
+                     diagnostics.warn('fallback_year', f"  Fallback: Using file modification year {year} for an entry from {filename} due to invalid timestamp: {entry.get('timestamp')}")
+                     if year not in buckets:
+                         buckets[year] = []
+                     buckets[year].append(entry)
+                 else:
+                      diagnostics.warn('no_year', f"Warning: Could not determine fallback year for an entry from {filename}. Entry: {entry}")
+             except Exception as mod_err:
+                  diagnostics.warn('no_year', f"Warning: Could not determine fallback year for an entry from {filename} (mod time error: {mod_err}). Entry: {entry}")
+    return buckets
+
+class IngestCancelled(Exception):
+    """Raised by process_data when its progress reports that the run was cancelled."""
+
+class IngestProgress:
+    """
+    Receives progress reports from process_data; this base class ignores them (see ingest_jobs.py).
+    Stages are 'scanning', 'hashing', 'parsing', 'writing' and 'done'. Per-file stages are 'hashing',
+    'unchanged', 'queued', 'parsing' and 'parsed'. cancelled() is checked between steps;
+    once year shards are being written the run is no longer cancelled, so the store stays consistent.
+    """
 
-    for filename in files_in_data_dir:
-        file_path = os.path.join(data_dir, filename)
-        if os.path.isfile(file_path):
-            print(f"\nProcessing file: {filename}")
-            source_type = detect_source(file_path)
-            print(f"  Detected source: {source_type}")
-
-            extracted_entries = []
-            if source_type == 'whatsapp_txt':
-                print(f"  Calling extract_text_from_whatsapp_txt for {filename}")
-                extracted_entries = extract_text_from_whatsapp_txt(file_path)
-            elif source_type.endswith('_zip'):
-                 print(f"  Calling extract_from_zip for {filename} with source type {source_type}")
-                 extracted_entries = extract_from_zip(file_path, source_type)
-            elif source_type == 'html':
-                print(f"  Calling extract_text_from_html for {filename}")
-                extracted_entries = extract_text_from_html(file_path)
-            elif source_type == 'txt':
-                print(f"  Processing generic txt file: {filename}")
-                try:
-                    encodings_to_try = ['utf-8', 'latin-1', 'cp1252']
-                    content = None
-                    for enc in encodings_to_try:
-                        try:
-                            with open(file_path, 'r', encoding=enc) as f:
-                                content = f.read()
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                        except Exception as read_err:
-                             print(f"  Error reading text file {filename} with {enc}: {read_err}")
-                             content = None
-                             break
-
-                    if content is not None:
-                        timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
-                        extracted_entries.append({"timestamp": timestamp, "sender": "Unknown", "text": content, "source": "txt"})
-                    else:
-                        print(f"  Error: Could not read text file {filename} with any attempted encoding.")
+    def stage(self, name):
+        pass
 
-                except Exception as e:
-                    print(f"  Error processing text file {filename}: {e}")
-            elif source_type == 'image':
-                print(f"  Image file detected: {filename}. Processing not yet implemented.")
-                timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
-                extracted_entries.append({"timestamp": timestamp, "sender": "System", "text": f"[Image File: {filename}]", "source": "image"})
-            elif source_type != 'bad_zip' and source_type != 'unknown_zip':
-                print(f"  Skipping unsupported or unknown file type: {filename} ({source_type})")
-
-            print(f"  Extracted {len(extracted_entries)} entries from {filename}.")
-            if extracted_entries:
-                processed_files_set.add(filename)
-                for entry in extracted_entries:
+    def file(self, filename, **fields):
+        pass
+
+    def years_to_write(self, years):
+        pass
+
+    def year_written(self, year):
+        pass
+
+    def cancelled(self):
+        return False
+
+def _check_cancelled(progress):
+    if progress.cancelled():
+        raise IngestCancelled("Ingestion was cancelled.")
+
+def _ingest_file(file_path, executor=None, source_type=None):
+    """
+    Extracts one file and buckets its entries by year. Runs either as a process pool
+    work unit or in the parent, where executor fans the file's conversations out instead.
+    Returns a tuple: (number of extracted entries, {year: entries}, stats), where stats holds the
+    parser, the file size, the seconds per stage and the file's ParseReport, to be recorded by the parent.
+    """
+    filename = os.path.basename(file_path)
+    logger.info(f"\nProcessing file: {filename}")
+    timings = {}
+    report = diagnostics.ParseReport(filename)
+    with diagnostics.collecting(report):
+        source_type, extracted_entries = extract_file_entries(file_path, executor, source_type, timings)
+        logger.info(f"  Extracted {len(extracted_entries)} entries from {filename}.")
+        start = time.perf_counter()
+        buckets = bucket_entries_by_year(file_path, extracted_entries)
+        timings['bucket'] = time.perf_counter() - start
+    report.parser = source_type
+    report.messages = len(extracted_entries)
+    if report.counts:
+        logger.warning(f"  Parse warnings in {filename}: {report.summary()}")
+    stats = {'parser': source_type, 'bytes': os.path.getsize(file_path), 'timings': timings, 'report': report}
+    return len(extracted_entries), buckets, stats
+
+def _record_parse_metrics(entry_count, stats):
+    for stage, seconds in stats['timings'].items():
+        INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+    parser = stats['parser']
+    PARSER_BYTES.inc(stats['bytes'], parser=parser)
+    PARSER_MESSAGES.inc(entry_count, parser=parser)
+    PARSER_SECONDS.inc(sum(seconds for stage, seconds in stats['timings'].items() if stage != 'bucket'), parser=parser)
+    for kind, count in stats['report'].counts.items():
+        PARSE_WARNINGS.inc(count, parser=parser, kind=kind)
+
+def _configured_ingest_workers():
+    """
+    Reads the ingestion worker count from GHOSTTEXT_INGEST_WORKERS.
+    Defaults to 1 (serial); 0 means one worker per CPU core.
+    """
+    value = os.environ.get('GHOSTTEXT_INGEST_WORKERS')
+    if not value:
+        return 1
+    try:
+        workers = int(value)
+    except ValueError:
+        logger.warning(f"Warning: Invalid GHOSTTEXT_INGEST_WORKERS '{value}'. Must be an integer. Using serial ingestion.")
+        return 1
+    if workers == 0:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+def _report_parsed(progress, file_path, result):
+    entry_count, buckets, stats = result
+    _record_parse_metrics(entry_count, stats)
+    progress.file(os.path.basename(file_path), stage='parsed', messages_parsed=entry_count, years=sorted(buckets), warnings=stats['report'].warning_count)
+
+def _parse_files(file_paths, workers, progress=None):
+    """
+    Runs _ingest_file for every path and returns the results in path order.
+    With workers > 1 the files are parsed in parallel by a process pool, and Discord,
+    Instagram and Facebook packages additionally fan their conversations out to the same pool.
+    progress is told when each file is parsed; on cancellation files not yet started are dropped,
+    files already being parsed are waited for, and IngestCancelled is raised.
+    """
+    if progress is None:
+        progress = IngestProgress()
+    if workers <= 1 or not file_paths:
+        results = []
+        for file_path in file_paths:
+            _check_cancelled(progress)
+            progress.file(os.path.basename(file_path), stage='parsing')
+            results.append(_ingest_file(file_path))
+            _report_parsed(progress, file_path, results[-1])
+        return results
+
+    logger.info(f"  Ingesting {len(file_paths)} files with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Whole files go to the pool first; archives with many conversations are then
+        # driven from here so their per-conversation units share the same workers.
+        source_types = []
+        for file_path in file_paths:
+            with INGEST_STAGE_SECONDS.time(stage='detect'):
+                source_types.append(detect_source(file_path))
+        pending = {}
+        try:
+            for index, (file_path, source_type) in enumerate(zip(file_paths, source_types)):
+                if source_type not in _CONVERSATION_ARCHIVE_SOURCES:
+                    pending[index] = executor.submit(_ingest_file, file_path, None, source_type)
+                    progress.file(os.path.basename(file_path), stage='queued')
+            results = []
+            for index, (file_path, source_type) in enumerate(zip(file_paths, source_types)):
+                if index in pending:
+                    results.append(None)
+                else:
+                    _check_cancelled(progress)
+                    progress.file(os.path.basename(file_path), stage='parsing')
+                    results.append(_ingest_file(file_path, executor, source_type))
+                    _report_parsed(progress, file_path, results[-1])
+            for index, future in pending.items():
+                while results[index] is None:
                     try:
-                        year = int(entry.get("timestamp", "0000")[:4])
-                        if year > 0:
-                            if year not in all_data:
-                                all_data[year] = []
-                            all_data[year].append(entry)
-                        else:
-                             print(f"Warning: Invalid year '0000' or less found for entry in {filename}. Attempting fallback.")
-                             raise ValueError("Invalid year")
-                    except (ValueError, TypeError, IndexError):
-                         try:
-                             mod_time = os.path.getmtime(file_path)
-                             year = datetime.fromtimestamp(mod_time).year
-                             if year > 0:
-                                 print(f"  Fallback: Using file modification year {year} for an entry from {filename} due to invalid timestamp: {entry.get('timestamp')}")
-                                 if year not in all_data:
-                                     all_data[year] = []
-                                 all_data[year].append(entry)
-                             else:
-                                  print(f"Warning: Could not determine fallback year for an entry from {filename}. Entry: {entry}")
-                         except Exception as mod_err:
-                              print(f"Warning: Could not determine fallback year for an entry from {filename} (mod time error: {mod_err}). Entry: {entry}")
-            else:
-                unprocessed_files.append(filename)
-
-    os.makedirs(processed_data_dir, exist_ok=True)
-    processed_years = set()
-    if not all_data:
-        print("\nNo data entries were successfully extracted to save.")
-        return processed_years, files_in_data_dir
-
-    print("\nSaving processed data by year...")
-    for year, entries in all_data.items():
-        entries.sort(key=lambda x: x.get('timestamp', '0'))
-
-        filtered_entries = []
-        last_added_entry = None
-        for entry in entries:
-            is_duplicate = False
-            if last_added_entry:
-                if (entry.get('timestamp') == last_added_entry.get('timestamp') and
-                    entry.get('sender') == last_added_entry.get('sender') and
-                    entry.get('text') == last_added_entry.get('text') and
-                    entry.get('source') == last_added_entry.get('source')):
-                    is_duplicate = True
-
-            if not is_duplicate:
-                filtered_entries.append(entry)
-                last_added_entry = entry
-
-        if not filtered_entries:
-             print(f"Skipping year {year} as no entries remained after filtering duplicates.")
-             continue
-
-        output_path = os.path.join(processed_data_dir, f"{year}.json")
+                        results[index] = future.result(timeout=0.25)
+                    except FutureTimeoutError:
+                        _check_cancelled(progress)
+                _report_parsed(progress, file_paths[index], results[index])
+        except IngestCancelled:
+            for future in pending.values():
+                future.cancel()
+            raise
+    return results
+
+MANIFEST_FILENAME = "manifest.json"
+# Bumped whenever parsers change the shape of stored entries, so older contributions are re-parsed.
+MANIFEST_VERSION = 2
+CONTRIBUTIONS_DIRNAME = "contributions"
+
+def file_content_hash(file_path, chunk_size=1024 * 1024, on_chunk=None):
+    """
+    Returns the hex SHA-256 of a file's contents, read in chunks.
+    on_chunk, if given, is called with the number of bytes read so far after every chunk.
+    """
+    digest = hashlib.sha256()
+    bytes_read = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            bytes_read += len(chunk)
+            if on_chunk is not None:
+                on_chunk(bytes_read)
+    return digest.hexdigest()
+
+def _write_json_atomic(path, data, **dump_kwargs):
+    """Writes JSON to a temporary file next to path and renames it into place."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **dump_kwargs)
+    os.replace(temp_path, path)
+
+def load_manifest(processed_data_dir):
+    """
+    Loads the ingestion manifest, which records for every ingested file its content hash,
+    size, mtime and the number of entries it contributed to each year.
+    Returns an empty manifest if none exists, it cannot be read or it was written for an older entry layout.
+    """
+    manifest_path = os.path.join(processed_data_dir, MANIFEST_FILENAME)
+    empty_manifest = {"version": MANIFEST_VERSION, "files": {}}
+    if not os.path.exists(manifest_path):
+        return empty_manifest
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if not isinstance(manifest, dict) or not isinstance(manifest.get('files'), dict):
+            raise ValueError("unexpected manifest layout")
+        if manifest.get('version') != MANIFEST_VERSION:
+            logger.info(f"Ingestion manifest {manifest_path} is from an older version. Reprocessing all files.")
+            return empty_manifest
+        return manifest
+    except Exception as e:
+        logger.warning(f"Warning: Could not read ingestion manifest {manifest_path}: {e}. Reprocessing all files.")
+        return empty_manifest
+
+def _save_manifest(processed_data_dir, manifest):
+    _write_json_atomic(os.path.join(processed_data_dir, MANIFEST_FILENAME), manifest, indent=2, ensure_ascii=False)
+
+KNOWN_HASHES_FILENAME = "known_hashes.json"
+# Not ingest_lock: recording a hash must not wait for a running ingestion to finish.
+_known_hashes_lock = threading.Lock()
+
+def _load_known_hashes(processed_data_dir):
+    path = os.path.join(processed_data_dir, KNOWN_HASHES_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            known_hashes = json.load(f)
+        return known_hashes if isinstance(known_hashes, dict) else {}
+    except Exception as e:
+        logger.warning(f"Warning: Could not read known file hashes {path}: {e}")
+        return {}
+
+def remember_file_hash(processed_data_dir, filename, sha256, stat):
+    """
+    Records the SHA-256 of a file in the data directory that was computed elsewhere, e.g. by a
+    chunked upload as its bytes arrived, so process_data does not read the file again to hash it.
+    The hash is only used while the file's size and mtime still match stat.
+    """
+    with _known_hashes_lock:
+        known_hashes = _load_known_hashes(processed_data_dir)
+        known_hashes[filename] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        os.makedirs(processed_data_dir, exist_ok=True)
+        _write_json_atomic(os.path.join(processed_data_dir, KNOWN_HASHES_FILENAME), known_hashes)
+
+def _forget_known_hashes(processed_data_dir, data_dir, manifest):
+    """Drops the known hashes now recorded in the manifest or whose file is gone."""
+    with _known_hashes_lock:
+        known_hashes = _load_known_hashes(processed_data_dir)
+        remaining = {}
+        for filename, known in known_hashes.items():
+            record = manifest['files'].get(filename)
+            if record and record.get('sha256') == known.get('sha256') and record.get('mtime_ns') == known.get('mtime_ns'):
+                continue
+            if not os.path.isfile(os.path.join(data_dir, filename)):
+                continue
+            remaining[filename] = known
+        if remaining != known_hashes:
+            _write_json_atomic(os.path.join(processed_data_dir, KNOWN_HASHES_FILENAME), remaining)
+
+def _matches_stat(record, stat):
+    return bool(record) and record.get('size') == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns
+
+def _contribution_path(processed_data_dir, filename):
+    """Path of the file holding the entries one uploaded file contributed, bucketed by year."""
+    name_digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return os.path.join(processed_data_dir, CONTRIBUTIONS_DIRNAME, f"{name_digest}.json")
+
+def _remove_contribution(processed_data_dir, filename):
+    contribution_path = _contribution_path(processed_data_dir, filename)
+    if os.path.exists(contribution_path):
+        os.remove(contribution_path)
+
+def _write_year_shard(processed_data_dir, year, entries):
+    """
+    Sorts and de-duplicates one year's entries and stores them in the message store.
+    Removes the year instead when no entries are left. Returns True if the year was written.
+    """
+    dedup_start = time.perf_counter()
+    entries.sort(key=lambda x: x.get('timestamp', '0'))
+
+    filtered_entries = []
+    last_added_entry = None
+    for entry in entries:
+        is_duplicate = False
+        if last_added_entry:
+            if (entry.get('timestamp') == last_added_entry.get('timestamp') and
+                entry.get('sender') == last_added_entry.get('sender') and
+                entry.get('text') == last_added_entry.get('text') and
+                entry.get('source') == last_added_entry.get('source')):
+                is_duplicate = True
+
+        if not is_duplicate:
+            filtered_entries.append(entry)
+            last_added_entry = entry
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - dedup_start, stage='dedup')
+
+    if not filtered_entries:
+         logger.info(f"Removing year {year} as no entries remain.")
+         message_store.delete_year(processed_data_dir, year)
+         semantic_index.remove_year(processed_data_dir, year)
+         _year_data_cache.invalidate(_year_cache_store_key(processed_data_dir), year)
+         return False
+
+    try:
+        with INGEST_STAGE_SECONDS.time(stage='write'):
+            version = message_store.replace_year(processed_data_dir, year, filtered_entries)
+        _year_data_cache.invalidate(_year_cache_store_key(processed_data_dir), year)
+        logger.info(f"Saved {len(filtered_entries)} entries for {year} to {message_store.store_path(processed_data_dir)} (Original: {len(entries)})")
+    except Exception as e:
+        logger.error(f"Error saving data for year {year} to {message_store.store_path(processed_data_dir)}: {e}")
+        return False
+
+    try:
+        with INGEST_STAGE_SECONDS.time(stage='index'):
+            semantic_index.build_year(processed_data_dir, year, filtered_entries, version)
+    except Exception as e:
+        # Not fatal: the index is rebuilt from the store on the next search.
+        logger.warning(f"Warning: Could not build semantic index for {year}: {e}")
+    return True
+
+def _rewrite_year_shards(processed_data_dir, manifest, years, progress=None):
+    """
+    Rebuilds the given year shards from the stored per-file contributions, merging files
+    in manifest (sorted filename) order so the result matches a full re-ingestion.
+    """
+    if progress is None:
+        progress = IngestProgress()
+    progress.years_to_write(sorted(years))
+    contributions = {}
+    for year in sorted(years):
+        year_key = str(year)
+        entries = []
+        for filename, record in manifest['files'].items():
+            if year_key not in record.get('years', {}):
+                continue
+            if filename not in contributions:
+                try:
+                    with open(_contribution_path(processed_data_dir, filename), 'r', encoding='utf-8') as f:
+                        contributions[filename] = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error: Could not load stored entries for {filename}: {e}")
+                    contributions[filename] = {}
+            entries.extend(contributions[filename].get(year_key, []))
+        _write_year_shard(processed_data_dir, year, entries)
+        progress.year_written(year)
+
+def _manifest_years(manifest):
+    years = set()
+    for record in manifest['files'].values():
+        years.update(int(year) for year in record.get('years', {}))
+    return years
+
+# Held while the ingestion manifest and the store are changed, so runs from the API, background
+# jobs and file deletions never interleave.
+ingest_lock = threading.RLock()
+
+def process_data(data_dir, processed_data_dir, workers=None, progress=None):
+    """
+    Scans the data directory, processes new or changed files, and saves structured data by year.
+    Files whose content hash matches the ingestion manifest are not parsed again, and only
+    the year shards touched by added, changed or removed files are rewritten. A hash recorded
+    with remember_file_hash (by a chunked upload) saves reading the file to hash it.
+    With workers > 1 the files are parsed in parallel by a process pool, and Discord,
+    Instagram and Facebook packages additionally fan their conversations out to the same
+    pool. Results are merged in filename and conversation order, so the output is
+    identical to serial ingestion.
+    workers defaults to GHOSTTEXT_INGEST_WORKERS (serial when unset).
+    progress (an IngestProgress) is told about every stage and file; if it reports the run as
+    cancelled before the year shards are written, IngestCancelled is raised and nothing is changed.
+    Returns a tuple: (set of years with data, list of unprocessed filenames, parse report), where
+    the parse report (see build_parse_report) covers the files parsed in this run.
+    """
+    with ingest_lock, PROCESS_DATA_SECONDS.time():
+        start = time.perf_counter()
+        processed_years, unprocessed_files, reports = _process_data(data_dir, processed_data_dir, workers, progress or IngestProgress())
+        return processed_years, unprocessed_files, build_parse_report(reports, time.perf_counter() - start)
+
+def build_parse_report(reports, elapsed_seconds):
+    """
+    Combines per-file ParseReports into {'files': [per-file reports], 'warnings': total,
+    'warning_counts': {kind: count}, 'elapsed_seconds': duration of the run}.
+    """
+    warning_counts = {}
+    for report in reports:
+        for kind, count in report.counts.items():
+            warning_counts[kind] = warning_counts.get(kind, 0) + count
+    return {
+        'files': [report.to_dict() for report in reports],
+        'warnings': sum(warning_counts.values()),
+        'warning_counts': warning_counts,
+        'elapsed_seconds': round(elapsed_seconds, 4),
+    }
+
+def _process_data(data_dir, processed_data_dir, workers, progress):
+    progress.stage('scanning')
+    logger.info(f"Scanning directory: {data_dir}")
+    if not os.path.isdir(data_dir):
+        logger.error(f"Error: Data directory '{data_dir}' not found.")
+        return set(), [], []
+
+    files_in_data_dir = sorted(f for f in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, f)))
+    logger.info(f"  Files found in {data_dir}: {files_in_data_dir}")
+
+    os.makedirs(os.path.join(processed_data_dir, CONTRIBUTIONS_DIRNAME), exist_ok=True)
+    manifest = load_manifest(processed_data_dir)
+    previous_files = manifest['files']
+    known_hashes = _load_known_hashes(processed_data_dir)
+    current_files = {}
+    changed_files = []
+    touched_years = set()
+
+    progress.stage('hashing')
+    stats = {}
+    for filename in list(files_in_data_dir):
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(filtered_entries, f, indent=2, ensure_ascii=False)
-            print(f"Saved {len(filtered_entries)} entries for {year} to {output_path} (Original: {len(entries)})")
-            processed_years.add(year)
-        except Exception as e:
-            print(f"Error saving data for year {year} to {output_path}: {e}")
+            stats[filename] = os.stat(os.path.join(data_dir, filename))
+        except FileNotFoundError:
+            # Deleted since the scan, e.g. by a request while this run was queued behind an upload.
+            files_in_data_dir.remove(filename)
+            continue
+        progress.file(filename, stage='hashing', size=stats[filename].st_size, bytes_read=0)
 
-    print(f"Finished saving processed data. Processed years: {processed_years}")
-    return processed_years, unprocessed_files
+    for filename in files_in_data_dir:
+        _check_cancelled(progress)
+        file_path = os.path.join(data_dir, filename)
+        stat = stats[filename]
+        record = previous_files.get(filename)
+        if _matches_stat(record, stat):
+            content_hash = record.get('sha256')
+        elif _matches_stat(known_hashes.get(filename), stat):
+            # Hashed while it was uploaded.
+            content_hash = known_hashes[filename]['sha256']
+            progress.file(filename, bytes_read=stat.st_size)
+        else:
+            def report_read(bytes_read, filename=filename):
+                progress.file(filename, bytes_read=bytes_read)
+                _check_cancelled(progress)
+            content_hash = file_content_hash(file_path, on_chunk=report_read)
+
+        if record and record.get('sha256') == content_hash and os.path.exists(_contribution_path(processed_data_dir, filename)):
+            logger.info(f"  Unchanged since last run, skipping: {filename}")
+            current_files[filename] = dict(record, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            progress.file(filename, stage='unchanged', messages_parsed=record.get('entry_count', 0))
+        else:
+            changed_files.append((filename, content_hash, stat))
+            progress.file(filename, stage='queued')
+
+    if workers is None:
+        workers = _configured_ingest_workers()
+    progress.stage('parsing')
+    results = _parse_files([os.path.join(data_dir, changed[0]) for changed in changed_files], workers, progress)
+    reports = [stats['report'] for _, _, stats in results]
+    _check_cancelled(progress)
+    progress.stage('writing')
+
+    changed_filenames = {changed[0] for changed in changed_files}
+    for filename, record in previous_files.items():
+        if filename not in current_files and filename not in changed_filenames:
+            logger.info(f"  File no longer present, retracting its entries: {filename}")
+            touched_years.update(int(year) for year in record.get('years', {}))
+            _remove_contribution(processed_data_dir, filename)
+
+    for (filename, content_hash, stat), (entry_count, buckets, _) in zip(changed_files, results):
+        old_record = previous_files.get(filename)
+        if old_record:
+            touched_years.update(int(year) for year in old_record.get('years', {}))
+        touched_years.update(buckets.keys())
+        _write_json_atomic(_contribution_path(processed_data_dir, filename), buckets, ensure_ascii=False)
+        current_files[filename] = {
+            "sha256": content_hash,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "entry_count": entry_count,
+            "years": {str(year): len(year_entries) for year, year_entries in sorted(buckets.items())},
+        }
+
+    manifest['files'] = {filename: current_files[filename] for filename in files_in_data_dir}
+    processed_years = _manifest_years(manifest)
+    # Years that went missing from the store behind the manifest's back are rebuilt as well,
+    # and stored years no file contributes to any more are dropped.
+    stored_years = set(message_store.list_years(processed_data_dir))
+    touched_years.update(processed_years ^ stored_years)
+
+    if touched_years:
+        logger.info(f"\nRewriting year shards: {sorted(touched_years)}")
+        _rewrite_year_shards(processed_data_dir, manifest, touched_years, progress)
+    _save_manifest(processed_data_dir, manifest)
+    if known_hashes:
+        _forget_known_hashes(processed_data_dir, data_dir, manifest)
+    progress.stage('done')
+
+    if not processed_years:
+        logger.info("\nNo data entries were successfully extracted to save.")
+        return set(), files_in_data_dir, reports
+
+    unprocessed_files = [filename for filename in files_in_data_dir if not manifest['files'][filename].get('entry_count')]
+    logger.info(f"Finished saving processed data. Processed years: {processed_years}")
+    return processed_years, unprocessed_files, reports
+
+def retract_file(processed_data_dir, filename):
+    """
+    Removes the entries one uploaded file contributed, rewriting only the year shards it touched.
+    Returns the set of years that were rewritten.
+    """
+    with ingest_lock:
+        return _retract_file(processed_data_dir, filename)
+
+def _retract_file(processed_data_dir, filename):
+    manifest = load_manifest(processed_data_dir)
+    record = manifest['files'].pop(filename, None)
+    if record is None:
+        return set()
+
+    touched_years = {int(year) for year in record.get('years', {})}
+    logger.info(f"Retracting {filename} from years {sorted(touched_years)}")
+    _remove_contribution(processed_data_dir, filename)
+    _rewrite_year_shards(processed_data_dir, manifest, touched_years)
+    _save_manifest(processed_data_dir, manifest)
+    return touched_years
+
+def check_store(data_dir, processed_data_dir):
+    """
+    Checks that the processed store is up to date with the data directory, without reading any
+    file contents: every file must be in the ingestion manifest with its current size and mtime
+    and a stored contribution, and the stored years must be exactly the manifest's years.
+    Returns {'consistent': bool, 'files': [{'name', 'size'}], 'years': [stored years],
+    'problems': [descriptions]}; any problem is fixed by the next process_data run.
+    """
+    manifest = load_manifest(processed_data_dir)
+    files = []
+    problems = []
+    if os.path.isdir(data_dir):
+        for filename in sorted(os.listdir(data_dir)):
+            file_path = os.path.join(data_dir, filename)
+            if not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            files.append({'name': filename, 'size': stat.st_size})
+            record = manifest['files'].get(filename)
+            if record is None:
+                problems.append(f"not processed: {filename}")
+            elif not _matches_stat(record, stat):
+                problems.append(f"changed since processing: {filename}")
+            elif not os.path.exists(_contribution_path(processed_data_dir, filename)):
+                problems.append(f"stored entries missing: {filename}")
+    present = {record['name'] for record in files}
+    for filename in manifest['files']:
+        if filename not in present:
+            problems.append(f"removed since processing: {filename}")
+
+    stored_years = set(get_available_years(processed_data_dir))
+    manifest_years = _manifest_years(manifest)
+    if manifest_years - stored_years:
+        problems.append(f"years missing from the store: {sorted(manifest_years - stored_years)}")
+    if stored_years - manifest_years:
+        problems.append(f"years no file contributes to: {sorted(stored_years - manifest_years)}")
+    return {'consistent': not problems, 'files': files, 'years': sorted(stored_years), 'problems': problems}
 
 def get_available_years(processed_data_dir):
-    """Scans the processed data directory for available year files (YYYY.json)."""
-    available_years = set()
-    if not os.path.exists(processed_data_dir):
-        return available_years
-
-    for filename in os.listdir(processed_data_dir):
-        if filename.endswith('.json'):
-            file_path = os.path.join(processed_data_dir, filename)
-            if os.path.isfile(file_path):
-                match = re.match(r"(\d{4})\.json", filename)
-                if match:
-                    try:
-                        year = int(match.group(1))
-                        available_years.add(year)
-                    except ValueError:
-                        continue
-    return available_years
+    """Returns the set of years that have data in the message store."""
+    try:
+        return set(message_store.list_years(processed_data_dir))
+    except Exception as e:
+        logger.error(f"Error reading available years from {message_store.store_path(processed_data_dir)}: {e}")
+        return set()
+
+def _configured_year_cache_bytes():
+    """
+    Reads the year cache ceiling in megabytes from GHOSTTEXT_YEAR_CACHE_MB.
+    Defaults to 256; 0 disables the cache.
+    """
+    value = os.environ.get('GHOSTTEXT_YEAR_CACHE_MB')
+    if not value:
+        return 256 * 1024 * 1024
+    try:
+        megabytes = float(value)
+    except ValueError:
+        logger.warning(f"Warning: Invalid GHOSTTEXT_YEAR_CACHE_MB '{value}'. Must be a number. Using 256.")
+        return 256 * 1024 * 1024
+    return max(0, int(megabytes * 1024 * 1024))
+
+def _estimate_entries_size(entries):
+    """Approximate memory held by a list of entry dicts, counting the dicts and their values."""
+    size = sys.getsizeof(entries)
+    for entry in entries:
+        size += sys.getsizeof(entry)
+        for value in entry.values():
+            size += sys.getsizeof(value)
+    return size
+
+class _YearDataCache:
+    """
+    Thread-safe LRU cache of loaded years, bounded by the estimated memory of the cached entries.
+    Keys are (store path, year, version); the version is the year's content hash in the message
+    store, so a rewritten year is never served stale even if invalidate() was not called.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def put(self, key, data):
+        if self.max_bytes <= 0:
+            return
+        size = _estimate_entries_size(data)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (data, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, store_path, year=None):
+        """Drops the cached versions of one year (or every year) of a store."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == store_path and (year is None or key[1] == year)]:
+                self.current_bytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "cached_years": len(self.entries),
+                "cached_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+_year_data_cache = _YearDataCache(_configured_year_cache_bytes())
+
+def _year_cache_store_key(processed_data_dir):
+    return os.path.abspath(message_store.store_path(processed_data_dir))
+
+def get_year_version(processed_data_dir, year):
+    """
+    Returns an identifier of one year's current contents (a hash that changes whenever the year is
+    rewritten), or None if the year has no data. Use it to key anything derived from a year.
+    """
+    try:
+        return message_store.year_version(processed_data_dir, year)
+    except Exception as e:
+        logger.error(f"Error reading the version of year {year} from {message_store.store_path(processed_data_dir)}: {e}")
+        return None
+
+def get_year_cache_stats():
+    """Returns the load_year_data cache counters: hits, misses, evictions, cached_years, cached_bytes, max_bytes."""
+    return _year_data_cache.stats()
 
 def load_year_data(processed_data_dir, year):
-    """Loads the processed data for a specific year."""
-    file_path = os.path.join(processed_data_dir, f"{year}.json")
-    if not os.path.exists(file_path):
-        print(f"Error: Processed data file not found for year {year} at {file_path}")
-        return []
+    """
+    Loads the processed data for a specific year.
+    Results are cached in memory (see GHOSTTEXT_YEAR_CACHE_MB) until the year is rewritten; the
+    returned list is a fresh copy but the entry dicts are shared, so callers must not modify them.
+    """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        start = time.perf_counter()
+        version = message_store.year_version(processed_data_dir, year)
+        if version is None:
+            logger.error(f"Error: Processed data not found for year {year} in {message_store.store_path(processed_data_dir)}")
+            return []
+        cache_key = (_year_cache_store_key(processed_data_dir), year, version)
+        data = _year_data_cache.get(cache_key)
+        cache_result = 'hit'
+        if data is None:
+            cache_result = 'miss'
+            data = message_store.load_year(processed_data_dir, year)
+            if data is None:
+                logger.error(f"Error: Processed data not found for year {year} in {message_store.store_path(processed_data_dir)}")
+                return []
+            _year_data_cache.put(cache_key, data)
+        data = list(data)
+        LOAD_YEAR_DATA_SECONDS.observe(time.perf_counter() - start, cache=cache_result)
         return data
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from file {file_path}")
-        return []
     except Exception as e:
-        print(f"Error loading data for year {year} from {file_path}: {e}")
+        logger.error(f"Error loading data for year {year} from {message_store.store_path(processed_data_dir)}: {e}")
         return []
+
+def get_year_metadata(processed_data_dir, year):
+    """
+    Returns the metadata ingestion stored for one year, or None if the year has no data:
+    {"year", "entry_count", "sender_counts": {source_type: {sender: count}},
+     "conversations": [{"source", "source_type", "display_name", "message_count", "first_timestamp", "last_timestamp"}]}
+    """
+    try:
+        return message_store.load_metadata(processed_data_dir, [year]).get(year)
+    except Exception as e:
+        logger.error(f"Error loading metadata for year {year} from {message_store.store_path(processed_data_dir)}: {e}")
+        return None
+
+def get_all_year_metadata(processed_data_dir):
+    """Returns {year: metadata} for every year with data (see get_year_metadata)."""
+    try:
+        return message_store.load_metadata(processed_data_dir)
+    except Exception as e:
+        logger.error(f"Error loading metadata from {message_store.store_path(processed_data_dir)}: {e}")
+        return {}
+
+def query_messages(processed_data_dir, year=None, sender=None, source_type=None, conversation_id=None, start=None, end=None, limit=None, newest_first=False):
+    """
+    Returns entries matching the given filters, oldest first, e.g. messages from one sender in March 2019:
+    query_messages(processed_data_dir, sender="Alice", start="2019-03", end="2019-04").
+    """
+    return message_store.query_messages(processed_data_dir, year, sender, source_type, conversation_id, start, end, limit, newest_first)
+
+def search_messages(processed_data_dir, text, year=None, limit=20):
+    """
+    Returns the entries most relevant to free text, best first, ranked with BM25 over
+    message text, chat partner names and sender. Any word of text may match.
+    """
+    match_query = message_store.match_any_terms(text)
+    return [entry for entry, score in message_store.bm25_search(processed_data_dir, match_query, year, limit)]
+
+def find_related_messages(processed_data_dir, text, year, limit=10):
+    """
+    Returns the entries of a year most similar in wording to text, as (entry, score) pairs, best first.
+    Uses the semantic index (hashed character n-grams, cosine similarity), so near matches
+    such as "holidays" for "holiday" are found without sharing a whole word.
+    """
+    [hits] = semantic_index.search(processed_data_dir, year, [text], limit)
+    entries = message_store.load_entries_at(processed_data_dir, year, [seq for seq, score in hits])
+    return list(zip(entries, (score for seq, score in hits)))
+
+def search_corpus(processed_data_dir, query, year=None, sender=None, source_type=None, conversation_id=None, sort='newest', cursor=None, limit=50):
+    """
+    Searches message text across all years (or one), e.g. search_corpus(dir, '"road trip" bali*', sender="Alice").
+    Supports "phrases", prefix* and -excluded terms (see message_store.parse_search_query).
+    Returns (entries, next_cursor); pass next_cursor back for the following page.
+    Raises ValueError if the query has nothing to search for or the sort or cursor is invalid.
+    """
+    match_expression = message_store.parse_search_query(query)
+    if not match_expression:
+        raise ValueError("Search query contains no words to search for.")
+    return message_store.full_text_search(processed_data_dir, match_expression, year, sender, source_type, conversation_id, sort, cursor, limit)
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+
+# Parse warnings (an unparseable line, a malformed message, a file that cannot be read) are
+# collected per uploaded file in a ParseReport instead of being printed one by one: the first
+# MAX_SAMPLES_PER_KIND of each kind are logged and kept as samples, the rest are only counted.
+
+MAX_SAMPLES_PER_KIND = 3
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+_logging_configured = False
+_logging_lock = threading.Lock()
+_active_reports = threading.local()
+
+class _CurrentStdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is when a record is emitted, like print does."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+def _configured_log_level():
+    value = os.environ.get('GHOSTTEXT_LOG_LEVEL')
+    if not value:
+        return logging.INFO
+    if value.strip().upper() in LOG_LEVELS:
+        return getattr(logging, value.strip().upper())
+    print(f"Warning: Invalid GHOSTTEXT_LOG_LEVEL '{value}'. Must be one of {', '.join(LOG_LEVELS)}. Using INFO.")
+    return logging.INFO
+
+def get_logger(name):
+    """
+    Returns the logger for a backend module. All of them write plain messages to stdout at
+    GHOSTTEXT_LOG_LEVEL (default INFO); DEBUG adds per-file and per-member details.
+    """
+    global _logging_configured
+    with _logging_lock:
+        if not _logging_configured:
+            root = logging.getLogger('ghosttext')
+            handler = _CurrentStdoutHandler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            root.addHandler(handler)
+            root.setLevel(_configured_log_level())
+            root.propagate = False
+            _logging_configured = True
+    return logging.getLogger(f'ghosttext.{name}')
+
+logger = get_logger('diagnostics')
+
+class ParseReport:
+    """
+    Diagnostics of parsing one uploaded file: its parser, the messages extracted, the time taken,
+    warning counts by kind and the first few warnings of each kind.
+    """
+
+    def __init__(self, filename, parser=None, log=True):
+        self.filename = filename
+        self.parser = parser
+        # False for reports filled in worker processes: their samples are logged once merged
+        # into the file's report, so the "first few of each kind" limit holds per file.
+        self.log = log
+        self.messages = 0
+        self.elapsed_seconds = 0.0
+        self.counts = OrderedDict()
+        self.samples = OrderedDict()
+
+    def warn(self, kind, message):
+        """Counts a warning; returns True if it is one of the first of its kind (and should be logged)."""
+        count = self.counts.get(kind, 0) + 1
+        self.counts[kind] = count
+        if count <= MAX_SAMPLES_PER_KIND:
+            self.samples.setdefault(kind, []).append(message)
+            return True
+        return False
+
+    def merge(self, other):
+        """
+        Adds the warnings of other, e.g. a conversation parsed in a worker process.
+        Returns the samples of other this report kept, as (kind, message) pairs.
+        """
+        kept = []
+        for kind, count in other.counts.items():
+            self.counts[kind] = self.counts.get(kind, 0) + count
+            samples = self.samples.setdefault(kind, [])
+            new_samples = other.samples.get(kind, [])[:MAX_SAMPLES_PER_KIND - len(samples)]
+            samples.extend(new_samples)
+            kept.extend((kind, message) for message in new_samples)
+        return kept
+
+    @property
+    def warning_count(self):
+        return sum(self.counts.values())
+
+    def summary(self):
+        """One line with the warning counts, e.g. "1204 orphan_line (3 shown), 2 unparsed_timestamp"."""
+        parts = []
+        for kind, count in self.counts.items():
+            suppressed = count - len(self.samples.get(kind, []))
+            parts.append(f"{count} {kind}" + (f" ({count - suppressed} shown)" if suppressed else ""))
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {
+            'file': self.filename,
+            'parser': self.parser,
+            'messages': self.messages,
+            'elapsed_seconds': round(self.elapsed_seconds, 4),
+            'warnings': self.warning_count,
+            'warning_counts': dict(self.counts),
+            'samples': {kind: list(samples) for kind, samples in self.samples.items()},
+        }
+
+def active_report():
+    """The ParseReport warnings in this thread are collected into, or None."""
+    stack = getattr(_active_reports, 'stack', None)
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def collecting(report):
+    """Collects the warnings raised in this thread inside the with-block into report, timing it."""
+    stack = getattr(_active_reports, 'stack', None)
+    if stack is None:
+        stack = _active_reports.stack = []
+    stack.append(report)
+    start = time.perf_counter()
+    try:
+        yield report
+    finally:
+        report.elapsed_seconds += time.perf_counter() - start
+        stack.pop()
+
+def warn(kind, message):
+    """
+    Records a parse warning of the given kind in the active report, logging it only while
+    it is among the first few of its kind. Without an active report it is always logged.
+    """
+    report = active_report()
+    if report is None:
+        logger.warning(message)
+    elif report.warn(kind, message) and report.log:
+        logger.warning(message)
+
+def merge_worker_report(worker_report):
+    """
+    Merges a report collected without logging in a worker process into this thread's active
+    report and logs the samples it keeps, so a file fanned out to workers logs no more than one
+    parsed here. Without an active report the worker's samples are logged as they are.
+    """
+    report = active_report()
+    if report is None:
+        samples = [(kind, message) for kind, messages in worker_report.samples.items() for message in messages]
+    else:
+        samples = report.merge(worker_report)
+        if not report.log:
+            return
+    for _, message in samples:
+        logger.warning(message)
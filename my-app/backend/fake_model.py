@@ -0,0 +1,98 @@
+import os
+import time
+
+def _configured_delay_seconds():
+    """Reads the pause between streamed chunks from GHOSTTEXT_FAKE_MODEL_DELAY_MS (default 40)."""
+    value = os.environ.get('GHOSTTEXT_FAKE_MODEL_DELAY_MS')
+    if not value:
+        return 0.04
+    try:
+        return max(0.0, float(value) / 1000)
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_FAKE_MODEL_DELAY_MS '{value}'. Must be a number. Using 40.")
+        return 0.04
+
+def _content_text(content):
+    """Text of a history item or message, whether it is a plain string or a {'role', 'parts'} dict."""
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else str(part) for part in content.get('parts', []))
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeResponse:
+    """A reply, iterable as chunks like a streamed Gemini response; .text is the whole reply."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.text = "".join(chunks)
+
+    def __iter__(self):
+        return (FakeChunk(chunk) for chunk in self.chunks)
+
+class FakeStreamResponse:
+    """A streamed reply. The turn is added to the chat history once every chunk has been read."""
+
+    def __init__(self, chat, message, chunks, delay):
+        self.chat = chat
+        self.message = message
+        self.chunks = chunks
+        self.delay = delay
+        self.text = ""
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            self.text += chunk
+            yield FakeChunk(chunk)
+        self.chat._finish_turn(self)
+
+class FakeChatSession:
+    """
+    Offline stand-in for google.generativeai's ChatSession: same send_message(content, stream=...),
+    history and rewind(). Replies are deterministic and say which turn and message they answer.
+    """
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+        self._pending = None
+
+    def _reply_chunks(self, message):
+        text = _content_text(message)
+        last_line = text.strip().splitlines()[-1] if text.strip() else ""
+        words = f"(offline reply {len(self.history) // 2}) You said: {last_line}".split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+    def send_message(self, content, stream=False):
+        chunks = self._reply_chunks(content)
+        if stream:
+            self._pending = FakeStreamResponse(self, content, chunks, self.model.delay)
+            return self._pending
+        time.sleep(self.model.delay * len(chunks))
+        response = FakeResponse(chunks)
+        self.history += [{'role': 'user', 'parts': [_content_text(content)]}, {'role': 'model', 'parts': [response.text]}]
+        return response
+
+    def _finish_turn(self, response):
+        if self._pending is response:
+            self._pending = None
+            self.history += [{'role': 'user', 'parts': [_content_text(response.message)]}, {'role': 'model', 'parts': [response.text]}]
+
+    def rewind(self):
+        """Drops the last turn, or the unfinished streamed one."""
+        if self._pending is not None:
+            self._pending = None
+            return
+        del self.history[-2:]
+
+class FakeGenerativeModel:
+    """Offline stand-in for google.generativeai.GenerativeModel, selected with GHOSTTEXT_FAKE_MODEL=1."""
+
+    def __init__(self, delay=None):
+        self.delay = _configured_delay_seconds() if delay is None else delay
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
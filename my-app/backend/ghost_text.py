@@ -14,7 +14,9 @@ def main():
     print(f"\nProcessing data from '{data_dir}'...")
     os.makedirs(processed_data_dir, exist_ok=True)
 
-    processed_years = data_processor.process_data(data_dir, processed_data_dir)
+    processed_years, unprocessed_files, parse_report = data_processor.process_data(data_dir, processed_data_dir)
+    if parse_report['warnings']:
+        print(f"Some lines could not be parsed: {parse_report['warning_counts']}")
 
     if not processed_years:
         print(f"\nNo data could be processed or found in '{data_dir}'.")
@@ -40,30 +42,13 @@ def main():
             print("Invalid input. Please enter a year number.")
 
     print(f"\nLoading data for {selected_year} to identify participants...")
-    year_data = data_processor.load_year_data(processed_data_dir, selected_year)
+    year_metadata = data_processor.get_year_metadata(processed_data_dir, selected_year)
 
-    if not year_data:
+    if not year_metadata:
         print(f"Error: Could not load data for {selected_year} even though it was listed as available.")
         return
 
-    sender_counts_by_source = {}
-    for entry in year_data:
-        sender = entry.get('sender')
-        source_info = entry.get('source', 'Unknown Source')
-        source_type = 'other'
-        if 'whatsapp' in source_info.lower():
-            source_type = 'whatsapp'
-        elif 'discord' in source_info.lower():
-            source_type = 'discord'
-        elif 'instagram' in source_info.lower():
-            source_type = 'instagram'
-        elif 'facebook' in source_info.lower():
-            source_type = 'facebook'
-
-        if sender and sender not in ['System', 'Unknown']:
-            if source_type not in sender_counts_by_source:
-                sender_counts_by_source[source_type] = Counter()
-            sender_counts_by_source[source_type][sender] += 1
+    sender_counts_by_source = {source_type: Counter(sender_counts) for source_type, sender_counts in year_metadata['sender_counts'].items()}
 
     selected_user_names = {}
 
@@ -0,0 +1,192 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import data_processor
+
+FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+FINISHED_JOBS_KEPT = 50
+
+def configured_job_workers():
+    """Reads the number of ingestion jobs run at once from GHOSTTEXT_INGEST_JOBS (default 1)."""
+    value = os.environ.get('GHOSTTEXT_INGEST_JOBS')
+    if not value:
+        return 1
+    try:
+        workers = int(value)
+        if workers < 1:
+            raise ValueError
+        return workers
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_INGEST_JOBS '{value}'. Must be a positive integer. Using 1.")
+        return 1
+
+class IngestJob(data_processor.IngestProgress):
+    """
+    One background ingestion run and its progress: the current stage, per-file progress
+    (size, bytes read, messages parsed, years) and the years written so far.
+    State goes from 'queued' to 'running' and ends as 'succeeded', 'failed' or 'cancelled'.
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = 'queued'
+        self.current_stage = None
+        self.files = OrderedDict()
+        self.years_pending = []
+        self.years_written = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        with self._lock:
+            self.current_stage = name
+
+    def file(self, filename, **fields):
+        with self._lock:
+            record = self.files.setdefault(filename, {'name': filename, 'stage': None, 'size': None, 'bytes_read': 0, 'messages_parsed': 0, 'years': []})
+            record.update(fields)
+
+    def years_to_write(self, years):
+        with self._lock:
+            self.years_pending = list(years)
+
+    def year_written(self, year):
+        with self._lock:
+            self.years_written.append(year)
+
+    def cancelled(self):
+        return self._cancel_requested.is_set()
+
+    def cancel(self):
+        """Asks the job to stop. Returns False if it has already finished."""
+        with self._lock:
+            if self.state in FINISHED_STATES:
+                return False
+            self._cancel_requested.set()
+            return True
+
+    def _progress_fraction(self):
+        if self.state == 'succeeded':
+            return 1.0
+        file_progress = 0.0
+        for record in self.files.values():
+            if record['stage'] in ('unchanged', 'parsed'):
+                file_progress += 1
+            elif record['size']:
+                # Hashing is a fraction of the work of parsing a file.
+                file_progress += 0.2 * min(1, record['bytes_read'] / record['size'])
+        fraction = 0.9 * file_progress / len(self.files) if self.files else 0.0
+        if self.years_pending:
+            fraction = 0.9 + 0.1 * len(self.years_written) / len(self.years_pending)
+        return round(fraction, 3)
+
+    def snapshot(self):
+        """Returns the job's state and progress as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'state': self.state,
+                'cancel_requested': self._cancel_requested.is_set() and self.state not in FINISHED_STATES,
+                'stage': self.current_stage,
+                'progress': self._progress_fraction(),
+                'files': [dict(record) for record in self.files.values()],
+                'bytes_read': sum(record['bytes_read'] for record in self.files.values()),
+                'messages_parsed': sum(record['messages_parsed'] for record in self.files.values()),
+                'years_to_write': list(self.years_pending),
+                'years_written': list(self.years_written),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+class JobManager:
+    """
+    Runs ingestion jobs on a bounded pool of background threads (GHOSTTEXT_INGEST_JOBS) so
+    requests return at once. Keeps every unfinished job and the FINISHED_JOBS_KEPT latest finished ones.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = configured_job_workers() if max_workers is None else max_workers
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ingest-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func):
+        """Queues func(job) as a new job and returns the job; func's return value becomes its result."""
+        job = IngestJob(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_locked()
+        self._executor.submit(self._run, job, func)
+        print(f"Queued {kind} job {job.id}.")
+        return job
+
+    def submit_or_join(self, kind, func):
+        """
+        Returns the queued job of this kind if one has not started yet, since it will see
+        everything present when it starts; otherwise queues func(job) as a new job.
+        Returns (job, joined).
+        """
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.kind != kind:
+                    continue
+                # Checked under the job's lock so it cannot start between the check and the return.
+                with job._lock:
+                    if job.state == 'queued' and not job._cancel_requested.is_set():
+                        return job, True
+        return self.submit(kind, func), False
+
+    def _run(self, job, func):
+        with job._lock:
+            if job._cancel_requested.is_set():
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+                print(f"Job {job.id} was cancelled before it started.")
+                return
+            job.state = 'running'
+            job.started_at = time.time()
+        try:
+            result = func(job)
+            state, error = 'succeeded', None
+        except data_processor.IngestCancelled:
+            result, state, error = None, 'cancelled', None
+        except Exception as e:
+            print(f"Error in {job.kind} job {job.id}: {e}")
+            result, state, error = None, 'failed', str(e)
+        with job._lock:
+            job.result = result
+            job.error = error
+            job.state = state
+            job.finished_at = time.time()
+        print(f"Job {job.id} {state} after {job.finished_at - job.started_at:.1f}s.")
+
+    def _trim_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel_all(self):
+        """Asks every unfinished job to stop. Returns the jobs that were asked."""
+        return [job for job in self.list() if job.cancel()]
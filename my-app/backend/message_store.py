@@ -0,0 +1,544 @@
+import os
+import re
+import sqlite3
+import hashlib
+import json
+import contextlib
+
+STORE_FILENAME = "messages.db"
+
+# Fields every stored entry round-trips through, in the order load_year returns them.
+ENTRY_FIELDS = ("timestamp", "sender", "text", "source", "source_type", "conversation_id", "participants")
+
+# Bumped whenever the tables change; an older store is dropped and rebuilt by the next process_data run.
+SCHEMA_VERSION = 4
+
+# messages.id is year * ROWID_YEAR_STRIDE + seq, so id (and full-text rowid) order is chronological
+# across years and a year is one contiguous id range.
+ROWID_YEAR_STRIDE = 100_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    year INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT,
+    sender TEXT,
+    text TEXT,
+    source TEXT,
+    source_type TEXT NOT NULL,
+    conversation_id TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_year_seq ON messages (year, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_source_type ON messages (year, source_type, sender);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, timestamp);
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    participants TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS years (
+    year INTEGER PRIMARY KEY,
+    entry_count INTEGER NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS year_metadata (
+    year INTEGER PRIMARY KEY,
+    metadata TEXT NOT NULL
+);
+"""
+
+# Full-text index over message text, the conversation's participant names and the sender.
+# rowid is messages.id. Kept in step with messages by replace_year and delete_year.
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, partner, sender,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+# Column weights for bm25(): matches in the message text count twice as much as in names.
+BM25_WEIGHTS = (1.0, 0.5, 0.5)
+
+# None until the first open; False if this SQLite build lacks FTS5, in which case search is unavailable.
+_fts_available = None
+
+# Senders that are never offered as "you" when counting participants.
+EXCLUDED_SENDERS = ('System', 'Unknown')
+
+def store_path(processed_data_dir):
+    return os.path.join(processed_data_dir, STORE_FILENAME)
+
+def store_exists(processed_data_dir):
+    return os.path.isfile(store_path(processed_data_dir))
+
+@contextlib.contextmanager
+def open_store(processed_data_dir):
+    """
+    Opens (and if needed creates) the message store, committing on success and rolling back on error.
+    Connections are short-lived so Flask request threads never share one.
+    """
+    conn = sqlite3.connect(store_path(processed_data_dir), timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("messages", "years", "year_metadata", "conversations", "messages_fts"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.executescript(_SCHEMA)
+        _ensure_fts(conn)
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _ensure_fts(conn):
+    global _fts_available
+    if _fts_available is False:
+        return False
+    try:
+        conn.execute(_FTS_SCHEMA)
+        _fts_available = True
+    except sqlite3.OperationalError as e:
+        print(f"Warning: SQLite full-text search (FTS5) is unavailable ({e}). Message search is disabled.")
+        _fts_available = False
+    return _fts_available
+
+def search_available():
+    """True unless the SQLite build turned out to lack FTS5."""
+    return _fts_available is not False
+
+def classify_source_type(source):
+    """Maps an entry's source string to whatsapp, discord, instagram, facebook or other."""
+    source_lower = (source or '').lower()
+    if 'whatsapp' in source_lower:
+        return 'whatsapp'
+    elif 'discord' in source_lower:
+        return 'discord'
+    elif 'instagram' in source_lower:
+        return 'instagram'
+    elif 'facebook' in source_lower:
+        return 'facebook'
+    return 'other'
+
+def conversation_display_name(source_type, source):
+    """Builds the name a conversation is listed under from its source string."""
+    display_name = source
+
+    if source_type == 'whatsapp':
+        match = re.search(r"WhatsApp Chat with (.*?)(?:\.zip|\.txt)", source, re.IGNORECASE)
+        if match:
+            display_name = f"WhatsApp Chat with {match.group(1).strip()}"
+        elif "whatsapp" in source.lower():
+             display_name = "WhatsApp Chat (Unknown)"
+
+    elif source_type == 'discord':
+        match = re.search(r"Discord DM \((.*?)\)", source, re.IGNORECASE)
+        if match:
+            display_name = f"Discord DM ({match.group(1).strip()})"
+        elif "discord" in source.lower():
+             display_name = "Discord Data (Unknown)"
+
+    elif source_type == 'instagram':
+        chat_match_json = re.search(r"Instagram Chat \((.*?)\)", source, re.IGNORECASE)
+        if chat_match_json:
+             display_name = f"Instagram Chat ({chat_match_json.group(1).strip()})"
+        elif "instagram" in source.lower():
+             path_parts = source.split(os.sep)
+             try:
+                 inbox_index = path_parts.index('inbox')
+                 if inbox_index + 1 < len(path_parts):
+                     display_name = f"Instagram Chat ({path_parts[inbox_index + 1]})"
+                 else:
+                     display_name = "Instagram Data (Unknown Chat)"
+             except ValueError:
+                 display_name = "Instagram Data (Unknown)"
+
+    elif source_type == 'facebook':
+        conv_match = re.search(r"Facebook Conversation \((.*?)\)", source, re.IGNORECASE)
+        if conv_match:
+             display_name = f"Facebook Conversation ({conv_match.group(1).strip()})"
+        elif "facebook" in source.lower():
+             display_name = "Facebook Data (Unknown)"
+
+    return display_name
+
+def build_year_metadata(year, entries):
+    """
+    Summarizes one year without its message bodies: sender counts per source type and the
+    conversation catalog (conversation id, participants, display name, message count and
+    first/last timestamp per source).
+    """
+    sender_counts = {}
+    conversations = {}
+    for entry in entries:
+        source = entry.get('source') or 'Unknown Source'
+        source_type = entry.get('source_type') or classify_source_type(source)
+        sender = entry.get('sender')
+        if sender and sender not in EXCLUDED_SENDERS:
+            source_senders = sender_counts.setdefault(source_type, {})
+            source_senders[sender] = source_senders.get(sender, 0) + 1
+
+        timestamp = entry.get('timestamp')
+        conversation = conversations.get(source)
+        if conversation is None:
+            conversation = conversations[source] = {
+                "source": source,
+                "source_type": source_type,
+                "conversation_id": entry.get('conversation_id'),
+                "participants": entry.get('participants') or [],
+                "display_name": conversation_display_name(source_type, source),
+                "message_count": 0,
+                "first_timestamp": timestamp,
+                "last_timestamp": timestamp,
+            }
+        conversation["message_count"] += 1
+        if isinstance(timestamp, str):
+            if not isinstance(conversation["first_timestamp"], str) or timestamp < conversation["first_timestamp"]:
+                conversation["first_timestamp"] = timestamp
+            if not isinstance(conversation["last_timestamp"], str) or timestamp > conversation["last_timestamp"]:
+                conversation["last_timestamp"] = timestamp
+
+    return {
+        "year": year,
+        "entry_count": len(entries),
+        "sender_counts": sender_counts,
+        "conversations": sorted(conversations.values(), key=lambda c: (c["source_type"], c["display_name"], c["source"])),
+    }
+
+def replace_year(processed_data_dir, year, entries):
+    """
+    Replaces all stored messages of one year with entries, keeping their order, and stores
+    the year's metadata in the same transaction.
+    Returns the new version of the year: a hash of its contents, so readers can tell when it changed.
+    """
+    digest = hashlib.sha256()
+    participants_by_conversation = {}
+
+    def rows():
+        for seq, entry in enumerate(entries):
+            values = tuple(entry.get(field) for field in ENTRY_FIELDS)
+            digest.update(json.dumps(values, ensure_ascii=False).encode('utf-8'))
+            conversation_id = entry.get('conversation_id')
+            if conversation_id not in participants_by_conversation:
+                participants_by_conversation[conversation_id] = entry.get('participants') or []
+            yield (year * ROWID_YEAR_STRIDE + seq, year, seq) + values[:4] + (entry.get('source_type') or classify_source_type(entry.get('source')), conversation_id)
+
+    with open_store(processed_data_dir) as conn:
+        if _fts_available:
+            conn.execute("DELETE FROM messages_fts WHERE rowid BETWEEN ? AND ?", _year_rowid_range(year))
+        conn.execute("DELETE FROM messages WHERE year = ?", (year,))
+        conn.executemany(
+            "INSERT INTO messages (id, year, seq, timestamp, sender, text, source, source_type, conversation_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows()
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO conversations (conversation_id, participants) VALUES (?, ?)",
+            [(conversation_id, json.dumps(participants, ensure_ascii=False))
+             for conversation_id, participants in participants_by_conversation.items() if conversation_id is not None]
+        )
+        if _fts_available:
+            conn.execute(
+                "INSERT INTO messages_fts (rowid, text, partner, sender)"
+                " SELECT m.id, m.text, c.participants, m.sender"
+                " FROM messages m LEFT JOIN conversations c ON c.conversation_id = m.conversation_id"
+                " WHERE m.year = ?",
+                (year,)
+            )
+        version = digest.hexdigest()
+        conn.execute(
+            "INSERT OR REPLACE INTO years (year, entry_count, version) VALUES (?, ?, ?)",
+            (year, len(entries), version)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO year_metadata (year, metadata) VALUES (?, ?)",
+            (year, json.dumps(build_year_metadata(year, entries), ensure_ascii=False))
+        )
+    return version
+
+def delete_year(processed_data_dir, year):
+    if not store_exists(processed_data_dir):
+        return
+    with open_store(processed_data_dir) as conn:
+        if _fts_available:
+            conn.execute("DELETE FROM messages_fts WHERE rowid BETWEEN ? AND ?", _year_rowid_range(year))
+        conn.execute("DELETE FROM messages WHERE year = ?", (year,))
+        conn.execute("DELETE FROM years WHERE year = ?", (year,))
+        conn.execute("DELETE FROM year_metadata WHERE year = ?", (year,))
+
+def list_years(processed_data_dir):
+    """Returns {year: (entry_count, version)} for every stored year."""
+    if not store_exists(processed_data_dir):
+        return {}
+    with open_store(processed_data_dir) as conn:
+        return {year: (entry_count, version) for year, entry_count, version in conn.execute("SELECT year, entry_count, version FROM years")}
+
+def year_version(processed_data_dir, year):
+    """Returns the version of a stored year, or None if the year is not stored."""
+    if not store_exists(processed_data_dir):
+        return None
+    with open_store(processed_data_dir) as conn:
+        row = conn.execute("SELECT version FROM years WHERE year = ?", (year,)).fetchone()
+    return row[0] if row else None
+
+_SELECT_ENTRIES = (
+    "SELECT m.timestamp, m.sender, m.text, m.source, m.source_type, m.conversation_id, c.participants"
+    " FROM messages m LEFT JOIN conversations c ON c.conversation_id = m.conversation_id"
+)
+
+def _rows_to_entries(rows):
+    """Builds entry dicts from _SELECT_ENTRIES rows, decoding each conversation's participants once."""
+    participants_by_json = {}
+    entries = []
+    for row in rows:
+        participants_json = row[6]
+        participants = participants_by_json.get(participants_json)
+        if participants is None:
+            participants = json.loads(participants_json) if participants_json else []
+            participants_by_json[participants_json] = participants
+        entries.append(dict(zip(ENTRY_FIELDS, row[:6] + (participants,))))
+    return entries
+
+def load_year(processed_data_dir, year):
+    """Returns one year's entries in stored order, or None if the year is not stored."""
+    if not store_exists(processed_data_dir):
+        return None
+    with open_store(processed_data_dir) as conn:
+        if conn.execute("SELECT 1 FROM years WHERE year = ?", (year,)).fetchone() is None:
+            return None
+        cursor = conn.execute(_SELECT_ENTRIES + " WHERE m.year = ? ORDER BY m.seq", (year,))
+        return _rows_to_entries(cursor)
+
+def load_entries_at(processed_data_dir, year, seqs):
+    """Returns the entries of one year at the given positions (seq), in the order given."""
+    if not seqs or not store_exists(processed_data_dir):
+        return []
+    placeholders = ", ".join("?" for _ in seqs)
+    with open_store(processed_data_dir) as conn:
+        rows = conn.execute(
+            "SELECT m.seq, m.timestamp, m.sender, m.text, m.source, m.source_type, m.conversation_id, c.participants"
+            " FROM messages m LEFT JOIN conversations c ON c.conversation_id = m.conversation_id"
+            f" WHERE m.year = ? AND m.seq IN ({placeholders})",
+            [year] + list(seqs)
+        ).fetchall()
+    entries_by_seq = dict(zip((row[0] for row in rows), _rows_to_entries(row[1:] for row in rows)))
+    return [entries_by_seq[seq] for seq in seqs if seq in entries_by_seq]
+
+def load_metadata(processed_data_dir, years=None):
+    """
+    Returns {year: metadata} for the given years (all stored years by default) without reading any messages.
+    Metadata missing for a stored year (e.g. a store written before it existed) is rebuilt and saved.
+    """
+    if not store_exists(processed_data_dir):
+        return {}
+    with open_store(processed_data_dir) as conn:
+        stored = {year: json.loads(metadata) for year, metadata in conn.execute("SELECT year, metadata FROM year_metadata")}
+        missing = [year for (year,) in conn.execute("SELECT year FROM years") if year not in stored]
+    for year in missing:
+        entries = load_year(processed_data_dir, year) or []
+        stored[year] = build_year_metadata(year, entries)
+        with open_store(processed_data_dir) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO year_metadata (year, metadata) VALUES (?, ?)",
+                (year, json.dumps(stored[year], ensure_ascii=False))
+            )
+    if years is None:
+        return stored
+    return {year: stored[year] for year in years if year in stored}
+
+def query_messages(processed_data_dir, year=None, sender=None, source_type=None, conversation_id=None, start=None, end=None, limit=None, newest_first=False):
+    """
+    Returns stored entries matching every given filter, oldest first (newest first with newest_first).
+    start and end are timestamp prefixes compared as text, e.g. start="2019-03", end="2019-04"
+    selects March 2019 (end is exclusive).
+    """
+    if not store_exists(processed_data_dir):
+        return []
+    conditions = []
+    params = []
+    for column, value in (("m.year", year), ("m.sender", sender), ("m.source_type", source_type), ("m.conversation_id", conversation_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if start is not None:
+        conditions.append("m.timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("m.timestamp < ?")
+        params.append(end)
+
+    query = _SELECT_ENTRIES
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY m.timestamp DESC, m.year DESC, m.seq DESC" if newest_first else " ORDER BY m.timestamp, m.year, m.seq"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+
+    with open_store(processed_data_dir) as conn:
+        return _rows_to_entries(conn.execute(query, params))
+
+_SEARCH_TERM_PATTERN = re.compile(r"\w+")
+
+def _year_rowid_range(year):
+    return year * ROWID_YEAR_STRIDE, (year + 1) * ROWID_YEAR_STRIDE - 1
+
+def match_any_terms(text, max_terms=32):
+    """
+    Turns free text (e.g. a chat message) into an FTS5 query matching any of its words.
+    Every word is quoted, so FTS5 operators in the text are taken literally. Returns "" if there are no words.
+    """
+    terms = []
+    for term in _SEARCH_TERM_PATTERN.findall(text.lower()):
+        if term not in terms:
+            terms.append(term)
+        if len(terms) >= max_terms:
+            break
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def bm25_search(processed_data_dir, match_query, year=None, limit=20):
+    """
+    Ranks stored entries against an FTS5 match query with BM25 (see BM25_WEIGHTS).
+    Returns a list of (entry, score), best first; lower scores are better, as in SQLite's bm25().
+    """
+    if not match_query or not store_exists(processed_data_dir):
+        return []
+    query = (
+        "SELECT m.timestamp, m.sender, m.text, m.source, m.source_type, m.conversation_id, c.participants, s.score"
+        " FROM (SELECT rowid, bm25(messages_fts, ?, ?, ?) AS score FROM messages_fts WHERE messages_fts MATCH ?{year_filter}) s"
+        " JOIN messages m ON m.id = s.rowid"
+        " LEFT JOIN conversations c ON c.conversation_id = m.conversation_id"
+        " ORDER BY s.score, m.timestamp LIMIT ?"
+    )
+    params = list(BM25_WEIGHTS) + [match_query]
+    if year is not None:
+        query = query.format(year_filter=" AND rowid BETWEEN ? AND ?")
+        params.extend(_year_rowid_range(year))
+    else:
+        query = query.format(year_filter="")
+    params.append(int(limit))
+
+    with open_store(processed_data_dir) as conn:
+        if not _fts_available:
+            return []
+        rows = conn.execute(query, params).fetchall()
+    entries = _rows_to_entries(row[:7] for row in rows)
+    return [(entry, row[7]) for entry, row in zip(entries, rows)]
+
+SEARCH_SORTS = ('newest', 'oldest', 'relevance')
+_QUERY_TOKEN_PATTERN = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+def parse_search_query(text):
+    """
+    Turns a search box query into an FTS5 expression over message text.
+    Every word must match; "quoted words" must match as a phrase; word* matches any word
+    starting with word; -word or -"a phrase" excludes messages containing it.
+    Everything else is taken literally. Returns "" if nothing searchable is left.
+    """
+    included = []
+    excluded = []
+    for match in _QUERY_TOKEN_PATTERN.finditer(text):
+        negate, phrase, token = match.groups()
+        prefix = False
+        if phrase is None:
+            negate = token.startswith('-')
+            prefix = token.endswith('*')
+            phrase = token
+        words = _SEARCH_TERM_PATTERN.findall(phrase.lower())
+        if not words:
+            continue
+        term = '"' + " ".join(words) + '"' + (" *" if prefix else "")
+        (excluded if negate else included).append(term)
+
+    if not included:
+        return ""
+    expression = " AND ".join(included)
+    if excluded:
+        expression = f"({expression}) NOT ({' OR '.join(excluded)})"
+    return f"text : ({expression})"
+
+def full_text_search(processed_data_dir, match_expression, year=None, sender=None, source_type=None, conversation_id=None, sort='newest', cursor=None, limit=50):
+    """
+    Returns one page of stored entries matching an FTS5 expression (see parse_search_query) and every given filter.
+    sort is 'newest' or 'oldest' (message time) or 'relevance' (BM25, best first).
+    Pass the returned cursor back to get the next page. Returns (entries, cursor); cursor is None after the last page.
+    Raises ValueError for an unknown sort or a malformed cursor.
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Unknown sort '{sort}'. Must be one of: {', '.join(SEARCH_SORTS)}.")
+    if not match_expression or not store_exists(processed_data_dir):
+        return [], None
+
+    fts_conditions = ["messages_fts MATCH ?"]
+    fts_params = [match_expression]
+    if year is not None:
+        fts_conditions.append("rowid BETWEEN ? AND ?")
+        fts_params.extend(_year_rowid_range(year))
+
+    conditions = []
+    params = []
+    for column, value in (("sender", sender), ("source_type", source_type), ("conversation_id", conversation_id)):
+        if value is not None:
+            conditions.append(f"m.{column} = ?")
+            params.append(value)
+
+    # Time order is rowid order (see ROWID_YEAR_STRIDE), which FTS5 walks without sorting,
+    # so a page stops reading the index as soon as it is full. The cursor is the last rowid.
+    # Relevance pages are keyed by (score, rowid).
+    if sort == 'relevance':
+        score_column = "bm25(messages_fts, ?, ?, ?)"
+        fts_params = list(BM25_WEIGHTS) + fts_params
+        order = "score, rowid"
+    else:
+        score_column = "NULL"
+        order = "rowid DESC" if sort == 'newest' else "rowid"
+    page_conditions = []
+    page_params = []
+    if cursor:
+        try:
+            if sort == 'relevance':
+                cursor_score, cursor_rowid = cursor.split(":")
+                page_conditions.append("(score > ? OR (score = ? AND rowid > ?))")
+                page_params.extend([float(cursor_score), float(cursor_score), int(cursor_rowid)])
+            else:
+                page_conditions.append("rowid < ?" if sort == 'newest' else "rowid > ?")
+                page_params.append(int(cursor))
+        except ValueError:
+            raise ValueError(f"Malformed search cursor '{cursor}'.")
+    limit = int(limit)
+
+    page = f"SELECT rowid, score FROM (SELECT rowid, {score_column} AS score FROM messages_fts WHERE {' AND '.join(fts_conditions)})"
+    if page_conditions:
+        page += " WHERE " + " AND ".join(page_conditions)
+    if not conditions:
+        # Without filters on message columns the page is cut before joining, so only its rows are looked up.
+        page += f" ORDER BY {order} LIMIT ?"
+        page_params.append(limit + 1)
+
+    query = (
+        "SELECT m.timestamp, m.sender, m.text, m.source, m.source_type, m.conversation_id, c.participants, f.rowid, f.score"
+        f" FROM ({page}) f"
+        " CROSS JOIN messages m ON m.id = f.rowid"
+        " LEFT JOIN conversations c ON c.conversation_id = m.conversation_id"
+    )
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(f"f.{term}" for term in order.split(", ")) + " LIMIT ?"
+
+    with open_store(processed_data_dir) as conn:
+        if not _fts_available:
+            return [], None
+        rows = conn.execute(query, fts_params + page_params + params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_rowid, last_score = rows[-1][7], rows[-1][8]
+        next_cursor = f"{last_score!r}:{last_rowid}" if sort == 'relevance' else str(last_rowid)
+    return _rows_to_entries(row[:7] for row in rows), next_cursor
@@ -0,0 +1,156 @@
+import time
+import math
+import threading
+import contextlib
+from collections import OrderedDict
+
+# In-process counters, gauges and histograms, rendered in the Prometheus text exposition format
+# at /api/metrics. Metrics are created once at import time by the modules that record them.
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2000000, 4000000)
+
+_registry = OrderedDict()
+_registry_lock = threading.Lock()
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for suffix, pairs, value in self._samples():
+                lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. bytes parsed."""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirrors a count kept elsewhere (e.g. a cache's hit count) at its current value."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield "", list(zip(self.label_names, key)), value
+
+class Gauge(_Metric):
+    """A value that is set to its current level, e.g. cached bytes."""
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield "", list(zip(self.label_names, key)), value
+
+class Histogram(_Metric):
+    """Counts observations (durations, sizes) in cumulative buckets, with their sum and count."""
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the seconds the with-block took, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, state in sorted(self._values.items()):
+            pairs = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                yield "_bucket", pairs + [('le', _format_value(bound))], cumulative
+            yield "_bucket", pairs + [('le', '+Inf')], state['count']
+            yield "_sum", pairs, state['sum']
+            yield "_count", pairs, state['count']
+
+def _register(metric_class, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, *args, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"Metric {name} is already registered as a {metric.type_name}")
+        return metric
+
+def counter(name, help_text, label_names=()):
+    """Returns the counter called name, creating it on first use."""
+    return _register(Counter, name, help_text, label_names)
+
+def gauge(name, help_text, label_names=()):
+    """Returns the gauge called name, creating it on first use."""
+    return _register(Gauge, name, help_text, label_names)
+
+def histogram(name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+    """Returns the histogram called name, creating it on first use."""
+    return _register(Histogram, name, help_text, label_names, buckets=buckets)
+
+def render():
+    """Returns every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+import threading
+import metrics
+
+_lock = threading.Lock()
+
+LOOKUPS = metrics.counter('ghosttext_prompt_cache_lookups_total', 'System prompt cache lookups, by result.', ('result',))
+
+def configured_max_bytes():
+    """
+    Reads the prompt cache size in megabytes from GHOSTTEXT_PROMPT_CACHE_MB.
+    Defaults to 64; 0 disables the cache.
+    """
+    value = os.environ.get('GHOSTTEXT_PROMPT_CACHE_MB')
+    if not value:
+        return 64 * 1024 * 1024
+    try:
+        megabytes = float(value)
+    except ValueError:
+        print(f"Warning: Invalid GHOSTTEXT_PROMPT_CACHE_MB '{value}'. Must be a number. Using 64.")
+        return 64 * 1024 * 1024
+    return max(0, int(megabytes * 1024 * 1024))
+
+def cache_key(**inputs):
+    """
+    Content-addresses a prompt: the SHA-256 of everything it was rendered from.
+    Pass every input (year version, name mapping, budgets, template, ...) as a keyword argument.
+    """
+    canonical = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.txt")
+
+def get(cache_dir, key):
+    """Returns the cached prompt for key, or None. A hit marks the entry as recently used."""
+    path = _entry_path(cache_dir, key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        os.utime(path)
+        LOOKUPS.inc(result='hit')
+        return text
+    except FileNotFoundError:
+        LOOKUPS.inc(result='miss')
+        return None
+    except Exception as e:
+        print(f"Warning: Could not read cached prompt {path}: {e}")
+        return None
+
+def put(cache_dir, key, text, max_bytes=None):
+    """
+    Stores a prompt under key, then evicts least recently used entries (by file mtime)
+    until the cache fits in max_bytes (GHOSTTEXT_PROMPT_CACHE_MB by default).
+    """
+    if max_bytes is None:
+        max_bytes = configured_max_bytes()
+    encoded = text.encode('utf-8')
+    if max_bytes <= 0 or len(encoded) > max_bytes:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _entry_path(cache_dir, key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(encoded)
+        os.replace(temp_path, path)
+        _evict(cache_dir, max_bytes)
+    except Exception as e:
+        print(f"Warning: Could not write prompt cache entry to {cache_dir}: {e}")
+
+def _evict(cache_dir, max_bytes):
+    with _lock:
+        cached = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith('.txt'):
+                continue
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            cached.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in cached)
+        for _, size, name in sorted(cached):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                print(f"Evicted cached prompt {name} ({size} bytes)")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def clear(cache_dir):
+    """Removes every cached prompt."""
+    if not os.path.isdir(cache_dir):
+        return
+    with _lock:
+        for name in os.listdir(cache_dir):
+            if name.endswith(('.txt', '.tmp')):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except FileNotFoundError:
+                    pass
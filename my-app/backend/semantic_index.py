@@ -0,0 +1,198 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import message_store
+
+# Every message is embedded as TF-IDF weighted counts of its character n-grams, hashed into
+# DIM buckets and L2-normalized, so cosine similarity is a dot product. No model, network or GPU.
+# One year is a (messages x DIM) float32 matrix: 2 KB per message, memory-mapped from disk.
+# It is stored column-major: a query only has a few dozen non-zero buckets, and a search
+# reads just those columns instead of the whole matrix.
+DIM = 512
+NGRAM_SIZES = (3, 4)
+SEMANTIC_DIRNAME = "semantic"
+
+_FNV_OFFSET = np.uint32(2166136261)
+_FNV_PRIME = np.uint32(16777619)
+_BATCH_ROWS = 4096
+_SEARCH_CHUNK_ROWS = 65536
+
+_INDEX_CACHE_SIZE = 4
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+def _index_paths(processed_data_dir, year):
+    base = os.path.join(processed_data_dir, SEMANTIC_DIRNAME, str(year))
+    return f"{base}.npy", f"{base}.idf.npy", f"{base}.json"
+
+def _ngram_counts(texts):
+    """
+    Returns a (len(texts) x DIM) float32 matrix of hashed character n-gram counts.
+    Text is lowercased and whitespace-collapsed; n-grams are taken over its UTF-8 bytes,
+    never across two messages.
+    """
+    encoded = [(" " + " ".join((text or "").lower().split()) + " ").encode('utf-8') for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint32)
+    row_of_byte = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths)
+
+    counts = np.zeros(len(encoded) * DIM, dtype=np.float32)
+    for n in NGRAM_SIZES:
+        ngram_count = len(data) - n + 1
+        if ngram_count <= 0:
+            continue
+        # FNV-1a over the n bytes of every n-gram at once, seeded by n so sizes do not collide.
+        hashes = np.full(ngram_count, _FNV_OFFSET ^ np.uint32(n), dtype=np.uint32)
+        for offset in range(n):
+            hashes ^= data[offset:offset + ngram_count]
+            hashes *= _FNV_PRIME
+        hashes ^= hashes >> np.uint32(15)
+        hashes *= np.uint32(0x2c1b3c6d)
+        hashes ^= hashes >> np.uint32(12)
+
+        rows = row_of_byte[:ngram_count]
+        within_message = rows == row_of_byte[n - 1:]
+        cells = rows[within_message] * DIM + (hashes[within_message] & np.uint32(DIM - 1))
+        counts += np.bincount(cells, minlength=len(counts)).astype(np.float32)
+    return counts.reshape(len(encoded), DIM)
+
+def _sublinear(counts):
+    """Dampens repeated n-grams: tf becomes 1 + log(tf)."""
+    nonzero = counts > 0
+    counts[nonzero] = 1 + np.log(counts[nonzero])
+    return counts
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors /= norms
+    return vectors
+
+def build_year(processed_data_dir, year, entries, version):
+    """
+    Builds the semantic index of one year from its stored entries (row i is the entry with seq i)
+    and writes it under processed_data/semantic. version is the year's store version, so a stale
+    index is detected and rebuilt on the next search.
+    """
+    matrix_path, idf_path, meta_path = _index_paths(processed_data_dir, year)
+    os.makedirs(os.path.dirname(matrix_path), exist_ok=True)
+    temp_matrix_path = f"{matrix_path}.tmp"
+    temp_idf_path = f"{idf_path}.tmp"
+
+    # Drop any cached memory map first: a mapped file cannot be replaced on every platform.
+    with _index_cache_lock:
+        _index_cache.pop((os.path.abspath(processed_data_dir), year), None)
+
+    with _build_lock:
+        matrix = np.lib.format.open_memmap(temp_matrix_path, mode='w+', dtype=np.float32, shape=(len(entries), DIM), fortran_order=True)
+        document_frequency = np.zeros(DIM, dtype=np.int64)
+        for start in range(0, len(entries), _BATCH_ROWS):
+            counts = _ngram_counts(entry.get('text') for entry in entries[start:start + _BATCH_ROWS])
+            document_frequency += np.count_nonzero(counts, axis=0)
+            matrix[start:start + len(counts)] = _sublinear(counts)
+
+        idf = (np.log((1 + len(entries)) / (1 + document_frequency)) + 1).astype(np.float32)
+        for start in range(0, len(entries), _BATCH_ROWS):
+            batch = matrix[start:start + _BATCH_ROWS] * idf
+            matrix[start:start + len(batch)] = _normalize_rows(batch)
+        matrix.flush()
+        del matrix
+
+        with open(temp_idf_path, 'wb') as f:
+            np.save(f, idf)
+        os.replace(temp_matrix_path, matrix_path)
+        os.replace(temp_idf_path, idf_path)
+        with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({"version": version, "rows": len(entries), "dim": DIM, "ngram_sizes": list(NGRAM_SIZES)}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+def remove_year(processed_data_dir, year):
+    """Deletes the semantic index of one year, if any."""
+    with _index_cache_lock:
+        _index_cache.pop((os.path.abspath(processed_data_dir), year), None)
+    for path in _index_paths(processed_data_dir, year):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _load_index(processed_data_dir, year):
+    """
+    Returns (matrix, idf) for the current version of a year, memory-mapped and cached.
+    Builds the index from the store if it is missing or stale. Returns None if the year is not stored.
+    """
+    version = message_store.year_version(processed_data_dir, year)
+    if version is None:
+        return None
+    cache_key = (os.path.abspath(processed_data_dir), year)
+    with _index_cache_lock:
+        cached = _index_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            _index_cache.move_to_end(cache_key)
+            return cached[1], cached[2]
+
+    matrix_path, idf_path, meta_path = _index_paths(processed_data_dir, year)
+    meta = _read_meta(meta_path)
+    if not meta or meta.get('version') != version or meta.get('dim') != DIM or meta.get('ngram_sizes') != list(NGRAM_SIZES):
+        print(f"Building semantic index for {year}...")
+        entries = message_store.load_year(processed_data_dir, year) or []
+        build_year(processed_data_dir, year, entries, version)
+
+    matrix = np.load(matrix_path, mmap_mode='r')
+    idf = np.load(idf_path)
+    with _index_cache_lock:
+        _index_cache[cache_key] = (version, matrix, idf)
+        while len(_index_cache) > _INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return matrix, idf
+
+def _top_k(matrix, query_vectors, k):
+    """
+    Cosine top-k of every query against the matrix rows, scanning the matrix in chunks.
+    Returns one list of (row, score) per query, best first, without non-positive scores.
+    """
+    columns = np.flatnonzero(np.any(query_vectors != 0, axis=0))
+    query_vectors = query_vectors[:, columns]
+    candidate_rows = []
+    candidate_scores = []
+    for start in range(0, len(matrix), _SEARCH_CHUNK_ROWS):
+        scores = matrix[start:start + _SEARCH_CHUNK_ROWS, columns] @ query_vectors.T
+        if len(scores) > k:
+            best = np.argpartition(scores, -k, axis=0)[-k:]
+            scores = np.take_along_axis(scores, best, axis=0)
+        else:
+            best = np.broadcast_to(np.arange(len(scores))[:, None], scores.shape)
+        candidate_rows.append(best + start)
+        candidate_scores.append(scores)
+
+    rows = np.concatenate(candidate_rows)
+    scores = np.concatenate(candidate_scores)
+    results = []
+    for query in range(query_vectors.shape[0]):
+        order = np.argsort(-scores[:, query], kind='stable')[:k]
+        results.append([(int(rows[i, query]), float(scores[i, query])) for i in order if scores[i, query] > 0])
+    return results
+
+def search(processed_data_dir, year, queries, k=10):
+    """
+    Finds the k messages of a year most similar to each query string.
+    Returns one list of (seq, score) per query, best first; seq is the message's position in the year.
+    """
+    index = _load_index(processed_data_dir, year)
+    if index is None or not queries:
+        return [[] for _ in queries]
+    matrix, idf = index
+    if len(matrix) == 0:
+        return [[] for _ in queries]
+    query_vectors = _normalize_rows(_sublinear(_ngram_counts(queries)) * idf)
+    return _top_k(matrix, query_vectors, min(k, len(matrix)))
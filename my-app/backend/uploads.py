@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+import metrics
+
+# Chunked, resumable uploads. A client starts an upload with its filename and size, PUTs the
+# bytes in chunks at increasing offsets and finalizes it. Chunks are appended to a staging file
+# as they arrive while a running SHA-256 is kept, so finalizing is a rename and the file never has
+# to be read again to be hashed. Staging files survive restarts; a resumed upload continues at the
+# number of bytes already on disk. An upload is only resumed for a client that identifies the same
+# file by its resume key (or full SHA-256): filename and size alone do not tell two exports apart.
+
+READ_SIZE = 1024 * 1024
+# Unfinished uploads untouched for this long are removed when a new upload starts.
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+
+UPLOAD_BYTES = metrics.counter('ghosttext_upload_bytes_total', "Bytes of uploaded files received.")
+UPLOADS_FINISHED = metrics.counter('ghosttext_uploads_total', "Chunked uploads by outcome.", ('outcome',))
+
+class UploadError(ValueError):
+    """A request the upload cannot accept, e.g. a bad filename or finalizing an incomplete upload."""
+
+class OffsetMismatch(UploadError):
+    """A chunk was sent for an offset other than the number of bytes received so far."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+def _validated_filename(filename):
+    name = os.path.basename(str(filename or '').replace('\\', '/'))
+    if not name or name.startswith('.'):
+        raise UploadError(f"Invalid filename: {filename!r}")
+    if not name.lower().endswith('.zip'):
+        raise UploadError(f"Only zip files can be uploaded: {name}")
+    return name
+
+def save_stream(stream, filename, target_dir, staging_dir):
+    """
+    Saves a whole file (e.g. a multipart form file) to target_dir/filename, hashing it as it is
+    written. It is written to staging_dir first and renamed into place, so an ingestion running
+    meanwhile never reads a half-written file. Returns (path, sha256).
+    """
+    filename = _validated_filename(filename)
+    os.makedirs(staging_dir, exist_ok=True)
+    staging_path = os.path.join(staging_dir, f"{uuid.uuid4().hex}.saving")
+    digest = hashlib.sha256()
+    try:
+        with open(staging_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(READ_SIZE), b''):
+                f.write(chunk)
+                digest.update(chunk)
+                UPLOAD_BYTES.inc(len(chunk))
+        os.makedirs(target_dir, exist_ok=True)
+        target_path = os.path.join(target_dir, filename)
+        os.replace(staging_path, target_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    return target_path, digest.hexdigest()
+
+class Upload:
+    """
+    One upload in progress: its target filename and size, an optional expected SHA-256, the
+    client's resume key and the bytes received so far, which are always exactly the bytes in
+    its staging file.
+    """
+
+    def __init__(self, uploads_dir, upload_id, filename, size, expected_sha256=None, created_at=None, resume_key=None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.expected_sha256 = expected_sha256
+        self.resume_key = resume_key
+        self.created_at = created_at or time.time()
+        self.part_path = os.path.join(uploads_dir, f"{upload_id}.part")
+        self.meta_path = os.path.join(uploads_dir, f"{upload_id}.json")
+        self.offset = 0
+        self._digest = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    def _save_meta(self):
+        temp_path = f"{self.meta_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'id': self.id, 'filename': self.filename, 'size': self.size,
+                       'sha256': self.expected_sha256, 'resume_key': self.resume_key,
+                       'created_at': self.created_at}, f)
+        os.replace(temp_path, self.meta_path)
+
+    def _resume_from_disk(self):
+        """Re-hashes the bytes a previous server process received (hash state is not persisted)."""
+        with open(self.part_path, 'a+b') as f:
+            f.seek(0)
+            for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                self._digest.update(chunk)
+                self.offset += len(chunk)
+        if self.offset > self.size:
+            raise UploadError(f"Staged upload {self.id} holds more bytes than its declared size")
+
+    def status(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'complete': self.offset == self.size,
+        }
+
+class UploadManager:
+    """Keeps the uploads in progress, staged as <id>.part with an <id>.json description in uploads_dir."""
+
+    def __init__(self, uploads_dir):
+        self.uploads_dir = uploads_dir
+        self._uploads = {}
+        self._lock = threading.Lock()
+        os.makedirs(uploads_dir, exist_ok=True)
+        self._load_staged()
+
+    def _load_staged(self):
+        for name in sorted(os.listdir(self.uploads_dir)):
+            if name.endswith('.saving'):
+                # Left by a save_stream the server did not finish.
+                os.remove(os.path.join(self.uploads_dir, name))
+                continue
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.uploads_dir, name)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                upload = Upload(self.uploads_dir, meta['id'], meta['filename'], int(meta['size']),
+                                meta.get('sha256'), meta.get('created_at'), meta.get('resume_key'))
+                upload._resume_from_disk()
+            except Exception as e:
+                print(f"Warning: Discarding unreadable staged upload {meta_path}: {e}")
+                self._remove_files(os.path.join(self.uploads_dir, name[:-len('.json')]))
+                continue
+            self._uploads[upload.id] = upload
+            print(f"Resumable upload of {upload.filename}: {upload.offset} of {upload.size} bytes received.")
+
+    def _remove_files(self, path_prefix):
+        for suffix in ('.part', '.json', '.json.tmp'):
+            try:
+                os.remove(path_prefix + suffix)
+            except FileNotFoundError:
+                pass
+
+    def _discard_locked(self, upload):
+        self._uploads.pop(upload.id, None)
+        self._remove_files(os.path.join(self.uploads_dir, upload.id))
+
+    def _discard_stale_locked(self):
+        cutoff = time.time() - STALE_UPLOAD_SECONDS
+        for upload in list(self._uploads.values()):
+            try:
+                last_write = os.path.getmtime(upload.part_path)
+            except OSError:
+                last_write = upload.created_at
+            if last_write < cutoff and not upload._lock.locked():
+                print(f"Discarding stale upload of {upload.filename} ({upload.offset} of {upload.size} bytes).")
+                self._discard_locked(upload)
+                UPLOADS_FINISHED.inc(outcome='expired')
+
+    def _resumes(self, upload, filename, size, expected_sha256, resume_key):
+        if upload.filename != filename or upload.size != size:
+            return False
+        if expected_sha256 and upload.expected_sha256 not in (None, expected_sha256):
+            return False
+        return bool(resume_key and upload.resume_key == resume_key) or \
+            bool(expected_sha256 and upload.expected_sha256 == expected_sha256)
+
+    def start(self, filename, size, expected_sha256=None, resume_key=None):
+        """
+        Starts an upload, or returns the unfinished one of the same file so an interrupted transfer
+        (or a reloaded page) continues at the offset already received. It is the same file only if
+        the filename and size match and so does the resume_key or expected SHA-256 the client sent;
+        without either a new upload is always started.
+        """
+        filename = _validated_filename(filename)
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError(f"Invalid size: {size!r}")
+        if size < 0:
+            raise UploadError(f"Invalid size: {size}")
+        if expected_sha256 is not None:
+            expected_sha256 = str(expected_sha256).lower()
+        with self._lock:
+            self._discard_stale_locked()
+            for upload in self._uploads.values():
+                if self._resumes(upload, filename, size, expected_sha256, resume_key):
+                    return upload
+            upload = Upload(self.uploads_dir, uuid.uuid4().hex, filename, size, expected_sha256, resume_key=resume_key)
+            open(upload.part_path, 'wb').close()
+            upload._save_meta()
+            self._uploads[upload.id] = upload
+        print(f"Started upload {upload.id} of {filename} ({size} bytes).")
+        return upload
+
+    def get(self, upload_id):
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+    def write_chunk(self, upload, offset, stream, length=None):
+        """
+        Appends the bytes read from stream (at most length) at offset, which must equal the bytes
+        received so far. Returns the new offset. If the stream breaks off, what arrived is kept
+        and the client resumes from the offset reported by status().
+        """
+        if not upload._lock.acquire(blocking=False):
+            raise OffsetMismatch(f"Another chunk of upload {upload.id} is being written", upload.offset)
+        try:
+            if offset != upload.offset:
+                raise OffsetMismatch(f"Expected a chunk at offset {upload.offset}, got {offset}", upload.offset)
+            remaining = upload.size - upload.offset
+            if length is not None and length > remaining:
+                raise UploadError(f"Chunk of {length} bytes exceeds the {remaining} bytes left of {upload.filename}")
+            with open(upload.part_path, 'r+b') as f:
+                # Drops bytes a failed earlier write may have left behind the received offset.
+                f.truncate(upload.offset)
+                f.seek(upload.offset)
+                while remaining > 0:
+                    chunk = stream.read(min(READ_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    upload._digest.update(chunk)
+                    upload.offset += len(chunk)
+                    remaining -= len(chunk)
+                    UPLOAD_BYTES.inc(len(chunk))
+                if remaining == 0 and stream.read(1):
+                    raise UploadError(f"Upload of {upload.filename} sent more than its declared {upload.size} bytes; the rest was dropped")
+            return upload.offset
+        finally:
+            upload._lock.release()
+
+    def finish(self, upload, target_dir):
+        """
+        Moves a complete upload to target_dir/filename (replacing a file of that name) and returns
+        (path, sha256). A hash mismatch with the one given at start discards the upload.
+        """
+        with upload._lock:
+            if upload.offset != upload.size:
+                raise UploadError(f"Upload of {upload.filename} is incomplete: {upload.offset} of {upload.size} bytes received")
+            sha256 = upload._digest.hexdigest()
+            with self._lock:
+                if self._uploads.get(upload.id) is not upload:
+                    raise UploadError(f"Upload of {upload.filename} was discarded")
+                if upload.expected_sha256 and upload.expected_sha256 != sha256:
+                    self._discard_locked(upload)
+                    UPLOADS_FINISHED.inc(outcome='hash_mismatch')
+                    raise UploadError(f"Upload of {upload.filename} does not match its SHA-256 and was discarded")
+                os.makedirs(target_dir, exist_ok=True)
+                target_path = os.path.join(target_dir, upload.filename)
+                os.replace(upload.part_path, target_path)
+                self._discard_locked(upload)
+        UPLOADS_FINISHED.inc(outcome='completed')
+        print(f"Finished upload of {upload.filename} ({upload.size} bytes, sha256 {sha256[:12]}).")
+        return target_path, sha256
+
+    def discard(self, upload):
+        with self._lock:
+            self._discard_locked(upload)
+        UPLOADS_FINISHED.inc(outcome='aborted')
+
+    def discard_all(self):
+        """Drops every unfinished upload. Returns how many there were."""
+        with self._lock:
+            uploads = list(self._uploads.values())
+            for upload in uploads:
+                self._discard_locked(upload)
+        return len(uploads)
+
+    def list(self):
+        with self._lock:
+            return list(self._uploads.values())
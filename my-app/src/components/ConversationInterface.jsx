@@ -170,16 +170,36 @@ function ConversationInterface({
     onUpdateTabTypingState(activeTab.id, true); // Indicate typing for this tab
 
     const controller = new AbortController();
-    const signal = controller.signal;
-    const timeoutDuration = 50000; // 100 * (1 - temperature) seconds based on backend .env
+    const timeoutDuration = 50000; // Abort if the backend sends nothing for this long
 
-    const timeoutId = setTimeout(() => {
-        controller.abort();
-    }, timeoutDuration);
+    let timeoutId = setTimeout(() => controller.abort(), timeoutDuration);
+    const resetTimeout = () => {
+        clearTimeout(timeoutId);
+        timeoutId = setTimeout(() => controller.abort(), timeoutDuration);
+    };
+
+    const addSystemMessage = (messages, text) => {
+        const errorMessage = {
+            id: Date.now() + 1,
+            text,
+            sender: 'system',
+            timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
+        };
+        onUpdateTabMessages(activeTab.id, [...messages, errorMessage]);
+    };
+
+    // The AI message grows as chunks arrive; 'streaming' hides the typing indicator meanwhile.
+    const aiResponse = {
+        id: Date.now() + 1,
+        text: '',
+        sender: 'ai',
+        streaming: true,
+        timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
+    };
 
     try {
-        // Send message to backend API with timeout
-        const fetchPromise = fetch('http://127.0.0.1:5000/api/chat', {
+        // Streamed reply as Server-Sent Events: a data event per chunk, then 'done' or 'error'
+        const response = await fetch('http://127.0.0.1:5000/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -188,61 +208,68 @@ function ConversationInterface({
                 year: activeTab.year, // Send the year to identify the session
                 message: userMessage.text,
             }),
-            signal: signal // Link the fetch request to the abort signal
+            signal: controller.signal // Aborting closes the stream; the backend then stops generating
         });
 
-        const response = await Promise.race([
-            fetchPromise,
-            new Promise((_, reject) =>
-                signal.addEventListener('abort', () => reject(new Error('Request timed out')), { once: true })
-            )
-        ]);
-
-        clearTimeout(timeoutId); // Clear the timeout if fetch completes
-
-        const data = await response.json();
-
-        if (response.ok) {
-            // Add AI response to messages
-            const aiResponse = {
-                id: Date.now() + 1, // Simple unique ID
-                text: data.response,
-                sender: 'ai',
-                timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
-            };
-            onUpdateTabMessages(activeTab.id, [...messagesAfterUser, aiResponse]);
-        } else {
+        if (!response.ok) {
+            const data = await response.json();
             console.error('Error sending message:', data.error);
-             const errorMessage = {
-                id: Date.now() + 1,
-                text: `Error: Could not get response. ${data.error}`,
-                sender: 'system',
-                timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
-            };
-            onUpdateTabMessages(activeTab.id, [...messagesAfterUser, errorMessage]);
+            addSystemMessage(messagesAfterUser, `Error: Could not get response. ${data.error}`);
+            return;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let streamError = null;
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            resetTimeout();
+            buffer += decoder.decode(value, { stream: true });
+
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const rawEvent of events) {
+                let eventType = 'message';
+                let data = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event: ')) eventType = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (!data) continue;
+                const payload = JSON.parse(data);
+
+                if (eventType === 'error') {
+                    streamError = payload.error;
+                } else if (eventType === 'done') {
+                    aiResponse.text = payload.response;
+                } else {
+                    aiResponse.text += payload.text;
+                }
+            }
+            onUpdateTabMessages(activeTab.id, [...messagesAfterUser, { ...aiResponse }]);
+        }
+
+        const finalMessages = aiResponse.text ? [...messagesAfterUser, { ...aiResponse, streaming: false }] : messagesAfterUser;
+        if (streamError) {
+            console.error('Error sending message:', streamError);
+            addSystemMessage(finalMessages, `Error: Could not get response. ${streamError}`);
+        } else {
+            onUpdateTabMessages(activeTab.id, finalMessages);
         }
     } catch (error) {
-        clearTimeout(timeoutId); // Ensure timeout is cleared on error as well
-        if (error.name === 'AbortError' || error.message === 'Request timed out') {
+        const partialMessages = aiResponse.text ? [...messagesAfterUser, { ...aiResponse, streaming: false }] : messagesAfterUser;
+        if (error.name === 'AbortError') {
             console.error('Message request timed out:', error);
-            const errorMessage = {
-                id: Date.now() + 1,
-                text: `Error: Request timed out. Please try again.`,
-                sender: 'system',
-                timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
-            };
-            onUpdateTabMessages(activeTab.id, [...messagesAfterUser, errorMessage]);
+            addSystemMessage(partialMessages, `Error: Request timed out. Please try again.`);
         } else {
             console.error('Network error sending message:', error);
-             const errorMessage = {
-                id: Date.now() + 1,
-                text: `Error: Network error sending message. ${error}`,
-                sender: 'system',
-                timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
-            };
-            onUpdateTabMessages(activeTab.id, [...messagesAfterUser, errorMessage]);
+            addSystemMessage(partialMessages, `Error: Network error sending message. ${error}`);
         }
     } finally {
+        clearTimeout(timeoutId);
         onUpdateTabTypingState(activeTab.id, false); // Stop typing indicator for this tab
     }
   };
@@ -342,7 +369,7 @@ function ConversationInterface({
             <span className={`message-time message-time-${msg.sender}`}>{msg.timestamp}</span>
           </div>
         ))}
-        {activeTab.isTyping && <TypingIndicator />}
+        {activeTab.isTyping && !activeTab.messages.some(msg => msg.streaming) && <TypingIndicator />}
       </div>
 
       {/* Input Area */}
@@ -10,8 +10,14 @@ function FileUpload({
   const [isDragging, setIsDragging] = useState(false);
   const [selectedFilesForUpload, setSelectedFilesForUpload] = useState([]);
   const [filesToDelete, setFilesToDelete] = useState([]);
+  const [uploadProgress, setUploadProgress] = useState({});
+  const [isUploading, setIsUploading] = useState(false);
 
   const MAX_FILES = 5;
+  // Files are sent in chunks so multi-GB exports neither time out nor restart from zero
+  // when the connection drops: a failed chunk is retried from the offset the server has.
+  const CHUNK_SIZE = 8 * 1024 * 1024;
+  const MAX_CHUNK_RETRIES = 5;
 
   const handleSelectFiles = (newFiles) => {
     if (newFiles.length === 0) return;
@@ -49,6 +55,85 @@ function FileUpload({
       });
   };
 
+  // Identifies a file's contents for resuming without reading all of it: a hash of its first
+  // and last MiB plus its modification time, so a re-export with the same name and size is
+  // uploaded afresh instead of being appended to the old partial upload.
+  const computeResumeKey = async (file) => {
+    const sample = 1024 * 1024;
+    const parts = [
+      new TextEncoder().encode(`${file.name}:${file.size}:${file.lastModified}:`),
+      new Uint8Array(await file.slice(0, sample).arrayBuffer()),
+      new Uint8Array(await file.slice(Math.max(0, file.size - sample)).arrayBuffer()),
+    ];
+    const bytes = new Uint8Array(parts.reduce((total, part) => total + part.length, 0));
+    let position = 0;
+    for (const part of parts) {
+      bytes.set(part, position);
+      position += part.length;
+    }
+    const digest = await crypto.subtle.digest('SHA-256', bytes);
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+  };
+
+  const uploadFileInChunks = async (file) => {
+    const resumeKey = await computeResumeKey(file);
+    const startResponse = await fetch('http://127.0.0.1:5000/api/uploads', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ filename: file.name, size: file.size, resume_key: resumeKey }),
+    });
+    const upload = await startResponse.json();
+    if (!startResponse.ok) {
+      throw new Error(upload.error);
+    }
+
+    const uploadUrl = `http://127.0.0.1:5000/api/uploads/${upload.upload_id}`;
+    let offset = upload.offset;
+    let failures = 0;
+    setUploadProgress(prev => ({ ...prev, [file.name]: file.size ? Math.round((offset / file.size) * 100) : 0 }));
+    while (offset < file.size) {
+      try {
+        const chunkResponse = await fetch(`${uploadUrl}?offset=${offset}`, {
+          method: 'PUT',
+          headers: {
+            'Content-Type': 'application/octet-stream',
+          },
+          body: file.slice(offset, offset + CHUNK_SIZE),
+        });
+        const chunkData = await chunkResponse.json();
+        if (!chunkResponse.ok && chunkResponse.status !== 409) {
+          throw new Error(chunkData.error);
+        }
+        // On 409 the server reports the offset it expects; continue from there.
+        offset = chunkData.offset;
+        failures = 0;
+      } catch (error) {
+        failures += 1;
+        if (failures > MAX_CHUNK_RETRIES) {
+          throw error;
+        }
+        console.warn(`Chunk upload of ${file.name} failed (attempt ${failures}), resuming:`, error);
+        await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+        const statusResponse = await fetch(uploadUrl);
+        if (statusResponse.ok) {
+          offset = (await statusResponse.json()).offset;
+        }
+      }
+      setUploadProgress(prev => ({ ...prev, [file.name]: Math.round((offset / file.size) * 100) }));
+    }
+
+    // process=1 starts ingesting this file while the next one is still uploading.
+    const finalizeResponse = await fetch(`${uploadUrl}/finalize?process=1`, { method: 'POST' });
+    const finalizeData = await finalizeResponse.json();
+    if (!finalizeResponse.ok) {
+      throw new Error(finalizeData.error);
+    }
+    console.log('Upload successful:', finalizeData.message);
+    return finalizeData;
+  };
+
   const handleSaveChanges = async () => {
     if (selectedFilesForUpload.length === 0 && filesToDelete.length === 0) {
       console.log("No changes to save.");
@@ -59,50 +144,6 @@ function FileUpload({
     let uploadSuccess = true;
     let deleteSuccess = true;
 
-    if (selectedFilesForUpload.length > 0) {
-        const formData = new FormData();
-        selectedFilesForUpload.forEach(file => {
-          formData.append('files', file);
-        });
-
-        try {
-          const xhr = new XMLHttpRequest();
-          xhr.open('POST', 'http://127.0.0.1:5000/api/upload');
-
-          xhr.onload = () => {
-            if (xhr.status >= 200 && xhr.status < 300) {
-              console.log('Upload successful:', xhr.responseText);
-              const successfullyAddedFiles = selectedFilesForUpload.map(file => ({ name: file.name }));
-              onFilesUpdate({ action: 'add', files: successfullyAddedFiles });
-              setSelectedFilesForUpload([]);
-              uploadSuccess = true;
-            } else {
-              console.error('Upload failed:', xhr.responseText);
-              alert(`Upload failed: ${xhr.responseText}`);
-              uploadSuccess = false;
-            }
-            processDeletions();
-          };
-
-          xhr.onerror = () => {
-            console.error('Network error during upload:', xhr.statusText);
-            alert(`Network error during upload: ${xhr.statusText}`);
-            uploadSuccess = false;
-            processDeletions();
-          };
-
-          xhr.send(formData);
-
-        } catch (error) {
-          console.error('Error setting up upload:', error);
-          alert(`Error setting up upload: ${error}`);
-          uploadSuccess = false;
-          processDeletions();
-        }
-    } else {
-        processDeletions();
-    }
-
     const processDeletions = async () => {
         if (filesToDelete.length > 0 && uploadSuccess) {
             for (let i = 0; i < filesToDelete.length; i++) {
@@ -150,6 +191,28 @@ function FileUpload({
              onClose();
         }
     };
+
+    if (selectedFilesForUpload.length > 0) {
+        setIsUploading(true);
+        const successfullyAddedFiles = [];
+        for (const file of selectedFilesForUpload) {
+          try {
+            await uploadFileInChunks(file);
+            successfullyAddedFiles.push({ name: file.name });
+          } catch (error) {
+            console.error(`Upload failed for ${file.name}:`, error);
+            alert(`Upload failed for ${file.name}: ${error.message}`);
+            uploadSuccess = false;
+          }
+        }
+        setIsUploading(false);
+        if (successfullyAddedFiles.length > 0) {
+          onFilesUpdate({ action: 'add', files: successfullyAddedFiles });
+          setSelectedFilesForUpload(prevFiles => prevFiles.filter(file => !successfullyAddedFiles.some(added => added.name === file.name)));
+        }
+    }
+
+    await processDeletions();
   };
 
   const handleDragEnter = useCallback((e) => {
@@ -183,7 +246,7 @@ function FileUpload({
     e.target.value = null;
   };
 
-  const isSaveDisabled = selectedFilesForUpload.length === 0 && filesToDelete.length === 0;
+  const isSaveDisabled = isUploading || (selectedFilesForUpload.length === 0 && filesToDelete.length === 0);
 
   return (
     <div className="file-upload-overlay">
@@ -226,9 +289,13 @@ function FileUpload({
                   <li key={file.name || index} className="file-item">
                      <span className="file-icon">📄</span>
                      <span className="file-name" title={file.name}>{file.name}</span>
+                     {uploadProgress[file.name] !== undefined && (
+                       <span className="upload-progress">{uploadProgress[file.name]}%</span>
+                     )}
                      <button
                        onClick={() => handleRemoveSelectedFile(file.name)}
                        className="remove-file-btn"
+                       disabled={isUploading}
                        aria-label={`Remove ${file.name}`}
                      >
                        &times;
@@ -268,7 +335,7 @@ function FileUpload({
                className="btn-primary action-btn"
                disabled={isSaveDisabled}
            >
-               Save Changes
+               {isUploading ? 'Uploading...' : 'Save Changes'}
            </button>
           <button onClick={onClose} className="btn-secondary action-btn">Close</button>
         </div>
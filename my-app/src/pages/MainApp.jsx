@@ -30,7 +30,32 @@ const MainApp = ({ uploadedFiles, handleFilesUpdate }) => {
         console.error('Network error clearing backend data on page load:', error);
       }
     };
-    clearDataOnLoad();
+
+    // In persistent storage mode the files uploaded before are kept; show them instead of clearing.
+    const restoreDataOnLoad = async () => {
+      try {
+        const response = await fetch('http://127.0.0.1:5000/api/storage');
+        const storage = await response.json();
+        if (!response.ok) {
+          console.error('Failed to read backend storage on page load:', storage.error);
+          return;
+        }
+        if (storage.mode === 'ephemeral') {
+          await clearDataOnLoad();
+          return;
+        }
+        if (storage.files.length > 0) {
+          handleFilesUpdate({ action: 'add', files: storage.files });
+        }
+        if (storage.needs_processing && storage.files.length > 0) {
+          console.log('Stored data is out of date, processing:', storage.problems);
+          handleProcessData();
+        }
+      } catch (error) {
+        console.error('Network error reading backend storage on page load:', error);
+      }
+    };
+    restoreDataOnLoad();
   }, []);
 
   const [selectedYear, setSelectedYear] = useState(new Date().getFullYear());
@@ -134,23 +159,38 @@ const MainApp = ({ uploadedFiles, handleFilesUpdate }) => {
       const response = await fetch('http://127.0.0.1:5000/api/process_data', {
         method: 'POST',
       });
+      const startData = await response.json();
 
-      let simulatedProgress = 0;
-      const progressInterval = setInterval(() => {
-          simulatedProgress += 10;
-          if (simulatedProgress <= 100) {
-              setProcessingProgress(simulatedProgress);
-          }
-      }, 200);
+      if (!response.ok) {
+        console.error('Processing failed to start:', startData.error);
+        setView('default');
+        alert(`Data processing failed: ${startData.error}`);
+        return;
+      }
 
-      const data = await response.json();
-      clearInterval(progressInterval);
-      setProcessingProgress(100);
+      // Processing runs as a background job; poll it for progress until it finishes.
+      let job;
+      while (true) {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const jobResponse = await fetch(`http://127.0.0.1:5000/api/jobs/${startData.job_id}`);
+        job = await jobResponse.json();
+        if (!jobResponse.ok) {
+          throw new Error(job.error || `Job status request failed with status ${jobResponse.status}`);
+        }
+        setProcessingProgress(Math.round(job.progress * 100));
+        if (['succeeded', 'failed', 'cancelled'].includes(job.state)) {
+          break;
+        }
+      }
 
-      if (response.ok) {
+      if (job.state === 'succeeded') {
+        const data = job.result;
         console.log('Processing successful:', data.message);
         console.log('Available years after processing:', data.available_years);
         console.log('Unprocessed files:', data.unprocessed_files);
+        if (data.parse_report && data.parse_report.warnings > 0) {
+          console.warn('Some lines could not be parsed:', data.parse_report.warning_counts, data.parse_report.files);
+        }
         const updatedAvailableYears = data.available_years || [];
         setAvailableYears(updatedAvailableYears);
         setUnprocessedFiles(data.unprocessed_files || []);
@@ -165,10 +205,13 @@ const MainApp = ({ uploadedFiles, handleFilesUpdate }) => {
             alert('Data processing complete, but no available years found. Please check uploaded files.');
         }
 
+      } else if (job.state === 'cancelled') {
+        console.warn('Processing was cancelled.');
+        setView('default');
       } else {
-        console.error('Processing failed:', data.error);
+        console.error('Processing failed:', job.error);
         setView('default');
-        alert(`Data processing failed: ${data.error}`);
+        alert(`Data processing failed: ${job.error}`);
       }
     } catch (error) {
       console.error('Network error during processing:', error);